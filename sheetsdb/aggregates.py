@@ -0,0 +1,144 @@
+class Aggregate:
+    """
+    Aggregate of the values of a column over the rows of a table, computed in a single pass by `Table.aggregate`.
+    Empty values are ignored.
+
+    An aggregate is computed by starting a state with `start`, stepping it with the value of each row with `step`,
+    and getting the result from the final state with `finish`.
+    """
+
+    # Column types that can be aggregated. None indicates all column types except json.
+    col_types = None
+
+    def __init__(self, col_name):
+        """
+        :type col_name: str
+        :param col_name: Column name to aggregate
+        """
+
+        if col_name is None:
+            raise ValueError('col_name is None')
+
+        self.col_name = col_name
+
+    def check_col_type(self, col_type):
+        """
+        Check that aggregate can be computed for a column type.
+
+        :type col_type: str
+        :param col_type: Type of column
+        """
+
+        if col_type == 'json' or (self.col_types is not None and col_type not in self.col_types):
+            raise ValueError('{} column type cannot be aggregated by {}'.format(col_type, type(self).__name__))
+
+    def start(self):
+        """
+        :rtype: Any
+        :return: State before any row
+        """
+
+        return None
+
+    def step(self, state, value):
+        """
+        :type state: Any
+        :param state: State before row
+        :type value: Any
+        :param value: Converted column value of row
+        :rtype: Any
+        :return: State after row
+        """
+
+        raise NotImplementedError()
+
+    def finish(self, state):
+        """
+        :type state: Any
+        :param state: State after all rows
+        :rtype: Any
+        :return: Result of aggregate
+        """
+
+        return state
+
+
+class Count(Aggregate):
+    """
+    Number of rows with non-empty values in a column, or number of rows if no column name is specified.
+    """
+
+    def __init__(self, col_name=None):
+        """
+        :type col_name: str
+        :param col_name: Column name to count non-empty values of. None counts all rows.
+        """
+
+        self.col_name = col_name
+
+    def start(self):
+        return 0
+
+    def step(self, state, value):
+        return state if value is None else state + 1
+
+
+class Sum(Aggregate):
+    """
+    Sum of values in a number column. None if there are no values.
+    """
+
+    col_types = ('number',)
+
+    def step(self, state, value):
+        if value is None:
+            return state
+        return value if state is None else state + value
+
+
+class Min(Aggregate):
+    """
+    Smallest value in a column. None if there are no values.
+    datetime values are compared as strings.
+    """
+
+    col_types = ('string', 'number', 'datetime')
+
+    def step(self, state, value):
+        if value is None:
+            return state
+        return value if state is None or value < state else state
+
+
+class Max(Aggregate):
+    """
+    Largest value in a column. None if there are no values.
+    datetime values are compared as strings.
+    """
+
+    col_types = ('string', 'number', 'datetime')
+
+    def step(self, state, value):
+        if value is None:
+            return state
+        return value if state is None or value > state else state
+
+
+class Avg(Aggregate):
+    """
+    Mean of values in a number column. None if there are no values.
+    """
+
+    col_types = ('number',)
+
+    def start(self):
+        # Sum and number of values
+        return 0.0, 0
+
+    def step(self, state, value):
+        if value is None:
+            return state
+        return state[0] + value, state[1] + 1
+
+    def finish(self, state):
+        return state[0] / state[1] if state[1] > 0 else None
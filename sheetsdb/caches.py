@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache that evicts the least recently used entry when it is full.
+    Entries can optionally expire after a timeout.
+    """
+
+    def __init__(self, max_size):
+        """
+        :type max_size: int
+        :param max_size: Maximum number of entries to keep. 0 or less disables caching.
+        """
+
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get the value cached for a key and mark it as most recently used.
+
+        :type key: hashable
+        :param key: Key to get value for
+        :type default: Any
+        :param default: Value to return if key is not cached
+        :rtype: Any
+        :return: Cached value, or default value if not cached
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return default
+            expiry, value = self._entries[key]
+            if expiry is not None and expiry <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """
+        Cache a value for a key, evicting the least recently used entries if cache is full.
+
+        :type key: hashable
+        :param key: Key to cache value for
+        :type value: Any
+        :param value: Value to cache
+        :type timeout: float
+        :param timeout: Seconds until value expires. None indicates value never expires.
+        """
+
+        if self.max_size <= 0:
+            return
+        expiry = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            self._entries[key] = (expiry, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove a key from cache.
+
+        :type key: hashable
+        :param key: Key to remove
+        :type default: Any
+        :param default: Value to return if key is not cached
+        :rtype: Any
+        :return: Removed value, or default value if not cached
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._entries.pop(key)[1]
+
+    def pop_matching(self, predicate):
+        """
+        Remove all keys that satisfy a predicate.
+
+        :type predicate: function
+        :param predicate: Function that takes a key and returns True if the key should be removed
+        :rtype: int
+        :return: Number of keys removed
+        """
+
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """
+        Remove all entries from cache.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RevisionCache:
+    """
+    Cache of values that are only valid for a revision of their source.
+    Values are cached in process, and optionally in a Django cache backend shared between processes.
+    """
+
+    def __init__(self, name, max_size, backend_alias=None):
+        """
+        :type name: str
+        :param name: Name of cache. Used as prefix of keys in Django cache backend.
+        :type max_size: int
+        :param max_size: Maximum number of values cached in process. 0 or less disables in process caching.
+        :type backend_alias: str
+        :param backend_alias: Alias of Django cache backend in `CACHES` setting. None disables the backend.
+        """
+
+        self.name = name
+        self.backend_alias = backend_alias
+        self._local_cache = LRUCache(max_size)
+
+    def is_enabled(self):
+        """
+        :rtype: bool
+        :return: Whether values can be cached
+        """
+
+        return self._local_cache.max_size > 0 or self.backend_alias is not None
+
+    def _get_backend_key(self, key):
+        return 'sheetsdb:{}:{}'.format(self.name, key)
+
+    def get(self, key, revision):
+        """
+        Get the value cached for a key, if it is cached for the same revision.
+
+        :type key: str
+        :param key: Key to get value for
+        :type revision: str
+        :param revision: Current revision of the source of value
+        :rtype: Any
+        :return: Cached value. None if not cached or cached for another revision.
+        """
+
+        entry = self._local_cache.get(key)
+        if (entry is None or entry[0] != revision) and self.backend_alias is not None:
+            entry = caches[self.backend_alias].get(self._get_backend_key(key))
+            if entry is not None:
+                self._local_cache.set(key, entry)
+        if entry is None or entry[0] != revision:
+            return None
+        return entry[1]
+
+    def set(self, key, revision, value):
+        """
+        Cache a value for a key and revision.
+
+        :type key: str
+        :param key: Key to cache value for
+        :type revision: str
+        :param revision: Revision of the source of value
+        :type value: Any
+        :param value: Value to cache
+        """
+
+        entry = (revision, value)
+        self._local_cache.set(key, entry)
+        if self.backend_alias is not None:
+            caches[self.backend_alias].set(self._get_backend_key(key), entry)
+
+    def invalidate(self, key):
+        """
+        Remove the value cached for a key.
+
+        :type key: str
+        :param key: Key to remove value for
+        """
+
+        self._local_cache.pop(key)
+        if self.backend_alias is not None:
+            caches[self.backend_alias].delete(self._get_backend_key(key))
+
+
+class ValueCache:
+    """
+    Cache of converted values of a table, keyed by (row ID, column index), that keeps at most a maximum number of
+    values. Not thread-safe, as it is used by a single table.
+    """
+
+    # Eviction policies
+    LRU = 'lru'
+    FIFO = 'fifo'
+
+    # Returned by `get` when value is not cached, as None is a valid converted value
+    MISSING = object()
+
+    def __init__(self, max_size, policy=LRU, col_types=('json',)):
+        """
+        :type max_size: int
+        :param max_size: Maximum number of values to keep
+        :type policy: str
+        :param policy: 'lru' to evict the least recently read value, 'fifo' to evict the earliest cached value
+        :type col_types: tuple
+        :param col_types: Types of columns whose values are cached
+        """
+
+        if policy not in (self.LRU, self.FIFO):
+            raise ValueError('Unrecognised value cache policy {}'.format(policy))
+
+        self.max_size = max_size
+        self.policy = policy
+        self.col_types = col_types
+        self._values = OrderedDict()
+
+    def get(self, row_id, col_index):
+        """
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_index: int
+        :param col_index: Index of column
+        :rtype: Any
+        :return: Cached value, or `ValueCache.MISSING` if not cached
+        """
+
+        key = (row_id, col_index)
+        value = self._values.get(key, self.MISSING)
+        if value is not self.MISSING and self.policy == self.LRU:
+            self._values.move_to_end(key)
+        return value
+
+    def set(self, row_id, col_index, value):
+        """
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_index: int
+        :param col_index: Index of column
+        :type value: Any
+        :param value: Converted value to cache
+        """
+
+        self._values[(row_id, col_index)] = value
+        if len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    def invalidate_row(self, row_id, num_cols):
+        """
+        Remove cached values of a row.
+
+        :type row_id: int
+        :param row_id: ID of row
+        :type num_cols: int
+        :param num_cols: Number of columns of table
+        """
+
+        for col_index in range(num_cols):
+            self._values.pop((row_id, col_index), None)
+
+    def clear(self):
+        """
+        Remove all cached values.
+        """
+
+        self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
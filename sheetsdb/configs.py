@@ -1,3 +1,5 @@
+import os
+
 from django.conf import settings
 
 META_SPREADSHEET_TITLE = 'sheetsdb/meta'
@@ -25,10 +27,12 @@ META_SPREADSHEET_COL_DEFS = [
     {
         'name': 'database_name',
         'type': 'string',
+        'index': 'hash',
     },
     {
         'name': 'table_name',
         'type': 'string',
+        'index': 'hash',
     },
     {
         'name': 'spreadsheet_id',
@@ -43,3 +47,111 @@ META_SPREADSHEET_COL_DEFS = [
 META_DATABASE_NAME = 'sheetsdb'
 
 META_TABLE_NAME = 'meta'
+
+# Maximum number of built Sheets/Drive service objects cached per process
+SERVICE_CACHE_SIZE = getattr(settings, 'SHEETSDB_SERVICE_CACHE_SIZE', 128)
+
+# Source of discovery documents used to build services.
+# 'static' uses the discovery documents bundled with sheetsdb, 'dynamic' lets googleapiclient resolve them.
+DISCOVERY_SOURCE = getattr(settings, 'SHEETSDB_DISCOVERY_SOURCE', 'static')
+
+DISCOVERY_DOCUMENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery')
+
+# Maximum number of keep-alive HTTP connections to Google APIs per worker process
+HTTP_POOL_SIZE = getattr(settings, 'SHEETSDB_HTTP_POOL_SIZE', 10)
+
+# Seconds to wait for a pooled HTTP connection to be available. None waits indefinitely.
+HTTP_POOL_TIMEOUT = getattr(settings, 'SHEETSDB_HTTP_POOL_TIMEOUT', None)
+
+# Socket timeout in seconds of HTTP connections to Google APIs. None uses the default socket timeout.
+HTTP_TIMEOUT = getattr(settings, 'SHEETSDB_HTTP_TIMEOUT', None)
+
+# Maximum number of attempts of a Google API request that fails with a retryable error. 1 disables retries.
+RETRY_MAX_ATTEMPTS = getattr(settings, 'SHEETSDB_RETRY_MAX_ATTEMPTS', 5)
+
+# Seconds to wait before the first retry. The wait doubles for each retry, with random jitter.
+RETRY_BASE_DELAY = getattr(settings, 'SHEETSDB_RETRY_BASE_DELAY', 1.0)
+
+# Maximum seconds to wait before a retry, including waits asked for by Retry-After
+RETRY_MAX_DELAY = getattr(settings, 'SHEETSDB_RETRY_MAX_DELAY', 32.0)
+
+# Sheets API read or write requests per minute allowed per process, matching the quota per project.
+# None disables the limit.
+RATE_LIMIT_PROJECT_PER_MINUTE = getattr(settings, 'SHEETSDB_RATE_LIMIT_PROJECT_PER_MINUTE', 300)
+
+# Sheets API read or write requests per minute allowed per user, matching the quota per user per project.
+# None disables the limit.
+RATE_LIMIT_USER_PER_MINUTE = getattr(settings, 'SHEETSDB_RATE_LIMIT_USER_PER_MINUTE', 60)
+
+# How tables commit changes to Google Sheets.
+# 'batch' sends updates, deletions and insertions in a single request that is applied atomically,
+# unless they write more than UPDATE_MAX_CELLS_PER_REQUEST cells.
+# 'values' sends them in up to 3 requests of the values API, with updates split by UPDATE_MAX_CELLS_PER_REQUEST.
+COMMIT_METHOD = getattr(settings, 'SHEETSDB_COMMIT_METHOD', 'batch')
+
+# Maximum number of cells updated or inserted per Sheets API request. Larger commits are split into multiple requests.
+UPDATE_MAX_CELLS_PER_REQUEST = getattr(settings, 'SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST', 50000)
+
+# Whether tables commit changes in the background by default. Requires 'batch' commit method.
+WRITE_BEHIND = getattr(settings, 'SHEETSDB_WRITE_BEHIND', False)
+
+# Maximum number of commits waiting to be written in the background per process
+WRITE_BEHIND_MAX_PENDING = getattr(settings, 'SHEETSDB_WRITE_BEHIND_MAX_PENDING', 100)
+
+# Seconds a commit waits to be queued when too many commits are pending. None waits indefinitely.
+WRITE_BEHIND_QUEUE_TIMEOUT = getattr(settings, 'SHEETSDB_WRITE_BEHIND_QUEUE_TIMEOUT', None)
+
+# Maximum number of pending commits written in a single Sheets API request
+WRITE_BEHIND_MAX_BATCH_SIZE = getattr(settings, 'SHEETSDB_WRITE_BEHIND_MAX_BATCH_SIZE', 50)
+
+# Seconds to wait for pending commits to be written when process exits. None waits indefinitely.
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = getattr(settings, 'SHEETSDB_WRITE_BEHIND_SHUTDOWN_TIMEOUT', 30)
+
+# Drive scopes that allow reading the revision of the meta spreadsheet, which cached meta tables are validated against
+DRIVE_METADATA_SCOPES = (
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/drive.readonly',
+    'https://www.googleapis.com/auth/drive.metadata',
+    'https://www.googleapis.com/auth/drive.metadata.readonly',
+)
+
+# Maximum number of meta tables cached per process. 0 disables caching of meta tables in process.
+# Disabled by default unless GOOGLE_API_SCOPES includes a scope that allows reading revisions.
+META_TABLE_CACHE_SIZE = getattr(
+    settings, 'SHEETSDB_META_TABLE_CACHE_SIZE',
+    64 if any(scope in DRIVE_METADATA_SCOPES for scope in getattr(settings, 'GOOGLE_API_SCOPES', [])) else 0)
+
+# Alias of Django cache backend to share cached meta tables between processes. None disables the backend.
+META_TABLE_CACHE_BACKEND = getattr(settings, 'SHEETSDB_META_TABLE_CACHE_BACKEND', None)
+
+# Seconds a user whose credentials are not allowed to read the revision of the meta spreadsheet is not asked again.
+# 0 asks every time.
+META_TABLE_REVISION_FORBIDDEN_TTL = getattr(settings, 'SHEETSDB_META_TABLE_REVISION_FORBIDDEN_TTL', 3600)
+
+# Maximum number of users not allowed to read the revision of the meta spreadsheet remembered per process
+META_TABLE_REVISION_FORBIDDEN_CACHE_SIZE = getattr(settings, 'SHEETSDB_META_TABLE_REVISION_FORBIDDEN_CACHE_SIZE', 1024)
+
+# Maximum number of users whose validated meta spreadsheets are cached per process
+META_SPREADSHEET_CACHE_SIZE = getattr(settings, 'SHEETSDB_META_SPREADSHEET_CACHE_SIZE', 1024)
+
+# Seconds a validated meta spreadsheet is reused without getting it from Sheets API again. 0 disables caching.
+META_SPREADSHEET_CACHE_TTL = getattr(settings, 'SHEETSDB_META_SPREADSHEET_CACHE_TTL', 300)
+
+# Seconds a meta spreadsheet that is not found is remembered as not found. 0 disables caching.
+META_SPREADSHEET_NOT_FOUND_CACHE_TTL = getattr(settings, 'SHEETSDB_META_SPREADSHEET_NOT_FOUND_CACHE_TTL', 30)
+
+# How tables store their rows in memory.
+# 'rows' stores rows of raw values and converts values when they are read.
+# 'columns' converts each column once into a typed container, which makes reads faster and uses less memory.
+TABLE_STORAGE = getattr(settings, 'SHEETSDB_TABLE_STORAGE', 'rows')
+
+# Maximum number of converted values cached per table with 'rows' storage. 0 disables caching.
+# Disabled by default, as cached json values are shared between reads and must not be modified.
+VALUE_CACHE_SIZE = getattr(settings, 'SHEETSDB_VALUE_CACHE_SIZE', 0)
+
+# Eviction policy of converted values cached per table. 'lru' or 'fifo'.
+VALUE_CACHE_POLICY = getattr(settings, 'SHEETSDB_VALUE_CACHE_POLICY', 'lru')
+
+# Types of columns whose converted values are cached. Only json values are cached by default,
+# as converting other types is about as fast as looking them up in cache.
+VALUE_CACHE_COL_TYPES = getattr(settings, 'SHEETSDB_VALUE_CACHE_COL_TYPES', ('json',))
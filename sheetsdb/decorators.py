@@ -5,10 +5,34 @@ from django.urls import reverse
 
 from . import configs
 from . import google_services
+from .caches import LRUCache
 from .sdk import SheetsdbSDK
 
 logger = logging.getLogger(__name__)
 
+# Validated meta spreadsheets, keyed by user primary key.
+# Each entry is a tuple of (meta spreadsheet ID, Google `Spreadsheet` resource or None if meta spreadsheet is
+# not found).
+_meta_spreadsheet_cache = LRUCache(configs.META_SPREADSHEET_CACHE_SIZE)
+
+
+def _cache_meta_spreadsheet(user, meta_spreadsheet_id, meta_spreadsheet):
+    timeout = (configs.META_SPREADSHEET_CACHE_TTL if meta_spreadsheet is not None
+               else configs.META_SPREADSHEET_NOT_FOUND_CACHE_TTL)
+    if timeout > 0:
+        _meta_spreadsheet_cache.set(user.pk, (meta_spreadsheet_id, meta_spreadsheet), timeout)
+
+
+def invalidate_meta_spreadsheet_cache(user):
+    """
+    Remove the validated meta spreadsheet cached for a user, e.g. after the meta spreadsheet ID of the user is updated.
+
+    :type user: django.contrib.auth.models.User
+    :param user: User to remove cached meta spreadsheet for
+    """
+
+    _meta_spreadsheet_cache.pop(user.pk)
+
 
 def require_meta_spreadsheet(view_func):
     """
@@ -18,6 +42,10 @@ def require_meta_spreadsheet(view_func):
         * `next` indicating the redirect URL when update is successful
         * `reason` indicating reason of error
 
+    A validated meta spreadsheet is cached per user for `SHEETSDB_META_SPREADSHEET_CACHE_TTL` seconds,
+    and a meta spreadsheet that is not found for `SHEETSDB_META_SPREADSHEET_NOT_FOUND_CACHE_TTL` seconds.
+    The cached meta spreadsheet is only used while it matches the meta spreadsheet ID of the user in DB.
+
     Only for advanced usage
     """
 
@@ -30,6 +58,17 @@ def require_meta_spreadsheet(view_func):
     def view_func_wrapper(request, **kwargs):
         user = request.user
 
+        # Entries cached before the meta spreadsheet ID of the user is changed, possibly by another process, are stale
+        cached = _meta_spreadsheet_cache.get(user.pk)
+        if cached is not None and hasattr(user, 'sheetsmetainfo') and \
+                cached[0] == user.sheetsmetainfo.meta_spreadsheet_id:
+            meta_spreadsheet_id, meta_spreadsheet = cached
+            if meta_spreadsheet is None:
+                reason = 'Meta spreadsheet {} not found'.format(meta_spreadsheet_id)
+                logger.error(reason)
+                return redirect_to_update_meta_spreadsheet_id(request, reason)
+            return view_func(request, meta_spreadsheet=meta_spreadsheet, **kwargs)
+
         if not hasattr(user, 'sheetsmetainfo'):
             # No meta spreadsheet information found, create one
             logger.info('Meta spreadsheet not found for user {} in DB. Creating one...', user.email)
@@ -40,6 +79,7 @@ def require_meta_spreadsheet(view_func):
                 return redirect_to_update_meta_spreadsheet_id(request, reason)
             else:
                 logger.info('Meta spreadsheet {} created'.format(meta_spreadsheet['spreadsheetId']))
+                _cache_meta_spreadsheet(user, meta_spreadsheet['spreadsheetId'], meta_spreadsheet)
 
         else:
             # Get meta spreadsheet info
@@ -50,6 +90,7 @@ def require_meta_spreadsheet(view_func):
             if error_status == 404:
                 reason = 'Meta spreadsheet {} not found'.format(meta_spreadsheet_id)
                 logger.error(reason)
+                _cache_meta_spreadsheet(user, meta_spreadsheet_id, None)
                 return redirect_to_update_meta_spreadsheet_id(request, reason)
             elif error_status is not None:
                 reason = 'Error when getting meta spreadsheet'
@@ -64,6 +105,8 @@ def require_meta_spreadsheet(view_func):
                 logger.error(reason)
                 return redirect_to_update_meta_spreadsheet_id(request, reason)
 
+            _cache_meta_spreadsheet(user, meta_spreadsheet_id, meta_spreadsheet)
+
         return view_func(request, meta_spreadsheet=meta_spreadsheet, **kwargs)
 
     return view_func_wrapper
@@ -1,13 +1,53 @@
+import email.utils
 import logging
-
-from googleapiclient.discovery import build
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import google.auth.credentials
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
 
 from . import configs
+from .caches import LRUCache
+from .http_pool import HttpPool
+from .rate_limit import RateLimiter
 from .models import SheetsMetaInfo
 
 logger = logging.getLogger(__name__)
 
+# Built service objects, keyed by (user primary key, API name, API version).
+# Each entry is a tuple of (credentials fingerprint, service).
+_service_cache = LRUCache(configs.SERVICE_CACHE_SIZE)
+
+# Bundled discovery documents, keyed by (API name, API version)
+_discovery_documents = {}
+_discovery_documents_lock = threading.Lock()
+
+# Keep-alive HTTP connections shared by all requests of the worker process
+_http_pool = HttpPool(configs.HTTP_POOL_SIZE, configs.HTTP_POOL_TIMEOUT, configs.HTTP_TIMEOUT)
+
+# HTTP statuses of errors that are retried for idempotent requests: rate limit exceeded and transient server errors
+_RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# HTTP statuses of errors that are retried for requests that are not idempotent, as the request is not applied
+_UNAPPLIED_STATUSES = frozenset([429])
+
+# Transport errors raised before a request is sent, which are retried for requests that are not idempotent
+_UNSENT_ERRORS = (ConnectionRefusedError, httplib2.ServerNotFoundError)
+
+# Limits Sheets API requests of all threads of the worker process to the per-minute quotas
+_rate_limiter = RateLimiter(configs.RATE_LIMIT_PROJECT_PER_MINUTE, configs.RATE_LIMIT_USER_PER_MINUTE)
+
+# Counters of Google API requests of the worker process. See `get_request_counters`.
+_request_counters = Counter()
+_request_counters_lock = threading.Lock()
+
 
 def get_bounded_range_values(user, spreadsheet_id,
                              start_row_index, start_col_index, end_row_index, end_col_index):
@@ -35,6 +75,7 @@ def get_bounded_range_values(user, spreadsheet_id,
     start_cell = _convert_to_a1(start_row_index, start_col_index)
     end_cell = _convert_to_a1(end_row_index, end_col_index)
     return _execute_request(
+        user,
         service.spreadsheets().values().get(spreadsheet_id=spreadsheet_id, range="{}:{}".format(start_cell, end_cell)))
 
 
@@ -59,6 +100,7 @@ def get_columns_values(user, spreadsheet_id, start_col_index, end_col_index):
     start_cell = _convert_to_a1(col_index=start_col_index)
     end_cell = _convert_to_a1(col_index=end_col_index)
     return _execute_request(
+        user,
         service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range="{}:{}".format(start_cell, end_cell)))
 
 
@@ -75,7 +117,27 @@ def get_spreadsheet(user, spreadsheet_id):
     """
     service = _build_sheets_service(user)
     return _execute_request(
-        service.spreadsheets().get(spreadsheetId=spreadsheet_id, includeGridData=False))
+        user, service.spreadsheets().get(spreadsheetId=spreadsheet_id, includeGridData=False))
+
+
+def get_file_revision(user, file_id):
+    """
+    Get the revision of a file in Google Drive. The revision changes whenever the file is modified.
+    Requires a Drive scope that allows reading file metadata,
+    e.g. `https://www.googleapis.com/auth/drive.metadata.readonly`
+
+    :type user: django.contrib.auth.models.User
+    :param user: User of file
+    :type file_id: str
+    :param file_id: ID of file, which is the spreadsheet ID for spreadsheets
+    :rtype: str, int
+    :return: Revision of file, error_status (None indicates no error)
+    """
+    service = _build_drive_service(user)
+    file, error_status = _execute_request(user, service.files().get(fileId=file_id, fields='version'))
+    if error_status is not None:
+        return None, error_status
+    return file['version'], None
 
 
 def create_meta_spreadsheet(user):
@@ -88,7 +150,8 @@ def create_meta_spreadsheet(user):
     :return: Created meta spreadsheet, error_status (None indicates no error)
     """
     service = _build_sheets_service(user)
-    meta_spreadsheet, error_status = _execute_request(service.spreadsheets().create(body=configs.META_SPREADSHEET_BODY))
+    meta_spreadsheet, error_status = _execute_request(
+        user, service.spreadsheets().create(body=configs.META_SPREADSHEET_BODY))
     if error_status is None:
         SheetsMetaInfo(user=user, meta_spreadsheet_id=meta_spreadsheet['spreadsheetId']).save()
     return meta_spreadsheet, error_status
@@ -143,7 +206,7 @@ def insert_rows(user, spreadsheet_id, rows_data):
 
     service = _build_sheets_service(user)
     return _execute_request(
-        service.spreadsheets().values().append(
+        user, service.spreadsheets().values().append(
             spreadsheetId=spreadsheet_id,
             range=fixed_range,
             includeValuesInResponse=False,
@@ -160,13 +223,22 @@ def update_rows(user, spreadsheet_id, rows_data):
         [
             {
                 'index': row_index,
-                'values': [col_0_value, col_1_value, ... ],
+                'start_col_index': col_s_index,
+                'values': [col_s_value, col_s+1_value, ... ],
             },
             ...
         ]
 
-    Update of values starts from column 0 onwards.
-    So ensure that 'values' contains values from all columns including the values that are not updated.
+    Update of values starts from column 'start_col_index' onwards, or column 0 if 'start_col_index' is not specified.
+    So ensure that 'values' contains values of all columns from the start column to the last updated column,
+    including the values that are not updated. A row can be specified more than once to update separate cells.
+
+    Rows with continuous row indexes that update the same columns are combined into a single range, and ranges with
+    more cells than `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST` are split by rows.
+    Ranges are sent in as many requests as needed to keep each request within `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST`
+    cells. Responses of requests are combined into a single `BatchUpdateValuesResponse`.
+    If a request fails, requests after it are not sent, and the combined response of the successful requests is
+    returned with the error status.
 
     Empty values should be specified as None or "".
 
@@ -189,26 +261,158 @@ def update_rows(user, spreadsheet_id, rows_data):
         logger.debug('No rows to update')
         return None, None
 
-    update_value_ranges = [
-        {
-            'majorDimension': 'ROWS',
-            'range': '{}:{}'.format(
-                _convert_to_a1(row_data['index'], 0), _convert_to_a1(row_data['index'], len(row_data['values']) - 1)),
-            'values': [_clean_values(row_data['values'])]
-        } for row_data in rows_data
-    ]
-
-    request_body = {
-        'valueInputOption': 'RAW',
-        'includeValuesInResponse': False,
-        'responseValueRenderOption': 'UNFORMATTED_VALUE',
-        'responseDateTimeRenderOption': 'FORMATTED_STRING',
-        'data': update_value_ranges
-    }
+    update_value_ranges = []
+    for combined_range in _combine_rows_data(rows_data):
+        for start_row_index, start_col_index, values in _split_rows_range(*combined_range,
+                                                                          configs.UPDATE_MAX_CELLS_PER_REQUEST):
+            update_value_ranges.append({
+                'majorDimension': 'ROWS',
+                'range': '{}:{}'.format(_convert_to_a1(start_row_index, start_col_index),
+                                        _convert_to_a1(start_row_index + len(values) - 1,
+                                                       start_col_index + len(values[0]) - 1)),
+                'values': values
+            })
 
     service = _build_sheets_service(user)
-    return _execute_request(
-        service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body))
+    combined_response = None
+    for batch in _split_value_ranges(update_value_ranges, configs.UPDATE_MAX_CELLS_PER_REQUEST):
+        request_body = {
+            'valueInputOption': 'RAW',
+            'includeValuesInResponse': False,
+            'responseValueRenderOption': 'UNFORMATTED_VALUE',
+            'responseDateTimeRenderOption': 'FORMATTED_STRING',
+            'data': batch
+        }
+        # Writing the same values to the same ranges again leaves the same result, so the request can be retried
+        response, error_status = _execute_request(
+            user, service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body),
+            idempotent=True)
+        if error_status is not None:
+            return combined_response, error_status
+        combined_response = _combine_update_responses(combined_response, response)
+
+    return combined_response, None
+
+
+def _combine_rows_data(rows_data):
+    """
+    Combine rows data of `update_rows` with continuous row indexes that update the same columns into rectangles.
+
+    :type rows_data: list[dict]
+    :param rows_data: Rows data of `update_rows`
+    :rtype: list[tuple]
+    :return: List of tuples of (0-based start row index, 0-based start column index, list of cleaned row values)
+    """
+
+    rectangles = []
+    # Rows updating the same columns are next to each other, in the order of row index
+    sorted_rows_data = sorted(
+        rows_data,
+        key=lambda row_data: (row_data.get('start_col_index', 0), len(row_data['values']), row_data['index']))
+    for row_data in sorted_rows_data:
+        start_col_index = row_data.get('start_col_index', 0)
+        values = _clean_values(row_data['values'])
+        if len(rectangles) > 0:
+            prev_start_row_index, prev_start_col_index, prev_values = rectangles[-1]
+            if prev_start_col_index == start_col_index and len(prev_values[0]) == len(values) and \
+                    prev_start_row_index + len(prev_values) == row_data['index']:
+                prev_values.append(values)
+                continue
+        rectangles.append((row_data['index'], start_col_index, [values]))
+    return rectangles
+
+
+def _split_rows_range(start_row_index, start_col_index, values, max_cells):
+    """
+    Split a range of rows into ranges of at most a maximum number of cells, each of as many whole rows as fit.
+    A row with more cells than the maximum is a range by itself.
+
+    :type start_row_index: int
+    :param start_row_index: 0-based row index of first row of range
+    :type start_col_index: int
+    :param start_col_index: 0-based column index of first column of range
+    :type values: list[list]
+    :param values: Values of rows of range, all with the same number of values
+    :type max_cells: int
+    :param max_cells: Maximum number of cells per range
+    :rtype: list[tuple]
+    :return: List of tuples of (start row index, start column index, values) of ranges
+    """
+
+    num_rows_per_range = max(1, max_cells // len(values[0]))
+    return [(start_row_index + i, start_col_index, values[i:i + num_rows_per_range])
+            for i in range(0, len(values), num_rows_per_range)]
+
+
+def _split_value_ranges(value_ranges, max_cells):
+    """
+    Split value ranges into batches of at most a maximum number of cells. A value range with more cells than the
+    maximum is in a batch by itself, so ranges should be split by `_split_rows_range` first.
+
+    :type value_ranges: list[dict]
+    :param value_ranges: Google `ValueRange` resources
+    :type max_cells: int
+    :param max_cells: Maximum number of cells per batch
+    :rtype: list[list[dict]]
+    :return: Batches of value ranges
+    """
+
+    return _split_batches(value_ranges, max_cells,
+                          lambda value_range: len(value_range['values']) * len(value_range['values'][0]))
+
+
+def _split_batches(items, max_cells, count_cells):
+    """
+    Split items into consecutive batches of at most a maximum number of cells. An item with more cells than the
+    maximum is in a batch by itself.
+
+    :type items: list
+    :param items: Items to split, in order
+    :type max_cells: int
+    :param max_cells: Maximum number of cells per batch
+    :type count_cells: function
+    :param count_cells: Function that takes an item and returns its number of cells
+    :rtype: list[list]
+    :return: Batches of items, in order
+    """
+
+    batches = []
+    batch = []
+    num_batch_cells = 0
+    for item in items:
+        num_cells = count_cells(item)
+        if len(batch) > 0 and num_batch_cells + num_cells > max_cells:
+            batches.append(batch)
+            batch = []
+            num_batch_cells = 0
+        batch.append(item)
+        num_batch_cells += num_cells
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def _combine_update_responses(combined_response, response):
+    """
+    Combine a `BatchUpdateValuesResponse` into the combined response of previous requests.
+
+    :type combined_response: dict
+    :param combined_response: Combined response of previous requests. None if there is no previous request.
+    :type response: dict
+    :param response: Response to combine
+    :rtype: dict
+    :return: Combined response
+    """
+
+    if combined_response is None:
+        return dict(response, responses=list(response.get('responses', [])))
+
+    for key in ('totalUpdatedRows', 'totalUpdatedColumns', 'totalUpdatedCells'):
+        combined_response[key] = combined_response.get(key, 0) + response.get(key, 0)
+    combined_response['totalUpdatedSheets'] = max(combined_response.get('totalUpdatedSheets', 0),
+                                                  response.get('totalUpdatedSheets', 0))
+    combined_response['responses'].extend(response.get('responses', []))
+    return combined_response
 
 
 def delete_rows(user, spreadsheet_id, row_indexes_set):
@@ -234,42 +438,10 @@ def delete_rows(user, spreadsheet_id, row_indexes_set):
         return None, None
 
     # Split row index into lists of continuous indexes
-    row_indexes_list = list(row_indexes_set)
-    if len(row_indexes_list) > 1:
-        row_indexes_list = sorted(row_indexes_list)
-        continuous_row_indexes = []
-        prev_index = row_indexes_list[0]
-        continuous = [prev_index]
-        for curr_index in row_indexes_list[1:]:
-            if prev_index == curr_index - 1:
-                continuous.append(curr_index)
-            else:
-                continuous_row_indexes.append(continuous)
-                continuous = [curr_index]
-            prev_index = curr_index
-        continuous_row_indexes.append(continuous)
-    else:
-        continuous_row_indexes = [row_indexes_list]
-
-    delete_ranges = [
-        {
-            # Delete from the first sheet in the spreadsheet. Each spreadsheet should only have 1 sheet.
-            'sheetId': 0,
-            'dimension': 'ROWS',
-            # Inclusive
-            'startIndex': continuous[0],
-            # Exclusive
-            'endIndex': continuous[len(continuous) - 1] + 1,
-        } for continuous in continuous_row_indexes]
+    continuous_row_indexes = _split_continuous_indexes(row_indexes_set)
 
     request_body = {
-        'requests': [
-            {
-                'deleteDimension': {
-                    'range': delete_range
-                }
-            } for delete_range in delete_ranges
-        ],
+        'requests': _get_delete_requests(continuous_row_indexes),
         'includeSpreadsheetInResponse': False,
         'responseIncludeGridData': False,
         'responseRanges': []
@@ -277,7 +449,244 @@ def delete_rows(user, spreadsheet_id, row_indexes_set):
 
     service = _build_sheets_service(user)
     return _execute_request(
-        service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body))
+        user, service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body))
+
+
+def commit_changes(user, spreadsheet_id, updated_rows_data, deleted_row_indexes_set, inserted_rows_data):
+    """
+    Update, delete and insert rows in a single Sheets API request, which is applied atomically:
+    either all changes are applied or none are. Changes of more cells than `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST`
+    are split into several requests as by `commit_many_changes`, which are only atomic one by one.
+
+    Rows are updated first, then deleted, then inserted, so row indexes of updated and deleted rows are 0-based row
+    indexes before any change.
+
+    :type user: django.contrib.auth.models.User
+    :param user: User of spreadsheet
+    :type spreadsheet_id: str
+    :param spreadsheet_id: Spreadsheet ID of spreadsheet to commit changes to
+    :type updated_rows_data: list[dict]
+    :param updated_rows_data: Rows to update, in the form of rows data of `update_rows`
+    :type deleted_row_indexes_set: set
+    :param deleted_row_indexes_set: Set of 0-based row indexes to delete
+    :type inserted_rows_data: list[list]
+    :param inserted_rows_data: Rows to append, in the form of rows data of `insert_rows`
+    :return: Response, error_status (None indicates no error)
+    """
+
+    return commit_many_changes(user, spreadsheet_id, [(updated_rows_data, deleted_row_indexes_set, inserted_rows_data)])
+
+
+def commit_many_changes(user, spreadsheet_id, changes):
+    """
+    Commit several sets of changes, one after another, in a single Sheets API request, which is applied atomically.
+    Each set of changes is applied as by `commit_changes`, so its row indexes are 0-based row indexes after the
+    previous sets of changes are applied.
+
+    Changes of more cells than `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST` are sent in as many requests as needed, in
+    order, so rows are still deleted from the bottom up. If a request fails, requests after it are not sent, and the
+    changes of the requests before it stay applied. Replies of requests are combined into a single response.
+
+    :type user: django.contrib.auth.models.User
+    :param user: User of spreadsheet
+    :type spreadsheet_id: str
+    :param spreadsheet_id: Spreadsheet ID of spreadsheet to commit changes to
+    :type changes: list[tuple]
+    :param changes: List of tuples of (updated_rows_data, deleted_row_indexes_set, inserted_rows_data),
+        in the form of the arguments of `commit_changes`
+    :return: Response, error_status (None indicates no error)
+    """
+
+    if spreadsheet_id is None:
+        raise ValueError('spreadsheet_id is None')
+    if changes is None:
+        raise ValueError('changes is None')
+
+    requests = []
+    for updated_rows_data, deleted_row_indexes_set, inserted_rows_data in changes:
+        requests.extend(_get_commit_requests(updated_rows_data, deleted_row_indexes_set, inserted_rows_data))
+
+    if len(requests) == 0:
+        logger.debug('No changes to commit')
+        return None, None
+
+    service = _build_sheets_service(user)
+    combined_response = None
+    for batch in _split_commit_requests(requests, configs.UPDATE_MAX_CELLS_PER_REQUEST):
+        request_body = {
+            'requests': batch,
+            'includeSpreadsheetInResponse': False,
+            'responseIncludeGridData': False,
+            'responseRanges': []
+        }
+        response, error_status = _execute_request(
+            user, service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body))
+        if error_status is not None:
+            return combined_response, error_status
+        if combined_response is None:
+            combined_response = dict(response)
+        else:
+            combined_response['replies'] = combined_response.get('replies', []) + response.get('replies', [])
+    return combined_response, None
+
+
+def _get_commit_requests(updated_rows_data, deleted_row_indexes_set, inserted_rows_data):
+    """
+    Get the `batchUpdate` requests of a set of changes of `commit_changes`
+
+    :type updated_rows_data: list[dict]
+    :param updated_rows_data: Rows to update, in the form of rows data of `update_rows`
+    :type deleted_row_indexes_set: set
+    :param deleted_row_indexes_set: Set of 0-based row indexes to delete
+    :type inserted_rows_data: list[list]
+    :param inserted_rows_data: Rows to append, in the form of rows data of `insert_rows`
+    :rtype: list[dict]
+    :return: Requests, in the order they are applied
+    """
+
+    if updated_rows_data is None:
+        raise ValueError('updated_rows_data is None')
+    if deleted_row_indexes_set is None:
+        raise ValueError('deleted_row_indexes_set is None')
+    if inserted_rows_data is None:
+        raise ValueError('inserted_rows_data is None')
+
+    requests = [
+        {
+            'updateCells': {
+                'start': {
+                    'sheetId': 0,
+                    'rowIndex': start_row_index,
+                    'columnIndex': start_col_index,
+                },
+                'rows': [{'values': [_convert_to_cell_data(value) for value in row_values]} for row_values in values],
+                'fields': 'userEnteredValue',
+            }
+        } for start_row_index, start_col_index, values in _combine_rows_data(updated_rows_data)
+    ]
+    requests.extend(_get_delete_requests(_split_continuous_indexes(deleted_row_indexes_set)))
+    if len(inserted_rows_data) > 0:
+        requests.append({
+            'appendCells': {
+                'sheetId': 0,
+                'rows': [{'values': [_convert_to_cell_data(value) for value in row_values]}
+                         for row_values in inserted_rows_data],
+                'fields': 'userEnteredValue',
+            }
+        })
+    return requests
+
+
+def _split_commit_requests(requests, max_cells):
+    """
+    Split `batchUpdate` requests of commits into batches of at most a maximum number of cells, keeping their order.
+    Requests that write more cells than the maximum are split by rows first. A row with more cells than the maximum
+    is in a batch by itself.
+
+    :type requests: list[dict]
+    :param requests: Requests from `_get_commit_requests`, in the order they are applied
+    :type max_cells: int
+    :param max_cells: Maximum number of cells per batch
+    :rtype: list[list[dict]]
+    :return: Batches of requests, in the order they are applied
+    """
+
+    split_requests = []
+    for request in requests:
+        kind = 'updateCells' if 'updateCells' in request else 'appendCells' if 'appendCells' in request else None
+        if kind is None:
+            split_requests.append(request)
+            continue
+        body = request[kind]
+        rows = body['rows']
+        num_rows_per_request = max(1, max_cells // max(1, max(len(row['values']) for row in rows)))
+        for i in range(0, len(rows), num_rows_per_request):
+            split_body = dict(body, rows=rows[i:i + num_rows_per_request])
+            if kind == 'updateCells':
+                split_body['start'] = dict(body['start'], rowIndex=body['start']['rowIndex'] + i)
+            split_requests.append({kind: split_body})
+    return _split_batches(split_requests, max_cells, _count_request_cells)
+
+
+def _count_request_cells(request):
+    """
+    :type request: dict
+    :param request: Request from `_get_commit_requests`
+    :rtype: int
+    :return: Number of cells written by request. 0 for requests that do not write cells.
+    """
+
+    body = request.get('updateCells') or request.get('appendCells')
+    if body is None:
+        return 0
+    return sum(len(row['values']) for row in body['rows'])
+
+
+def _split_continuous_indexes(indexes):
+    """
+    Split indexes into lists of continuous indexes.
+
+    :type indexes: iterable
+    :param indexes: Indexes without repeats
+    :rtype: list[list[int]]
+    :return: Lists of continuous indexes, in ascending order
+    """
+
+    continuous_indexes = []
+    for index in sorted(indexes):
+        if len(continuous_indexes) > 0 and continuous_indexes[-1][-1] == index - 1:
+            continuous_indexes[-1].append(index)
+        else:
+            continuous_indexes.append([index])
+    return continuous_indexes
+
+
+def _get_delete_requests(continuous_row_indexes):
+    """
+    Get `deleteDimension` requests for lists of continuous row indexes.
+    Requests in a batch update are applied one after another, so rows are deleted from the bottom up,
+    so that deleting rows does not move rows that are not deleted yet.
+
+    :type continuous_row_indexes: list[list[int]]
+    :param continuous_row_indexes: Lists of continuous 0-based row indexes, in ascending order
+    :rtype: list[dict]
+    :return: Requests
+    """
+
+    return [
+        {
+            'deleteDimension': {
+                'range': {
+                    # Delete from the first sheet in the spreadsheet. Each spreadsheet should only have 1 sheet.
+                    'sheetId': 0,
+                    'dimension': 'ROWS',
+                    # Inclusive
+                    'startIndex': continuous[0],
+                    # Exclusive
+                    'endIndex': continuous[len(continuous) - 1] + 1,
+                }
+            }
+        } for continuous in reversed(continuous_row_indexes)
+    ]
+
+
+def _convert_to_cell_data(value):
+    """
+    Convert a value to a Google `CellData` resource, entered as is like the RAW value input option.
+
+    :type value: Any
+    :param value: Value to convert
+    :rtype: dict
+    :return: `CellData` resource. Empty values clear the cell.
+    """
+
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
 
 
 def _convert_to_a1(row_index=None, col_index=None):
@@ -330,21 +739,245 @@ def _clean_values(values):
     return [value if value is not None else '' for value in values]
 
 
-def _execute_request(api_request):
+def get_request_counters():
+    """
+    Get counters of Google API requests executed by the worker process, for monitoring:
+        'requests': Number of requests
+        'attempts': Number of attempts of requests, including retries
+        'retries': Number of retries
+        'retry_seconds': Seconds waited before retries
+        'throttled': Number of attempts delayed by rate limit
+        'throttled_seconds': Seconds attempts are delayed by rate limit
+        'errors': Number of requests that fail after all attempts
+        'transport_errors': Number of attempts that fail without a response
+        'status_<status>': Number of attempts that fail with each HTTP status, e.g. 'status_429'
+
+    :rtype: dict
+    :return: Counters. Counters that are 0 may be missing.
+    """
+    with _request_counters_lock:
+        return dict(_request_counters)
+
+
+def _count_request(counter, amount=1):
+    with _request_counters_lock:
+        _request_counters[counter] += amount
+
+
+def _execute_request(user, api_request, idempotent=None):
     """
-    Execute an API request
+    Execute an API request on a pooled HTTP connection.
+    Sheets API requests wait until they are within the per-minute quotas of project and user.
+    Idempotent requests that fail with a retryable HTTP status or without a response are retried with jittered
+    exponential backoff, waiting at least as long as Retry-After header asks for. Other requests may be applied
+    even if they fail, and are only retried if they are rate limited or fail before they are sent,
+    so that rows are not appended or deleted twice.
 
+    :type user: django.contrib.auth.models.User
+    :param user: User making request
     :param api_request: API request
+    :type idempotent: bool
+    :param idempotent: Whether request gives the same result if it is applied more than once.
+        Defaults to True for GET requests and False otherwise.
     :return: response, error_status (None indicates no error)
     """
-    response = None
-    error_status = None
+    if idempotent is None:
+        idempotent = api_request.method == 'GET'
+    retryable_statuses = _RETRYABLE_STATUSES if idempotent else _UNAPPLIED_STATUSES
+    retryable_errors = (OSError, httplib2.HttpLib2Error) if idempotent else _UNSENT_ERRORS
+    quota_kind = _get_quota_kind(api_request)
+    _count_request('requests')
+    attempt = 1
+    while True:
+        if quota_kind is not None:
+            throttled_seconds = _rate_limiter.acquire(user.pk, quota_kind)
+            if throttled_seconds > 0:
+                _count_request('throttled')
+                _count_request('throttled_seconds', throttled_seconds)
+        _count_request('attempts')
+
+        retry_after = None
+        try:
+            return _execute_attempt(api_request), None
+        except HttpError as http_error:
+            error_status = http_error.resp.status
+            _count_request('status_{}'.format(error_status))
+            if error_status not in retryable_statuses or attempt >= configs.RETRY_MAX_ATTEMPTS:
+                logger.exception('Error when executing request')
+                _count_request('errors')
+                return None, error_status
+            retry_after = _parse_retry_after(http_error.resp.get('retry-after'))
+            failure = 'error status {}'.format(error_status)
+        except (OSError, httplib2.HttpLib2Error) as transport_error:
+            _count_request('transport_errors')
+            if not isinstance(transport_error, retryable_errors) or attempt >= configs.RETRY_MAX_ATTEMPTS:
+                _count_request('errors')
+                raise
+            failure = 'no response ({})'.format(repr(transport_error))
+
+        delay = _get_retry_delay(attempt, retry_after)
+        logger.warning('Attempt {} of request failed with {}. Retrying in {:.1f} seconds'.format(
+            attempt, failure, delay))
+        _count_request('retries')
+        _count_request('retry_seconds', delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+def _execute_attempt(api_request):
+    """
+    Execute an API request once on a pooled HTTP connection
+
+    :param api_request: API request
+    :return: response
+    """
+    if not isinstance(api_request.http, AuthorizedHttp):
+        # Cannot attach credentials to a pooled connection. Execute on the connection of the service, which is not
+        # shared with other threads as such services are not cached.
+        return api_request.execute(http=api_request.http)
+
+    with _http_pool.checkout() as http:
+        return api_request.execute(http=AuthorizedHttp(api_request.http.credentials, http=http))
+
+
+def _get_quota_kind(api_request):
+    """
+    Get the Sheets API quota an API request counts towards
+
+    :param api_request: API request
+    :rtype: str
+    :return: 'read' or 'write'. None if request is not a Sheets API request.
+    """
+    if 'sheets.googleapis.com' not in api_request.uri:
+        return None
+    return 'read' if api_request.method == 'GET' else 'write'
+
+
+def _parse_retry_after(retry_after):
+    """
+    Parse the value of a Retry-After header, which is either seconds or a HTTP date
+
+    :type retry_after: str
+    :param retry_after: Value of header
+    :rtype: float
+    :return: Seconds to wait. None if value is missing or cannot be parsed.
+    """
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
     try:
-        response = api_request.execute()
-    except HttpError as http_error:
-        logger.exception('Error when executing request')
-        error_status = http_error.resp.status
-    return response, error_status
+        retry_datetime = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_datetime is None:
+        return None
+    if retry_datetime.tzinfo is None:
+        retry_datetime = retry_datetime.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_datetime - datetime.now(timezone.utc)).total_seconds())
+
+
+def _get_retry_delay(attempt, retry_after=None):
+    """
+    Get seconds to wait before retrying a request. The backoff doubles for each attempt, and a random half of it is
+    jittered so that requests that fail together are not retried together.
+
+    :type attempt: int
+    :param attempt: Number of attempts made
+    :type retry_after: float
+    :param retry_after: Seconds to wait asked for by Retry-After header. None if not asked for.
+    :rtype: float
+    :return: Seconds to wait, up to `SHEETSDB_RETRY_MAX_DELAY`
+    """
+    backoff = min(configs.RETRY_MAX_DELAY, configs.RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    delay = backoff / 2 + random.uniform(0, backoff / 2)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return min(configs.RETRY_MAX_DELAY, delay)
+
+
+def _get_credentials_fingerprint(credentials):
+    """
+    Get a value that changes whenever credentials are refreshed or replaced.
+
+    :param credentials: Credentials to get fingerprint for
+    :rtype: tuple
+    :return: Fingerprint of credentials
+    """
+    return getattr(credentials, 'token', None), getattr(credentials, 'refresh_token', None)
+
+
+def _get_service(user, service_name, version):
+    """
+    Get a service for a user from cache. The service is built and cached if it is not cached yet,
+    or if the credentials of the user has changed since the service was built.
+
+    Only services with `google.auth` credentials are cached, as their requests are executed on pooled connections.
+    Services with other credentials execute requests on their own `httplib2.Http` object, which is not thread-safe,
+    so they are built for every call and not shared between threads.
+
+    :param user: User to get service for
+    :type service_name: str
+    :param service_name: Name of API
+    :type version: str
+    :param version: Version of API
+    :return: service object
+    """
+    credentials = user.googlecreds.credentials
+    fingerprint = _get_credentials_fingerprint(credentials)
+    cache_key = (user.pk, service_name, version)
+    cached = _service_cache.get(cache_key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    if configs.DISCOVERY_SOURCE == 'static':
+        service = build_from_document(_get_discovery_document(service_name, version), credentials=credentials)
+    elif configs.DISCOVERY_SOURCE == 'dynamic':
+        service = build(service_name, version, credentials=credentials, cache_discovery=False)
+    else:
+        raise ValueError('Unrecognised discovery source {}'.format(configs.DISCOVERY_SOURCE))
+    if isinstance(credentials, google.auth.credentials.Credentials):
+        _service_cache.set(cache_key, (fingerprint, service))
+    return service
+
+
+def _get_discovery_document(service_name, version):
+    """
+    Get a discovery document bundled with sheetsdb. Documents are read from disk once per process.
+
+    :type service_name: str
+    :param service_name: Name of API
+    :type version: str
+    :param version: Version of API
+    :rtype: str
+    :return: Discovery document in JSON
+    """
+    key = (service_name, version)
+    document = _discovery_documents.get(key)
+    if document is None:
+        with _discovery_documents_lock:
+            document = _discovery_documents.get(key)
+            if document is None:
+                path = os.path.join(configs.DISCOVERY_DOCUMENTS_DIR, '{}.{}.json'.format(service_name, version))
+                with open(path, encoding='utf-8') as document_file:
+                    document = document_file.read()
+                _discovery_documents[key] = document
+    return document
+
+
+def invalidate_service_cache(user=None):
+    """
+    Remove cached services of a user, e.g. after the credentials of the user are revoked.
+
+    :type user: django.contrib.auth.models.User
+    :param user: User to remove cached services for. None removes cached services of all users.
+    """
+    if user is None:
+        _service_cache.clear()
+    else:
+        _service_cache.pop_matching(lambda cache_key: cache_key[0] == user.pk)
 
 
 def _build_sheets_service(user):
@@ -354,7 +987,7 @@ def _build_sheets_service(user):
     :param user: User to build service for
     :return: service object
     """
-    return build('sheets', 'v4', credentials=user.googlecreds.credentials)
+    return _get_service(user, 'sheets', 'v4')
 
 
 def _build_drive_service(user):
@@ -364,4 +997,4 @@ def _build_drive_service(user):
     :param user: User to build service for
     :return: service object
     """
-    return build('drive', 'v3', credentials=user.googlecreds.credentials)
+    return _get_service(user, 'drive', 'v3')
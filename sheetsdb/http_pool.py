@@ -0,0 +1,101 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import httplib2
+
+
+class HttpPoolTimeout(Exception):
+    """
+    Error raised when no HTTP connection in pool becomes available in time
+    """
+
+
+class HttpPool:
+    """
+    Bounded pool of keep-alive `httplib2.Http` objects shared by the threads of a worker process.
+    An `httplib2.Http` object keeps its connections open between requests, but is not thread-safe,
+    so each one is used by at most 1 thread at a time.
+    """
+
+    def __init__(self, max_size, checkout_timeout=None, http_timeout=None):
+        """
+        :type max_size: int
+        :param max_size: Maximum number of HTTP objects in pool
+        :type checkout_timeout: float
+        :param checkout_timeout: Seconds to wait for a HTTP object to be available. None waits indefinitely.
+        :type http_timeout: float
+        :param http_timeout: Socket timeout in seconds of HTTP objects. None uses the default socket timeout.
+        """
+
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.http_timeout = http_timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Last-in-first-out so that the most recently used connections, which are least likely to be closed by
+        # the server, are reused first
+        self._idle = queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(self.max_size)
+        self._pid = os.getpid()
+
+    def _ensure_owned_by_process(self):
+        # Connections must not be shared with a forked process, so a forked worker starts with an empty pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    @contextmanager
+    def checkout(self):
+        """
+        Check out a HTTP object for the duration of a `with` block. The HTTP object is returned to pool at the end
+        of the block, unless a transport error is raised in the block, in which case its connections are discarded.
+        Other errors, e.g. for error responses, leave the connections usable.
+
+        :rtype: httplib2.Http
+        :return: HTTP object
+        """
+
+        self._ensure_owned_by_process()
+        available = self._available
+        idle = self._idle
+        if not available.acquire(timeout=self.checkout_timeout):
+            raise HttpPoolTimeout('No HTTP connection available after {} seconds'.format(self.checkout_timeout))
+        try:
+            try:
+                http = idle.get_nowait()
+            except queue.Empty:
+                http = httplib2.Http(timeout=self.http_timeout)
+
+            is_broken = False
+            try:
+                yield http
+            except (OSError, httplib2.HttpLib2Error):
+                is_broken = True
+                raise
+            finally:
+                if is_broken:
+                    http.close()
+                else:
+                    idle.put(http)
+        finally:
+            available.release()
+
+    def clear(self):
+        """
+        Close all idle connections in pool.
+        """
+
+        while True:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            http.close()
@@ -0,0 +1,245 @@
+import bisect
+
+
+class HashIndex:
+    """
+    Index of the rows of a table by the value of a column, for equality lookups.
+    Rows are identified by row IDs assigned by the table.
+    """
+
+    kind = 'hash'
+
+    # Whether index can look up ranges of values
+    is_ordered = False
+
+    # Column types that can be indexed
+    col_types = ('string', 'number', 'datetime')
+
+    def __init__(self):
+        # Dict where key is column value and value is set of row IDs
+        self._row_ids = {}
+
+    def add(self, value, row_id):
+        """
+        Add a row to index.
+
+        :type value: Any
+        :param value: Column value of row
+        :type row_id: int
+        :param row_id: ID of row
+        """
+
+        row_ids = self._row_ids.get(value)
+        if row_ids is None:
+            self._row_ids[value] = {row_id}
+        else:
+            row_ids.add(row_id)
+
+    def add_many(self, values_and_row_ids):
+        """
+        Add many rows to index.
+
+        :type values_and_row_ids: iterable
+        :param values_and_row_ids: Iterable of tuples of (column value of row, ID of row)
+        """
+
+        for value, row_id in values_and_row_ids:
+            self.add(value, row_id)
+
+    def remove(self, value, row_id):
+        """
+        Remove a row from index.
+
+        :type value: Any
+        :param value: Column value of row when it was added
+        :type row_id: int
+        :param row_id: ID of row
+        """
+
+        row_ids = self._row_ids.get(value)
+        if row_ids is not None:
+            row_ids.discard(row_id)
+            if len(row_ids) == 0:
+                del self._row_ids[value]
+
+    def lookup(self, value):
+        """
+        Get rows with a column value.
+
+        :type value: Any
+        :param value: Column value to look up
+        :rtype: set
+        :return: IDs of rows with column value. Do not modify.
+        """
+
+        return self._row_ids.get(value, frozenset())
+
+    def remap(self, row_id_mapping):
+        """
+        Change the row IDs in index, e.g. after the table renumbers its rows.
+
+        :type row_id_mapping: dict
+        :param row_id_mapping: Dict where key is old row ID and value is new row ID.
+            Rows not in mapping are removed.
+        """
+
+        remapped = {}
+        for value, row_ids in self._row_ids.items():
+            new_row_ids = {row_id_mapping[row_id] for row_id in row_ids if row_id in row_id_mapping}
+            if len(new_row_ids) > 0:
+                remapped[value] = new_row_ids
+        self._row_ids = remapped
+
+
+class SortedIndex:
+    """
+    Index of the rows of a table sorted by the value of a column, for range and equality lookups.
+    Rows are identified by row IDs assigned by the table. Rows with empty values are not returned by lookups.
+    """
+
+    kind = 'sorted'
+
+    # Whether index can look up ranges of values
+    is_ordered = True
+
+    # Column types that can be indexed. Values of a column must be comparable to each other.
+    col_types = ('number', 'datetime')
+
+    def __init__(self):
+        # Sorted list of tuples of (column value, row ID), excluding empty values
+        self._entries = []
+
+    def add(self, value, row_id):
+        """
+        Add a row to index.
+
+        :type value: Any
+        :param value: Column value of row
+        :type row_id: int
+        :param row_id: ID of row
+        """
+
+        if value is not None:
+            bisect.insort(self._entries, (value, row_id))
+
+    def add_many(self, values_and_row_ids):
+        """
+        Add many rows to index. Faster than adding rows one by one, as entries are sorted once.
+
+        :type values_and_row_ids: iterable
+        :param values_and_row_ids: Iterable of tuples of (column value of row, ID of row)
+        """
+
+        self._entries.extend(entry for entry in values_and_row_ids if entry[0] is not None)
+        self._entries.sort()
+
+    def remove(self, value, row_id):
+        """
+        Remove a row from index.
+
+        :type value: Any
+        :param value: Column value of row when it was added
+        :type row_id: int
+        :param row_id: ID of row
+        """
+
+        if value is None:
+            return
+        entry = (value, row_id)
+        i = bisect.bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def lookup(self, value):
+        """
+        Get rows with a column value.
+
+        :type value: Any
+        :param value: Column value to look up
+        :rtype: set
+        :return: IDs of rows with column value. Empty if value cannot be compared with column values.
+        """
+
+        try:
+            return self.lookup_range(value, True, value, True)
+        except TypeError:
+            # A value of another type is never equal to column values, as in a scan
+            return set()
+
+    def lookup_range(self, lower=None, is_lower_inclusive=True, upper=None, is_upper_inclusive=True):
+        """
+        Get rows with a column value in a range.
+
+        :type lower: Any
+        :param lower: Lower bound of range. None indicates no lower bound.
+        :type is_lower_inclusive: bool
+        :param is_lower_inclusive: Whether lower bound is in range
+        :type upper: Any
+        :param upper: Upper bound of range. None indicates no upper bound.
+        :type is_upper_inclusive: bool
+        :param is_upper_inclusive: Whether upper bound is in range
+        :rtype: set
+        :return: IDs of rows with column value in range
+        :raises TypeError: If a bound cannot be compared with column values
+        """
+
+        entries = self._entries
+        # A tuple of only the value sorts before all entries with the value,
+        # and a tuple of the value and infinity sorts after all of them
+        if lower is None:
+            start = 0
+        elif is_lower_inclusive:
+            start = bisect.bisect_left(entries, (lower,))
+        else:
+            start = bisect.bisect_right(entries, (lower, float('inf')))
+        if upper is None:
+            end = len(entries)
+        elif is_upper_inclusive:
+            end = bisect.bisect_right(entries, (upper, float('inf')))
+        else:
+            end = bisect.bisect_left(entries, (upper,))
+        return {entries[i][1] for i in range(start, end)}
+
+    def iter_ordered(self, is_descending=False):
+        """
+        Iterate through rows in the order of their column values. Rows with the same value are in the order of
+        row IDs in both directions. Rows with empty values are not included.
+
+        :type is_descending: bool
+        :param is_descending: Whether to iterate from the largest value
+        :rtype: iterator
+        :return: Iterator of row IDs
+        """
+
+        entries = self._entries
+        if not is_descending:
+            for value, row_id in entries:
+                yield row_id
+            return
+
+        end = len(entries)
+        while end > 0:
+            # Find the start of the run of entries with the same value as the last entry before end
+            start = bisect.bisect_left(entries, (entries[end - 1][0],), 0, end)
+            for i in range(start, end):
+                yield entries[i][1]
+            end = start
+
+    def remap(self, row_id_mapping):
+        """
+        Change the row IDs in index, e.g. after the table renumbers its rows.
+        Mapping must keep the order of row IDs.
+
+        :type row_id_mapping: dict
+        :param row_id_mapping: Dict where key is old row ID and value is new row ID.
+            Rows not in mapping are removed.
+        """
+
+        self._entries = [(value, row_id_mapping[row_id]) for value, row_id in self._entries
+                         if row_id in row_id_mapping]
+
+
+INDEX_KINDS = {
+    HashIndex.kind: HashIndex,
+    SortedIndex.kind: SortedIndex,
+}
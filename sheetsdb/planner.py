@@ -0,0 +1,248 @@
+import math
+
+# Selectivities of where conditions when there are no column statistics
+DEFAULT_EQUAL_SELECTIVITY = 0.1
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+DEFAULT_PREFIX_SELECTIVITY = 0.1
+
+# Fraction of rows changed since statistics of a column were computed that makes them stale
+STATS_STALE_FRACTION = 0.1
+
+# Cost of getting a matching row ID from an index, relative to checking a where condition against a row
+INDEX_ROW_COST = 0.2
+
+
+class ColumnStats:
+    """
+    Statistics of the values of a column, used to estimate the selectivity of where conditions.
+    """
+
+    def __init__(self, num_rows, num_nulls, num_distinct, min_value, max_value):
+        """
+        :type num_rows: int
+        :param num_rows: Number of rows
+        :type num_nulls: int
+        :param num_nulls: Number of rows with empty values
+        :type num_distinct: int
+        :param num_distinct: Number of distinct non-empty values
+        :type min_value: Any
+        :param min_value: Smallest non-empty value. None if all values are empty.
+        :type max_value: Any
+        :param max_value: Largest non-empty value. None if all values are empty.
+        """
+
+        self.num_rows = num_rows
+        self.num_nulls = num_nulls
+        self.num_distinct = num_distinct
+        self.min_value = min_value
+        self.max_value = max_value
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Compute statistics of values in a single pass.
+
+        :type values: iterable
+        :param values: Converted values of column. Values must be hashable and comparable to each other.
+        :rtype: ColumnStats
+        :return: Statistics of values
+        """
+
+        num_rows = 0
+        num_nulls = 0
+        distinct_values = set()
+        for value in values:
+            num_rows += 1
+            if value is None:
+                num_nulls += 1
+            else:
+                distinct_values.add(value)
+        if len(distinct_values) == 0:
+            return cls(num_rows, num_nulls, 0, None, None)
+        return cls(num_rows, num_nulls, len(distinct_values), min(distinct_values), max(distinct_values))
+
+    @property
+    def non_null_fraction(self):
+        """
+        :rtype: float
+        :return: Fraction of rows with non-empty values
+        """
+
+        return 1.0 - self.num_nulls / self.num_rows if self.num_rows > 0 else 0.0
+
+    def estimate_equal_selectivity(self):
+        """
+        :rtype: float
+        :return: Estimated fraction of rows equal to a value, assuming values are evenly distributed
+        """
+
+        return self.non_null_fraction / self.num_distinct if self.num_distinct > 0 else 0.0
+
+    def estimate_range_selectivity(self, lower=None, upper=None):
+        """
+        :type lower: Any
+        :param lower: Lower bound of range. None indicates no lower bound.
+        :type upper: Any
+        :param upper: Upper bound of range. None indicates no upper bound.
+        :rtype: float
+        :return: Estimated fraction of rows in range. Interpolated between smallest and largest values for numbers.
+        """
+
+        if self.num_distinct == 0:
+            return 0.0
+        try:
+            if (lower is not None and lower > self.max_value) or (upper is not None and upper < self.min_value):
+                return 0.0
+            if isinstance(self.min_value, float):
+                if self.max_value == self.min_value:
+                    return self.non_null_fraction
+                start = self.min_value if lower is None else max(lower, self.min_value)
+                end = self.max_value if upper is None else min(upper, self.max_value)
+                return self.non_null_fraction * (end - start) / (self.max_value - self.min_value)
+        except TypeError:
+            # Bound is not comparable to values of column
+            pass
+        return self.non_null_fraction * DEFAULT_RANGE_SELECTIVITY
+
+
+class QueryPlan:
+    """
+    How rows that satisfy a list of where conditions are found:
+    where conditions answered by indexes are looked up, and the other where conditions are checked row by row
+    against the rows found by indexes, or against all rows if no index is used,
+    in the order of most selective and cheapest first.
+    """
+
+    def __init__(self, num_rows, index_lookups, scan_conditions):
+        """
+        :type num_rows: int
+        :param num_rows: Number of rows in table
+        :type index_lookups: list[tuple]
+        :param index_lookups: List of tuples of (where condition, IDs of rows from index)
+        :type scan_conditions: list[tuple]
+        :param scan_conditions: List of tuples of (where condition, estimated selectivity, estimated cost),
+            in the order they are checked
+        """
+
+        self.num_rows = num_rows
+        self.index_lookups = index_lookups
+        self.scan_conditions = scan_conditions
+
+    @property
+    def indexed_row_ids(self):
+        """
+        :rtype: set
+        :return: IDs of rows that satisfy where conditions answered by indexes. None if no index is used.
+        """
+
+        indexed_row_ids = None
+        for condition, row_ids in self.index_lookups:
+            indexed_row_ids = row_ids if indexed_row_ids is None else indexed_row_ids & row_ids
+        return indexed_row_ids
+
+    def explain(self):
+        """
+        Describe plan in the form:
+            {
+                'num_rows': Number of rows in table,
+                'index_lookups': [
+                    {
+                        'condition': Where condition,
+                        'num_rows': Number of rows from index,
+                    },
+                    ...
+                ],
+                'scan': 'index' if rows found by indexes are checked, 'table' if all rows are checked,
+                'scan_conditions': [
+                    {
+                        'condition': Where condition,
+                        'selectivity': Estimated fraction of rows that satisfy where condition,
+                        'cost': Estimated cost of checking where condition against a row,
+                    },
+                    ...
+                ],
+                'estimated_num_rows': Estimated number of rows that satisfy all where conditions,
+            }
+
+        :rtype: dict
+        :return: Description of plan
+        """
+
+        indexed_row_ids = self.indexed_row_ids
+        estimated_num_rows = self.num_rows if indexed_row_ids is None else len(indexed_row_ids)
+        for condition, selectivity, cost in self.scan_conditions:
+            estimated_num_rows *= selectivity
+
+        return {
+            'num_rows': self.num_rows,
+            'index_lookups': [{'condition': repr(condition), 'num_rows': len(row_ids)}
+                              for condition, row_ids in self.index_lookups],
+            'scan': 'table' if indexed_row_ids is None else 'index',
+            'scan_conditions': [{'condition': repr(condition), 'selectivity': selectivity, 'cost': cost}
+                                for condition, selectivity, cost in self.scan_conditions],
+            'estimated_num_rows': int(round(estimated_num_rows)),
+        }
+
+
+def plan_query(where_conditions, col_indexes, indexes, get_col_stats, num_rows, limit=None):
+    """
+    Plan how to find the rows that satisfy a list of where conditions.
+
+    A where condition is looked up in an index if it can be answered by one and it is estimated to be cheaper than
+    checking rows. Without limit, index lookups are always cheaper, as all rows are checked otherwise.
+    With limit, checking rows stops once limit is reached, so looking up a where condition that many rows satisfy
+    can be more expensive. That choice is made with default selectivities.
+
+    Statistics of columns are only used to order where conditions that are checked row by row, when there is more
+    than one and there is no limit. Computing statistics reads all rows, which costs no more than checking all rows,
+    but much more than checking rows until limit is reached.
+
+    :type where_conditions: list[sdk.Condition]
+    :param where_conditions: Where conditions to satisfy
+    :type col_indexes: dict
+    :param col_indexes: Mapping of column name to column index from `get_col_indexes`
+    :type indexes: dict
+    :param indexes: Indexes of table, keyed by column index
+    :type get_col_stats: function
+    :param get_col_stats: Function that takes a column name and returns its `ColumnStats`, or None if not available
+    :type num_rows: int
+    :param num_rows: Number of rows in table
+    :type limit: int
+    :param limit: Number of matching rows needed, in the order of rows in table. None indicates all rows are needed.
+    :rtype: QueryPlan
+    :return: Plan
+    """
+
+    index_lookups = []
+    scan_conditions = []
+    for condition in where_conditions:
+        if not condition.can_lookup_index(col_indexes, indexes):
+            scan_conditions.append(condition)
+            continue
+        if limit is not None:
+            selectivity = condition.estimate_selectivity(_get_no_col_stats)
+            cost = condition.estimate_cost()
+            # Rows checked until limit is reached, if no index is used
+            scan_cost = min(num_rows, limit / selectivity) * cost if selectivity > 0 else num_rows * cost
+            if num_rows * selectivity * INDEX_ROW_COST > scan_cost:
+                scan_conditions.append(condition)
+                continue
+        row_ids = condition.lookup_index(col_indexes, indexes)
+        if row_ids is None:
+            # Index cannot answer where condition for its values after all
+            scan_conditions.append(condition)
+            continue
+        index_lookups.append((condition, row_ids))
+
+    if len(scan_conditions) <= 1 or limit is not None:
+        # No where conditions to order, or not worth reading all rows to order them
+        get_col_stats = _get_no_col_stats
+    estimates = [(condition, condition.estimate_selectivity(get_col_stats), condition.estimate_cost())
+                 for condition in scan_conditions]
+    # Check where conditions that reject the most rows per cost first, so that later ones are checked less often
+    estimates.sort(key=lambda estimate: estimate[2] / (1.0 - estimate[1]) if estimate[1] < 1.0 else math.inf)
+    return QueryPlan(num_rows, index_lookups, estimates)
+
+
+def _get_no_col_stats(col_name):
+    return None
@@ -0,0 +1,126 @@
+import threading
+import time
+
+from .caches import LRUCache
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens are added at a constant rate up to a capacity, and each request takes 1 token,
+    waiting for one to be added if the bucket is empty.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :type rate: float
+        :param rate: Tokens added per second
+        :type capacity: float
+        :param capacity: Maximum number of tokens, i.e. the largest burst of requests allowed at once
+        """
+
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, which may not be added yet.
+
+        :rtype: float
+        :return: Seconds to wait until token is added. 0 if token is available now.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """
+    Limits requests to Google APIs to the per-minute quotas of Sheets API: a quota per project, which is shared by all
+    users of the process, and a quota per user. Read and write requests have separate quotas.
+
+    A request waits until it is within all quotas it counts towards. Buckets are shared by all threads of the process.
+    """
+
+    def __init__(self, project_requests_per_minute, user_requests_per_minute, max_users=1024):
+        """
+        :type project_requests_per_minute: int
+        :param project_requests_per_minute: Read or write requests per minute allowed per project. None disables limit.
+        :type user_requests_per_minute: int
+        :param user_requests_per_minute: Read or write requests per minute allowed per user. None disables limit.
+        :type max_users: int
+        :param max_users: Maximum number of users whose buckets are kept. Buckets of other users are recreated full.
+        """
+
+        self.project_requests_per_minute = project_requests_per_minute
+        self.user_requests_per_minute = user_requests_per_minute
+        self._project_buckets = {}
+        self._user_buckets = LRUCache(max_users)
+        self._lock = threading.Lock()
+
+    def _get_project_bucket(self, kind):
+        with self._lock:
+            bucket = self._project_buckets.get(kind)
+            if bucket is None:
+                bucket = self._project_buckets[kind] = _create_bucket(self.project_requests_per_minute)
+            return bucket
+
+    def _get_user_bucket(self, user_key, kind):
+        with self._lock:
+            bucket = self._user_buckets.get((user_key, kind))
+            if bucket is None:
+                bucket = _create_bucket(self.user_requests_per_minute)
+                self._user_buckets.set((user_key, kind), bucket)
+            return bucket
+
+    def reserve(self, user_key, kind):
+        """
+        Count a request towards the quotas of project and user.
+
+        :type user_key: hashable
+        :param user_key: Key of user making request. None counts request towards quota of project only.
+        :type kind: str
+        :param kind: 'read' or 'write'
+        :rtype: float
+        :return: Seconds to wait before making request
+        """
+
+        wait_seconds = 0.0
+        if self.project_requests_per_minute:
+            wait_seconds = self._get_project_bucket(kind).reserve()
+        if self.user_requests_per_minute and user_key is not None:
+            wait_seconds = max(wait_seconds, self._get_user_bucket(user_key, kind).reserve())
+        return wait_seconds
+
+    def acquire(self, user_key, kind):
+        """
+        Wait until a request is within the quotas of project and user.
+
+        :type user_key: hashable
+        :param user_key: Key of user making request. None counts request towards quota of project only.
+        :type kind: str
+        :param kind: 'read' or 'write'
+        :rtype: float
+        :return: Seconds waited
+        """
+
+        wait_seconds = self.reserve(user_key, kind)
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+        return wait_seconds
+
+
+def _create_bucket(requests_per_minute):
+    # A full bucket allows the requests of a whole minute at once, as quotas are counted per minute
+    return TokenBucket(requests_per_minute / 60.0, requests_per_minute)
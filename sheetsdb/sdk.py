@@ -1,26 +1,26 @@
-import json
+import heapq
+import itertools
 import logging
-
-from . import google_services
-from .configs import META_SPREADSHEET_COL_DEFS, META_DATABASE_NAME, META_TABLE_NAME
+import operator
+from collections import OrderedDict, namedtuple
+
+from . import google_services, write_behind
+from .caches import LRUCache, RevisionCache, ValueCache
+from .configs import META_SPREADSHEET_COL_DEFS, META_DATABASE_NAME, META_TABLE_NAME, META_TABLE_CACHE_SIZE, \
+    META_TABLE_CACHE_BACKEND, TABLE_STORAGE, VALUE_CACHE_SIZE, VALUE_CACHE_POLICY, VALUE_CACHE_COL_TYPES, \
+    COMMIT_METHOD, WRITE_BEHIND, META_TABLE_REVISION_FORBIDDEN_TTL, META_TABLE_REVISION_FORBIDDEN_CACHE_SIZE
+from .indexes import INDEX_KINDS
+from .planner import DEFAULT_EQUAL_SELECTIVITY, DEFAULT_RANGE_SELECTIVITY, DEFAULT_PREFIX_SELECTIVITY, \
+    STATS_STALE_FRACTION, ColumnStats, plan_query
+from .storage import STORAGE_KINDS, RowStorage, convert_to_value, get_or_default
 
 logger = logging.getLogger(__name__)
 
+# Values of meta spreadsheets, keyed by meta spreadsheet ID and validated against the revision of the meta spreadsheet
+_meta_table_cache = RevisionCache('meta_table', META_TABLE_CACHE_SIZE, META_TABLE_CACHE_BACKEND)
 
-def get_or_default(arr, index, default_value=None):
-    """
-    Get value at index from list. Return default value if index out of bound
-
-    :type arr: list
-    :param arr: List to get value from
-    :type index: int
-    :param index: Index to get value for
-    :type default_value: Any
-    :param default_value: Default value
-    :rtype: Any
-    :return: Value to get
-    """
-    return arr[index] if len(arr) > index else default_value
+# Primary keys of users whose credentials are not allowed to read revisions, so that they are not asked again
+_revision_forbidden_users = LRUCache(META_TABLE_REVISION_FORBIDDEN_CACHE_SIZE)
 
 
 def get_col_index(col_name, col_defs):
@@ -35,36 +35,21 @@ def get_col_index(col_name, col_defs):
     :return: Index of column. None if not found.
     """
 
-    return next(iter([i for i in range(len(col_defs)) if col_defs[i]['name'] == col_name]), None)
+    return next((i for i, col_def in enumerate(col_defs) if col_def['name'] == col_name), None)
 
 
-def convert_to_value(raw_value, value_type):
-    """
-    Convert raw values into the correct type.
-
-    :type raw_value: Any
-    :param raw_value: Raw value to convert
-    :type value_type: str
-    :param value_type: Type to convert raw value to
-    :rtype: Any
-    :return: Converted value
+def get_col_indexes(col_defs):
     """
+    Get a mapping of column name to index of column for all columns in a table.
+    Use it instead of `get_col_index` to look up many column names.
 
-    if raw_value is None or raw_value == '':
-        return None
+    :type col_defs: list[dict]
+    :param col_defs: Column definitions for table
+    :rtype: dict
+    :return: Dict where key is column name and value is index of column
+    """
 
-    if value_type == 'string':
-        return str(raw_value)
-    elif value_type == 'number':
-        return float(raw_value)
-    elif value_type == 'datetime':
-        # Simple string value for datetime for now
-        return str(raw_value)
-    elif value_type == 'json':
-        return json.loads(raw_value)
-    else:
-        logger.warning('Unrecognised value type {} when converting raw value'.format(value_type))
-        return raw_value
+    return {col_def['name']: i for i, col_def in enumerate(col_defs)}
 
 
 class SheetsdbSDKError(Exception):
@@ -76,6 +61,7 @@ class SheetsdbSDKError(Exception):
     SPREADSHEET_NOT_FOUND = 1
     UNEXPECTED_TABLE_RESULT = 2
     SHEETS_API_ERROR = 3
+    WRITE_BEHIND_ERROR = 4
 
     def __init__(self, message, error_code, source='Unknown'):
         """
@@ -116,23 +102,26 @@ class SheetsdbSDK:
         self._meta_spreadsheet = meta_spreadsheet
         self._tables = dict()
 
-    def _create_table_from_spreadsheet(self, spreadsheet_id, col_defs):
+    def _get_value_range(self, spreadsheet_id, col_defs):
         """
         Internal function.
 
-        Create a table IN MEMORY by reading an existing spreadsheet. No spreadsheet is created.
+        Get the values of all columns of a table from its spreadsheet, after commits to the spreadsheet that are
+        queued by write-behind in this process are written.
 
         :type spreadsheet_id: str
         :param spreadsheet_id: Spreadsheet ID containing table data
         :type col_defs: list[dict]
         :param col_defs: List of column definitions for table
-        :rtype: Table
-        :return: Created table
+        :rtype: Google `ValueRange` resource
+        :return: Table data
         """
 
+        # Row indexes of later commits must match the rows after queued commits
+        write_behind.flush(spreadsheet_id=spreadsheet_id)
         value_range, error_status = google_services.get_columns_values(self._user, spreadsheet_id, 0, len(col_defs) - 1)
         if error_status is None:
-            return Table(self._user, spreadsheet_id, value_range, col_defs)
+            return value_range
         elif error_status == 404:
             raise SheetsdbSDKError('Spreadsheet {} not found'.format(spreadsheet_id),
                                    SheetsdbSDKError.SPREADSHEET_NOT_FOUND, 'get_table_defs')
@@ -140,6 +129,61 @@ class SheetsdbSDK:
             raise SheetsdbSDKError('Sheets API error {}'.format(error_status),
                                    SheetsdbSDKError.SHEETS_API_ERROR, 'get_table_defs')
 
+    def _create_table_from_spreadsheet(self, spreadsheet_id, col_defs):
+        """
+        Internal function.
+
+        Create a table IN MEMORY by reading an existing spreadsheet. No spreadsheet is created.
+
+        :type spreadsheet_id: str
+        :param spreadsheet_id: Spreadsheet ID containing table data
+        :type col_defs: list[dict]
+        :param col_defs: List of column definitions for table
+        :rtype: Table
+        :return: Created table
+        """
+
+        return Table(self._user, spreadsheet_id, self._get_value_range(spreadsheet_id, col_defs), col_defs)
+
+    def _create_meta_table(self):
+        """
+        Internal function.
+
+        Create the meta table IN MEMORY by reading the meta spreadsheet.
+        Values of the meta spreadsheet are reused from cache if the meta spreadsheet is not modified since they were
+        cached. Committing the meta table invalidates the cached values.
+
+        :rtype: Table
+        :return: Created meta table
+        """
+
+        meta_spreadsheet_id = self.get_meta_spreadsheet_id()
+        # Revision only changes once queued commits are written
+        write_behind.flush(spreadsheet_id=meta_spreadsheet_id)
+
+        revision = None
+        if _meta_table_cache.is_enabled() and _revision_forbidden_users.get(self._user.pk) is None:
+            revision, error_status = google_services.get_file_revision(self._user, meta_spreadsheet_id)
+            if error_status == 403 and META_TABLE_REVISION_FORBIDDEN_TTL > 0:
+                # Credentials of user lack a Drive scope that allows reading revisions
+                _revision_forbidden_users.set(self._user.pk, True, META_TABLE_REVISION_FORBIDDEN_TTL)
+            if error_status is not None:
+                self._logger.warning('Error status {} when getting revision of meta spreadsheet {}. '
+                                     'Meta table is not cached.'.format(error_status, meta_spreadsheet_id))
+
+        values = _meta_table_cache.get(meta_spreadsheet_id, revision) if revision is not None else None
+        if values is None:
+            values = self._get_value_range(meta_spreadsheet_id, META_SPREADSHEET_COL_DEFS).get('values', [])
+            if revision is not None:
+                _meta_table_cache.set(meta_spreadsheet_id, revision, [list(row) for row in values])
+        else:
+            # Copy cached values as table modifies its rows in place
+            values = [list(row) for row in values]
+
+        return Table(self._user, meta_spreadsheet_id, {'majorDimension': 'ROWS', 'values': values},
+                     META_SPREADSHEET_COL_DEFS,
+                     on_commit=lambda table: _meta_table_cache.invalidate(meta_spreadsheet_id))
+
     def get_meta_spreadsheet_id(self):
         """
         :rtype: str
@@ -158,11 +202,7 @@ class SheetsdbSDK:
 
         if self._tables.get(META_DATABASE_NAME, {}).get(META_TABLE_NAME) is None:
             # Create table
-            meta_spreadsheet_id = self.get_meta_spreadsheet_id()
-            if not hasattr(self._tables, META_DATABASE_NAME):
-                self._tables[META_DATABASE_NAME] = {}
-            self._tables[META_DATABASE_NAME][META_TABLE_NAME] = self._create_table_from_spreadsheet(
-                meta_spreadsheet_id, META_SPREADSHEET_COL_DEFS)
+            self._tables.setdefault(META_DATABASE_NAME, {})[META_TABLE_NAME] = self._create_meta_table()
 
         return self._tables[META_DATABASE_NAME][META_TABLE_NAME]
 
@@ -190,9 +230,7 @@ class SheetsdbSDK:
                     'Expected 1 row for col_defs but got {}'.format(len(row_based_result)),
                     SheetsdbSDKError.UNEXPECTED_TABLE_RESULT, 'get_table')
             row = row_based_result[0]
-            if not hasattr(self._tables, database_name):
-                self._tables[database_name] = {}
-            self._tables[database_name][table_name] = self._create_table_from_spreadsheet(
+            self._tables.setdefault(database_name, {})[table_name] = self._create_table_from_spreadsheet(
                 row['spreadsheet_id'], row['col_defs'])
 
         return self._tables[database_name][table_name]
@@ -244,16 +282,63 @@ class SheetsdbSDK:
         return meta_table.select(['database_name', 'table_name', 'spreadsheet_id', 'col_defs'])
 
 
+# Converted value of an updated cell that cannot be converted, so it is never equal to the current value
+_UNCOMPARABLE = object()
+
+
+def _get_continuous_runs(sorted_indexes):
+    """
+    Split sorted indexes into runs of continuous indexes.
+
+    :type sorted_indexes: list[int]
+    :param sorted_indexes: Sorted indexes without repeats
+    :rtype: list[tuple]
+    :return: List of tuples of (first index of run, last index of run)
+    """
+
+    runs = []
+    for index in sorted_indexes:
+        if len(runs) > 0 and runs[-1][1] == index - 1:
+            runs[-1] = (runs[-1][0], index)
+        else:
+            runs.append((index, index))
+    return runs
+
+
+class _Descending:
+    """
+    Wrapper of a sort key that reverses its order, so that columns in descending order can be sorted in the same
+    pass as columns in ascending order.
+    """
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
 class Table:
     """
     Logical table entity for a database table.
     When created, it captures a Google `ValueRange` resource and stores it as the initial state of the table.
     Provides functions to operate on the table in memory and commit the changes to Google Sheets.
+
+    Internally, rows are identified by row IDs. The row ID of an initial row is its index in initial rows,
+    and the row ID of an inserted row is the number of initial rows plus its index in inserted rows.
+    Row IDs are renumbered when changes are committed.
     """
 
     _logger = logging.getLogger('{}.{}'.format(__name__, __qualname__))
 
-    def __init__(self, user, spreadsheet_id, value_range, col_defs):
+    def __init__(self, user, spreadsheet_id, value_range, col_defs, on_commit=None, storage=None,
+                 value_cache_size=None, value_cache_policy=None, commit_method=None,
+                 write_behind=None):
         """
         :type user: django.contrib.auth.models.User
         :param user: User of table. Used when committing changes.
@@ -262,7 +347,27 @@ class Table:
         :type value_range: Google `ValueRange` resource
         :param value_range: Table data
         :type col_defs: list[dict]
-        :param col_defs: List of column definitions for table
+        :param col_defs: List of column definitions for table.
+            A column definition can declare an index on the column with the 'index' key. See `create_index`.
+        :type on_commit: function
+        :param on_commit: Function called with the table after changes are committed to Google Sheets
+        :type storage: str
+        :param storage: How rows are stored in memory, 'rows' or 'columns'. See `storage.RowStorage` and
+            `storage.ColumnStorage`. Defaults to `SHEETSDB_TABLE_STORAGE` setting.
+        :type value_cache_size: int
+        :param value_cache_size: Maximum number of converted values cached with 'rows' storage. 0 disables caching.
+            Defaults to `SHEETSDB_VALUE_CACHE_SIZE` setting.
+        :type value_cache_policy: str
+        :param value_cache_policy: Eviction policy of cached converted values, 'lru' or 'fifo'.
+            Defaults to `SHEETSDB_VALUE_CACHE_POLICY` setting.
+        :type commit_method: str
+        :param commit_method: How changes are committed. 'batch' commits all changes in a single atomic request,
+            unless they write more than `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST` cells.
+            'values' commits updates, deletions and insertions in separate requests.
+            Defaults to `SHEETSDB_COMMIT_METHOD` setting.
+        :type write_behind: bool
+        :param write_behind: Whether changes are committed in the background. Requires 'batch' commit method.
+            See `commit`. Defaults to `SHEETSDB_WRITE_BEHIND` setting.
         """
 
         if user is None:
@@ -276,37 +381,498 @@ class Table:
         major_dimension = value_range.get('majorDimension')
         if not major_dimension == 'ROWS':
             raise ValueError('Wrong major dimension {}. Should be ROWS'.format(major_dimension))
+        storage_class = STORAGE_KINDS.get(storage or TABLE_STORAGE)
+        if storage_class is None:
+            raise ValueError('Unrecognised storage {}'.format(storage or TABLE_STORAGE))
+        commit_method = commit_method or COMMIT_METHOD
+        if commit_method not in ('batch', 'values'):
+            raise ValueError('Unrecognised commit method {}'.format(commit_method))
+        write_behind = write_behind if write_behind is not None else WRITE_BEHIND
+        if write_behind and commit_method != 'batch':
+            raise ValueError('Write-behind requires batch commit method')
 
         self.user = user
         self.spreadsheet_id = spreadsheet_id
-        self.col_defs = col_defs
-        self.col_names = [col_def['name'] for col_def in col_defs]
-        # Initial rows from spreadsheet
-        self.initial_rows = value_range.get('values', [])
-        # Rows that are inserted but not committed
-        self.inserted_rows = []
+        self.on_commit = on_commit
+        self.commit_method = commit_method
+        self.write_behind = write_behind
+        # Initial rows from spreadsheet and rows that are inserted but not committed
+        col_types = [col_def['type'] for col_def in col_defs]
+        if storage_class is RowStorage:
+            value_cache_size = value_cache_size if value_cache_size is not None else VALUE_CACHE_SIZE
+            value_cache = ValueCache(value_cache_size, value_cache_policy or VALUE_CACHE_POLICY,
+                                     VALUE_CACHE_COL_TYPES) if value_cache_size > 0 else None
+            self._storage = RowStorage(value_range.get('values', []), col_types, value_cache)
+        else:
+            self._storage = storage_class(value_range.get('values', []), col_types)
+        self._num_initial_rows = len(self._storage)
+        # Number of rows that are not deleted, kept up to date so that it is not counted by iterating rows
+        self._num_rows = self._num_initial_rows
         # Row indexes in initial rows that are deleted but not committed
         self.deleted_initial_row_indexes = set()
-        # Row indexes in initial rows that are updated but not committed
-        self.updated_initial_row_indexes = set()
+        # Row indexes in inserted rows that are deleted but not committed
+        self.deleted_inserted_row_indexes = set()
+        # Row indexes in initial rows that are updated but not committed,
+        # mapped to the set of column indexes of the cells that are changed
+        self.updated_initial_row_indexes = {}
+        # Indexes of table, keyed by column index
+        self._indexes = {}
+        # Statistics of columns for query planning, keyed by column index. Computed when first needed.
+        self._col_stats = {}
+        # Number of rows inserted, updated and deleted, to tell when statistics of columns are stale
+        self._num_changed_rows = 0
+        # Handle of last commit, which later commits are queued after with write-behind
+        self._commit_handle = None
+        # Types of columns that storage converts values to
+        self._col_types = col_types
+        self.col_defs = col_defs
 
-    def _get_effective_rows(self):
-        return [self.initial_rows[i] for i in range(len(self.initial_rows))
-                if i not in self.deleted_initial_row_indexes] + self.inserted_rows
+    @property
+    def col_defs(self):
+        """
+        :rtype: list[dict]
+        :return: List of column definitions for table
+        """
 
-    def _is_where_conditions_passed(self, row, where_conditions):
+        return self._col_defs
+
+    @col_defs.setter
+    def col_defs(self, col_defs):
+        col_types = [col_def['type'] for col_def in col_defs]
+        col_indexes = get_col_indexes(col_defs)
+        # Keep existing indexes on columns that are still defined, and add indexes declared in column definitions
+        index_kinds = {self.col_names[col_index]: index.kind for col_index, index in self._indexes.items()}
+        index_kinds.update({col_def['name']: col_def['index'] for col_def in col_defs if col_def.get('index')})
+
+        def get_column_reader(col_index):
+            if col_index < len(self._col_types) and self._col_types[col_index] == col_types[col_index]:
+                return self._storage.get_column_reader(col_index)
+            # Storage still converts column to its previous type
+            col_type = col_types[col_index]
+            return lambda row_id: convert_to_value(
+                get_or_default(self._storage.get_raw_row(row_id), col_index), col_type)
+
+        # Build all indexes before changing anything, so that an invalid definition leaves table unchanged
+        indexes = {}
+        for col_name, kind in index_kinds.items():
+            if col_name in col_indexes:
+                col_index, index = self._build_index(col_name, kind, col_indexes, col_types, get_column_reader)
+                indexes[col_index] = index
+
+        self._col_defs = col_defs
+        self.col_names = [col_def['name'] for col_def in col_defs]
+        self._col_types = col_types
+        self._col_indexes = col_indexes
+        self._col_stats = {}
+        self._storage.set_col_types(col_types)
+        self._indexes = indexes
+
+    @property
+    def initial_rows(self):
+        """
+        :rtype: list[list]
+        :return: Raw values of rows from spreadsheet, including rows that are deleted but not committed
         """
-        Check if a row satisfies all of a list of where conditions.
 
-        :type row: list
-        :param row: List of values in the order of column index
-        :type where_conditions: list[WhereCondition]
-        :param where_conditions: Where conditions to check
+        return [self._storage.get_raw_row(row_id) for row_id in range(self._num_initial_rows)]
+
+    @property
+    def inserted_rows(self):
+        """
+        :rtype: list[list]
+        :return: Raw values of rows that are inserted but not committed, including rows that are deleted
+        """
+
+        return [self._storage.get_raw_row(row_id) for row_id in range(self._num_initial_rows, len(self._storage))]
+
+    def get_col_index(self, col_name):
+        """
+        Get index of column for a column name in table.
+
+        :type col_name: str
+        :param col_name: Column name to get index for
+        :rtype: int
+        :return: Index of column. None if not found.
+        """
+
+        return self._col_indexes.get(col_name)
+
+    def _check_col_names(self, col_names, action):
+        """
+        Check that all column names are valid column names of table.
+
+        :type col_names: iterable
+        :param col_names: Column names to check
+        :type action: str
+        :param action: Description of action for error message
+        """
+
+        col_indexes = self._col_indexes
+        for col_name in col_names:
+            if col_name not in col_indexes:
+                raise ValueError('Invalid column name for {}'.format(action))
+
+    def _iter_effective_row_ids(self):
+        """
+        Iterate through rows that are not deleted, including inserted rows, in the order of rows in table.
+
+        :rtype: iterator
+        :return: Iterator of row IDs
+        """
+
+        num_initial_rows = self._num_initial_rows
+        deleted_initial_row_indexes = self.deleted_initial_row_indexes
+        for row_id in range(num_initial_rows):
+            if row_id not in deleted_initial_row_indexes:
+                yield row_id
+
+        deleted_inserted_row_indexes = self.deleted_inserted_row_indexes
+        for row_id in range(num_initial_rows, len(self._storage)):
+            if row_id - num_initial_rows not in deleted_inserted_row_indexes:
+                yield row_id
+
+    def create_index(self, col_name, kind='hash'):
+        """
+        Create an index on a column. Queries with where conditions on the column look up rows in the index
+        instead of checking every row. The index is kept up to date as rows are inserted, updated and deleted.
+
+        Indexes can also be declared in column definitions, e.g. {'name': ..., 'type': ..., 'index': 'hash'}
+
+        :type col_name: str
+        :param col_name: Column name to create index on
+        :type kind: str
+        :param kind: 'hash' for '=' where conditions.
+            'sorted' for '=', '<=', '<', '>', '>=' where conditions on number and datetime columns.
+        """
+
+        col_index, index = self._build_index(col_name, kind, self._col_indexes, self._col_types,
+                                             self._storage.get_column_reader)
+        self._indexes[col_index] = index
+
+    def _build_index(self, col_name, kind, col_indexes, col_types, get_column_reader):
+        """
+        Build an index on a column from the rows of table, without adding it to table.
+
+        :type col_name: str
+        :param col_name: Column name to build index on
+        :type kind: str
+        :param kind: Kind of index. See `create_index`.
+        :type col_indexes: dict
+        :param col_indexes: Mapping of column name to column index from `get_col_indexes`
+        :type col_types: list[str]
+        :param col_types: Types of columns, in the order of column index
+        :type get_column_reader: function
+        :param get_column_reader: Function that takes a column index and returns a function that reads the converted
+            values of column
+        :rtype: tuple
+        :return: Tuple of (column index, index)
+        """
+
+        col_index = col_indexes.get(col_name)
+        if col_index is None:
+            raise ValueError('Column name {} is not in column definitions'.format(col_name))
+        index_class = INDEX_KINDS.get(kind)
+        if index_class is None:
+            raise ValueError('Unrecognised index kind {}'.format(kind))
+        col_type = col_types[col_index]
+        if col_type not in index_class.col_types:
+            raise ValueError('{} column type cannot be indexed by {} index'.format(col_type, kind))
+
+        index = index_class()
+        read = get_column_reader(col_index)
+        index.add_many((read(row_id), row_id) for row_id in self._iter_effective_row_ids())
+        return col_index, index
+
+    def drop_index(self, col_name):
+        """
+        Drop the index on a column, if any.
+
+        :type col_name: str
+        :param col_name: Column name to drop index of
+        """
+
+        self._indexes.pop(self._col_indexes.get(col_name), None)
+
+    def _compile_where_conditions(self, where_conditions):
+        """
+        Compile a list of where conditions into predicates on row IDs that can be reused for all rows of a query.
+
+        :type where_conditions: list[Condition]
+        :param where_conditions: Where conditions to compile
+        :rtype: list[function]
+        :return: Compiled where conditions
+        """
+
+        return [condition.bind(self.col_defs, self._col_indexes, self._storage.get_column_reader)
+                for condition in where_conditions]
+
+    def _match_row_ids(self, where_conditions, limit=None, offset=0, order_by=None):
+        """
+        Get the rows that satisfy a list of where conditions, in the order of rows in table or in the order given.
+        Where conditions that can be answered by an index are looked up in the index instead of checked for every row.
+        Other where conditions are checked lazily as rows are iterated, so rows must not be deleted while iterating,
+        and no more rows are checked once limit is reached, unless rows are sorted.
+
+        :type where_conditions: list[Condition]
+        :param where_conditions: Where conditions to satisfy
+        :type limit: int
+        :param limit: Maximum number of rows. None indicates no limit.
+        :type offset: int
+        :param offset: Number of matching rows to skip
+        :type order_by: list[str]
+        :param order_by: Column names to order rows by. See `select`.
+        :rtype: iterator
+        :return: Iterator of row IDs
+        """
+
+        if limit is not None and limit < 0:
+            raise ValueError('limit must not be negative')
+        if offset < 0:
+            raise ValueError('offset must not be negative')
+
+        # Rows are checked until limit is reached, unless they are sorted
+        needed_rows = None if order_by or limit is None else offset + limit
+        indexed_row_ids, predicates = self._plan_where_conditions(where_conditions, needed_rows)
+        if order_by:
+            row_ids = self._order_row_ids(indexed_row_ids, predicates, self._resolve_order_by(order_by),
+                                          None if limit is None else offset + limit)
+        else:
+            row_ids = self._filter_row_ids(self._iter_candidate_row_ids(indexed_row_ids), predicates)
+        if limit is None and offset == 0:
+            return iter(row_ids)
+        return itertools.islice(row_ids, offset, None if limit is None else offset + limit)
+
+    def _get_col_stats(self, col_name):
+        """
+        Get the statistics of a column, computing them if they are not computed or are stale.
+
+        :type col_name: str
+        :param col_name: Column name
+        :rtype: planner.ColumnStats
+        :return: Statistics of column. None if column is not in table or is a json column.
+        """
+
+        col_index = self._col_indexes.get(col_name)
+        if col_index is None or self._col_types[col_index] == 'json':
+            return None
+
+        col_stats, num_changed_rows = self._col_stats.get(col_index, (None, 0))
+        if col_stats is None or \
+                self._num_changed_rows - num_changed_rows > STATS_STALE_FRACTION * max(col_stats.num_rows, 1):
+            read = self._storage.get_column_reader(col_index)
+            col_stats = ColumnStats.from_values(read(row_id) for row_id in self._iter_effective_row_ids())
+            self._col_stats[col_index] = (col_stats, self._num_changed_rows)
+        return col_stats
+
+    def _plan_query(self, where_conditions, needed_rows=None):
+        """
+        Plan how to find the rows that satisfy a list of where conditions. See `planner.plan_query`.
+
+        :type where_conditions: list[Condition]
+        :param where_conditions: Where conditions to satisfy
+        :type needed_rows: int
+        :param needed_rows: Number of matching rows needed, in the order of rows in table.
+            None indicates all rows are needed.
+        :rtype: planner.QueryPlan
+        :return: Plan
+        """
+
+        return plan_query(where_conditions, self._col_indexes, self._indexes, self._get_col_stats, self._num_rows,
+                          needed_rows)
+
+    def _plan_where_conditions(self, where_conditions, needed_rows=None):
+        """
+        Look up where conditions that are planned to be answered by an index, and compile the others
+        in the order they are planned to be checked.
+
+        :type where_conditions: list[Condition]
+        :param where_conditions: Where conditions to satisfy
+        :type needed_rows: int
+        :param needed_rows: Number of matching rows needed, in the order of rows in table.
+            None indicates all rows are needed.
+        :rtype: set, list[function]
+        :return: IDs of rows that satisfy indexed where conditions, or None if no where condition is indexed,
+            and compiled where conditions that are not indexed
+        """
+
+        plan = self._plan_query(where_conditions, needed_rows)
+        return plan.indexed_row_ids, self._compile_where_conditions(
+            [condition for condition, selectivity, cost in plan.scan_conditions])
+
+    def explain(self, where_conditions=list(), limit=None, offset=0, order_by=None):
+        """
+        Describe how a query with where conditions, limit, offset and order is run, without running it.
+        Where conditions answered by indexes are looked up to count their rows.
+
+        Returned description is in the form of `planner.QueryPlan.explain`, with the additional key:
+            'order': None if rows are in the order of rows in table,
+                'index' if rows are iterated in the order of a sorted index,
+                'top-k' if only the first rows up to limit are kept while rows are checked,
+                'sort' if all matching rows are sorted
+
+        :type where_conditions: list[Condition]
+        :param where_conditions: List of where conditions for query
+        :type limit: int
+        :param limit: Maximum number of rows to select. See `select`.
+        :type offset: int
+        :param offset: Number of matching rows to skip. See `select`.
+        :type order_by: list[str]
+        :param order_by: Column names to order rows by. See `select`.
+        :rtype: dict
+        :return: Description of query plan
+        """
+
+        needed_rows = None if order_by or limit is None else offset + limit
+        description = self._plan_query(where_conditions, needed_rows).explain()
+        if not order_by:
+            description['order'] = None
+        elif self._get_order_index(self._resolve_order_by(order_by)) is not None:
+            description['order'] = 'index'
+        else:
+            description['order'] = 'sort' if limit is None else 'top-k'
+        return description
+
+    def _iter_candidate_row_ids(self, indexed_row_ids):
+        """
+        :type indexed_row_ids: set
+        :param indexed_row_ids: IDs of rows that satisfy indexed where conditions.
+            None if no where condition is indexed.
+        :rtype: iterable
+        :return: IDs of rows that can satisfy where conditions, in the order of rows in table
+        """
+
+        if indexed_row_ids is None:
+            return self._iter_effective_row_ids()
+        return sorted(indexed_row_ids)
+
+    def _filter_row_ids(self, row_ids, predicates):
+        """
+        :type row_ids: iterable
+        :param row_ids: IDs of rows to filter
+        :type predicates: list[function]
+        :param predicates: Compiled where conditions
+        :rtype: iterable
+        :return: IDs of rows that satisfy all compiled where conditions, lazily filtered
+        """
+
+        if len(predicates) == 0:
+            return row_ids
+        return (row_id for row_id in row_ids if self._is_where_conditions_passed(row_id, predicates))
+
+    def _resolve_order_by(self, order_by):
+        """
+        :type order_by: list[str]
+        :param order_by: Column names to order rows by. See `select`.
+        :rtype: list[tuple]
+        :return: List of tuples of (column index, whether order is descending)
+        """
+
+        resolved = []
+        for col_name in order_by:
+            is_descending = col_name.startswith('-')
+            if is_descending:
+                col_name = col_name[1:]
+            col_index = self._col_indexes.get(col_name)
+            if col_index is None:
+                raise ValueError('Column name {} is not in column definitions'.format(col_name))
+            if self._col_types[col_index] == 'json':
+                raise ValueError('json column type cannot be used to order rows')
+            resolved.append((col_index, is_descending))
+        return resolved
+
+    def _get_order_index(self, order_by):
+        """
+        :type order_by: list[tuple]
+        :param order_by: List of tuples of (column index, whether order is descending)
+        :return: Sorted index that rows can be iterated in the order of. None if there is none.
+        """
+
+        if len(order_by) == 1:
+            index = self._indexes.get(order_by[0][0])
+            if index is not None and index.is_ordered:
+                return index
+        return None
+
+    def _order_row_ids(self, indexed_row_ids, predicates, order_by, limit):
+        """
+        Get the rows that satisfy where conditions, ordered by columns.
+        Rows with empty values are ordered last in both directions. Rows with the same values are in the order of rows
+        in table.
+
+        If rows are ordered by a single column with a sorted index, rows are iterated in the order of the index,
+        so no sorting is done and no more rows are checked once limit is reached.
+        Otherwise, if there is a limit, only the first rows up to limit are kept while rows are checked.
+
+        :type indexed_row_ids: set
+        :param indexed_row_ids: IDs of rows that satisfy indexed where conditions.
+            None if no where condition is indexed.
+        :type predicates: list[function]
+        :param predicates: Compiled where conditions that are not indexed
+        :type order_by: list[tuple]
+        :param order_by: List of tuples of (column index, whether order is descending)
+        :type limit: int
+        :param limit: Number of first rows needed. None indicates all rows are needed.
+        :rtype: iterable
+        :return: IDs of rows
+        """
+
+        index = self._get_order_index(order_by)
+        if index is not None:
+            col_index, is_descending = order_by[0]
+            return self._iter_index_ordered_row_ids(indexed_row_ids, predicates, col_index, index, is_descending)
+
+        readers = [(self._storage.get_column_reader(col_index), is_descending) for col_index, is_descending in order_by]
+
+        def get_sort_key(row_id):
+            sort_key = []
+            for read, is_descending in readers:
+                value = read(row_id)
+                if is_descending:
+                    # Empty values are smallest, which are last in descending order
+                    sort_key.append(_Descending((value is not None, value)))
+                else:
+                    sort_key.append((value is None, value))
+            return sort_key
+
+        row_ids = self._filter_row_ids(self._iter_candidate_row_ids(indexed_row_ids), predicates)
+        if limit is not None:
+            # Both are stable, so rows with the same values stay in the order of rows in table
+            return heapq.nsmallest(limit, row_ids, key=get_sort_key)
+        return sorted(row_ids, key=get_sort_key)
+
+    def _iter_index_ordered_row_ids(self, indexed_row_ids, predicates, col_index, index, is_descending):
+        """
+        Iterate through the rows that satisfy where conditions in the order of a sorted index,
+        followed by rows with empty values, which are not in index.
+        """
+
+        for row_id in index.iter_ordered(is_descending):
+            if (indexed_row_ids is None or row_id in indexed_row_ids) and \
+                    self._is_where_conditions_passed(row_id, predicates):
+                yield row_id
+
+        read = self._storage.get_column_reader(col_index)
+        for row_id in self._filter_row_ids(self._iter_candidate_row_ids(indexed_row_ids), predicates):
+            if read(row_id) is None:
+                yield row_id
+
+    @staticmethod
+    def _is_where_conditions_passed(row_id, predicates):
+        """
+        Check if a row satisfies all of a list of compiled where conditions.
+
+        :type row_id: int
+        :param row_id: ID of row
+        :type predicates: list[function]
+        :param predicates: Compiled where conditions to check
         :rtype: bool
         :return: True if row satisfies all where conditions specified
         """
 
-        return all([condition.is_pass(row, self.col_defs) for condition in where_conditions])
+        for predicate in predicates:
+            if not predicate(row_id):
+                return False
+        return True
 
     def num_rows(self):
         """
@@ -314,9 +880,9 @@ class Table:
         :return: Number of rows in table
         """
 
-        return len(self._get_effective_rows())
+        return self._num_rows
 
-    def select(self, col_names, where_conditions=list(), is_row_base=True):
+    def select(self, col_names, where_conditions=list(), is_row_base=True, limit=None, offset=0, order_by=None):
         """
         Select some data from table and return it as a row-based or column-based format.
 
@@ -350,46 +916,235 @@ class Table:
 
         :type col_names: list[str]
         :param col_names: List of valid column names to select
-        :type where_conditions: list[WhereCondition]
+        :type where_conditions: list[Condition]
         :param where_conditions: List of where conditions for query
         :type is_row_base: bool
         :param is_row_base: Whether result is row based. False indicated result is column-based.
+        :type limit: int
+        :param limit: Maximum number of rows to select. Rows after limit are not checked against where conditions.
+            None indicates no limit.
+        :type offset: int
+        :param offset: Number of matching rows to skip before selecting rows
+        :type order_by: list[str]
+        :param order_by: Column names to order rows by, e.g. ['name', '-created_datetime'].
+            A column name prefixed by '-' is in descending order. Empty values are ordered last in both directions.
+            json columns cannot be ordered. If not specified, rows are in the order of rows in table.
         :rtype: list or dict
         :return: Row-based or column-based result
 
         """
 
-        if not set(col_names).issubset(self.col_names):
-            raise ValueError('Invalid column name for select query')
+        self._check_col_names(col_names, 'select query')
 
         if len(col_names) == 0:
             self._logger.debug('No column name to select. Return empty result set')
             return [] if is_row_base else {}
 
-        # Construct effect rows by removing deleted rows and adding inserted rows
-        effective_rows = self._get_effective_rows()
-        filtered_rows = [row for row in effective_rows
-                         if self._is_where_conditions_passed(row, where_conditions)]
-        col_indexes = [get_col_index(col_name, self.col_defs) for col_name in col_names]
         if is_row_base:
-            result = []
-            for row in filtered_rows:
-                row_data = {}
-                for i in col_indexes:
-                    row_data[self.col_defs[i]['name']] = convert_to_value(
-                        get_or_default(row, i), self.col_defs[i]['type'])
-                result.append(row_data)
-        else:
-            result = {}
-            for i in col_indexes:
-                column_data = []
-                for row in filtered_rows:
-                    column_data.append(convert_to_value(
-                        get_or_default(row, i), self.col_defs[i]['type']))
-                result[self.col_defs[i]['name']] = column_data
+            return list(self.iter_select(col_names, where_conditions, limit=limit, offset=offset, order_by=order_by))
+
+        # Row IDs are iterated once per column
+        row_ids = list(self._match_row_ids(where_conditions, limit, offset, order_by))
+        result = {}
+        for col_name in col_names:
+            read = self._storage.get_column_reader(self._col_indexes[col_name])
+            result[col_name] = [read(row_id) for row_id in row_ids]
 
         return result
 
+    def iter_select(self, col_names, where_conditions=list(), batch_size=None, row_type='dict', limit=None, offset=0,
+                    order_by=None):
+        """
+        Select some data from table and iterate through it row by row, or in batches of rows.
+        Rows are matched and converted as they are iterated, so the first row is available without scanning the whole
+        table, and memory used does not grow with the number of rows selected.
+
+        **Note**: The table must not be modified while iterating.
+
+        :type col_names: list[str]
+        :param col_names: List of valid column names to select
+        :type where_conditions: list[Condition]
+        :param where_conditions: List of where conditions for query
+        :type batch_size: int
+        :param batch_size: Number of rows per batch. If specified, lists of up to batch size rows are yielded.
+            Otherwise, rows are yielded one by one.
+        :type row_type: str
+        :param row_type: Type of rows yielded.
+            'dict' for dicts where key is column name, as returned by `select`.
+            'tuple' for tuples of values in the order of column names.
+            'namedtuple' for named tuples with column names as field names.
+            Column names that are not valid field names are renamed to their position, e.g. '_0'.
+        :type limit: int
+        :param limit: Maximum number of rows to select. None indicates no limit.
+        :type offset: int
+        :param offset: Number of matching rows to skip before selecting rows
+        :type order_by: list[str]
+        :param order_by: Column names to order rows by. See `select`.
+        :rtype: iterator
+        :return: Iterator of rows, or of lists of rows if batch size is specified
+        """
+
+        self._check_col_names(col_names, 'select query')
+        if batch_size is not None and batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+
+        readers = [self._storage.get_column_reader(self._col_indexes[col_name]) for col_name in col_names]
+        if row_type == 'dict':
+            selected_cols = list(zip(col_names, readers))
+
+            def make_row(row_id):
+                return {col_name: read(row_id) for col_name, read in selected_cols}
+        elif row_type == 'tuple':
+            def make_row(row_id):
+                return tuple([read(row_id) for read in readers])
+        elif row_type == 'namedtuple':
+            row_class = namedtuple('Row', col_names, rename=True)
+            make_new_row = row_class._make
+
+            def make_row(row_id):
+                return make_new_row([read(row_id) for read in readers])
+        else:
+            raise ValueError('Unrecognised row type {}'.format(row_type))
+
+        return self._iter_rows(self._match_row_ids(where_conditions, limit, offset, order_by), make_row, batch_size)
+
+    def first(self, col_names, where_conditions=list(), order_by=None):
+        """
+        Select the first row that satisfies a list of where conditions. Rows after it are not checked,
+        unless rows are ordered.
+
+        :type col_names: list[str]
+        :param col_names: List of valid column names to select
+        :type where_conditions: list[Condition]
+        :param where_conditions: List of where conditions for query
+        :type order_by: list[str]
+        :param order_by: Column names to order rows by. See `select`.
+        :rtype: dict
+        :return: Row in the same format as a row of `select`. None if no row satisfies where conditions.
+        """
+
+        return next(self.iter_select(col_names, where_conditions, limit=1, order_by=order_by), None)
+
+    def exists(self, where_conditions=list()):
+        """
+        Check if any row satisfies a list of where conditions. Rows after the first matching row are not checked.
+
+        :type where_conditions: list[Condition]
+        :param where_conditions: List of where conditions for query
+        :rtype: bool
+        :return: Whether any row satisfies where conditions
+        """
+
+        return next(self._match_row_ids(where_conditions, limit=1), None) is not None
+
+    def aggregate(self, aggregates, where_conditions=list(), group_by=None):
+        """
+        Aggregate the values of columns over the rows that satisfy a list of where conditions, e.g.
+            table.aggregate({'total': Sum('amount'), 'count': Count()}, group_by=['category'])
+
+        Aggregates are computed in a single pass over the stored column values, without selecting rows.
+        See `aggregates` module for available aggregates.
+
+        If not grouped, returned data is:
+            {
+                aggregate_name_1: result,
+                ...
+            }
+
+        If grouped, returned data is a row per group, in the order that groups first appear in table:
+            [
+                {
+                    group_by_col_1: group_value,
+                    ...
+                    aggregate_name_1: result,
+                    ...
+                },
+
+                ...
+            ]
+
+        :type aggregates: dict
+        :param aggregates: Dict where key is name of result and value is `aggregates.Aggregate`
+        :type where_conditions: list[Condition]
+        :param where_conditions: List of where conditions for query
+        :type group_by: list[str]
+        :param group_by: Column names to group rows by. json columns cannot be grouped by.
+        :rtype: dict or list[dict]
+        :return: Results of aggregates, or results of aggregates per group
+        """
+
+        resolved_aggregates = []
+        for name, aggregate in aggregates.items():
+            if aggregate.col_name is None:
+                # Aggregate of rows, not of a column, so every row has a value
+                read = lambda row_id: True
+            else:
+                col_index = self._col_indexes.get(aggregate.col_name)
+                if col_index is None:
+                    raise ValueError('Column name {} is not in column definitions'.format(aggregate.col_name))
+                aggregate.check_col_type(self._col_types[col_index])
+                read = self._storage.get_column_reader(col_index)
+            resolved_aggregates.append((name, aggregate, read))
+
+        group_by = group_by or []
+        self._check_col_names(group_by, 'group by')
+        for col_name in group_by:
+            if self._col_types[self._col_indexes[col_name]] == 'json':
+                raise ValueError('json column type cannot be used to group rows')
+        group_readers = [self._storage.get_column_reader(self._col_indexes[col_name]) for col_name in group_by]
+
+        # States of aggregates, keyed by tuple of group values
+        group_states = OrderedDict()
+        if len(group_readers) == 0:
+            group_states[()] = [aggregate.start() for name, aggregate, read in resolved_aggregates]
+        steps = [(aggregate.step, read) for name, aggregate, read in resolved_aggregates]
+
+        for row_id in self._match_row_ids(where_conditions):
+            group = tuple([read(row_id) for read in group_readers])
+            states = group_states.get(group)
+            if states is None:
+                states = group_states[group] = [aggregate.start() for name, aggregate, read in resolved_aggregates]
+            for i, (step, read) in enumerate(steps):
+                states[i] = step(states[i], read(row_id))
+
+        results = []
+        for group, states in group_states.items():
+            result = dict(zip(group_by, group))
+            for (name, aggregate, read), state in zip(resolved_aggregates, states):
+                result[name] = aggregate.finish(state)
+            results.append(result)
+
+        return results if len(group_by) > 0 else results[0]
+
+    @staticmethod
+    def _iter_rows(row_ids, make_row, batch_size):
+        """
+        Iterate through rows made from row IDs, one by one or in batches.
+
+        :type row_ids: iterator
+        :param row_ids: Iterator of row IDs
+        :type make_row: function
+        :param make_row: Function that takes a row ID and returns a row
+        :type batch_size: int
+        :param batch_size: Number of rows per batch. None yields rows one by one.
+        :rtype: iterator
+        :return: Iterator of rows, or of lists of rows
+        """
+
+        if batch_size is None:
+            for row_id in row_ids:
+                yield make_row(row_id)
+            return
+
+        batch = []
+        for row_id in row_ids:
+            batch.append(make_row(row_id))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
     def insert(self, row_data):
         """
         Insert a row of data. Row data is in the form:
@@ -402,13 +1157,100 @@ class Table:
         :param row_data: A dict where key is a valid column name and value is the value to be inserted for that column.
             All column names must be valid.
             Not all column names need to be specified. Not specified columns names are set to None.
+            Raises if a value cannot be converted to the type of its column, in which case the row is not inserted.
+        """
+
+        self._check_col_names(row_data, 'row to insert')
+
+        raw_rows = [[row_data.get(col_name) for col_name in self.col_names]]
+        self._append_raw_rows(raw_rows, self._convert_raw_rows(raw_rows))
+
+    def insert_many(self, rows, chunk_size=None, progress_callback=None):
+        """
+        Insert many rows of data. Each row is either a dict in the form of row data of `insert`,
+        or a list or tuple of values in the order of columns. A list or tuple can have fewer values than columns,
+        in which case the remaining columns are set to None.
+
+        All rows are validated and their values converted to the types of columns before any row is inserted,
+        so no row is inserted if a row is invalid or has a value that cannot be converted.
+
+        If chunk size is specified, rows are committed in chunks of at most chunk size rows, with a request per chunk,
+        so that requests stay within Sheets API size limits. Other uncommitted changes are committed with the first
+        chunk. Otherwise, rows are committed by `commit` like rows inserted by `insert`.
+
+        :type rows: iterable
+        :param rows: Rows to insert
+        :type chunk_size: int
+        :param chunk_size: Number of rows committed per request. None indicates rows are not committed.
+        :type progress_callback: function
+        :param progress_callback: Function called after each chunk is committed, with the number of rows committed
+            so far and the total number of rows
         """
 
-        if not set(row_data.keys()).issubset(self.col_names):
-            raise ValueError('Invalid column name for row to insert')
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+
+        col_names = self.col_names
+        col_name_set = self._col_indexes.keys()
+        num_cols = len(col_names)
+        raw_rows = []
+        for row in rows:
+            if isinstance(row, dict):
+                if not col_name_set >= row.keys():
+                    raise ValueError('Invalid column name for row to insert')
+                raw_rows.append([row.get(col_name) for col_name in col_names])
+            else:
+                if isinstance(row, (str, bytes)):
+                    raise TypeError('Row to insert must be a dict, list or tuple, not {}'.format(type(row).__name__))
+                if len(row) > num_cols:
+                    raise ValueError('Row to insert has {} values but table has {} columns'.format(len(row), num_cols))
+                raw_rows.append(list(row) + [None] * (num_cols - len(row)))
+        index_values = self._convert_raw_rows(raw_rows)
+
+        if chunk_size is None:
+            self._append_raw_rows(raw_rows, index_values)
+            return
+
+        for start in range(0, len(raw_rows), chunk_size):
+            self._append_raw_rows(raw_rows[start:start + chunk_size], index_values[start:start + chunk_size])
+            self.commit()
+            if progress_callback is not None:
+                progress_callback(min(start + chunk_size, len(raw_rows)), len(raw_rows))
+
+    def _convert_raw_rows(self, raw_rows):
+        """
+        Convert the values of rows to insert, so that a value that cannot be converted raises before any row is
+        inserted.
+
+        :type raw_rows: list[list]
+        :param raw_rows: Raw values of rows, for all columns
+        :rtype: list[list]
+        :return: Converted values of indexed columns of rows, in the order of `self._indexes`
+        """
 
-        self.inserted_rows.append(
-            [row_data[col_def['name']] if col_def['name'] in row_data else None for col_def in self.col_defs])
+        col_types = self._col_types
+        indexed_col_indexes = list(self._indexes)
+        index_values = []
+        for raw_row in raw_rows:
+            values = [convert_to_value(raw_value, col_type) for raw_value, col_type in zip(raw_row, col_types)]
+            index_values.append([values[col_index] for col_index in indexed_col_indexes])
+        return index_values
+
+    def _append_raw_rows(self, raw_rows, index_values):
+        """
+        Append rows of raw values to storage, and add them to indexes.
+
+        :type raw_rows: list[list]
+        :param raw_rows: Raw values of rows, for all columns
+        :type index_values: list[list]
+        :param index_values: Converted values of indexed columns of rows, from `_convert_raw_rows`
+        """
+
+        row_ids = [self._storage.append(raw_row) for raw_row in raw_rows]
+        self._num_rows += len(row_ids)
+        self._num_changed_rows += len(row_ids)
+        for i, index in enumerate(self._indexes.values()):
+            index.add_many((values[i], row_id) for values, row_id in zip(index_values, row_ids))
 
     def update(self, row_data, where_conditions=list()):
         """
@@ -426,38 +1268,162 @@ class Table:
         :type row_data: dict
         :param row_data: A dict where key is a valid column name and value is the value to be updated for that column.
            All column names must be valid.
-        :type where_conditions: list[WhereCondition]
+        :type where_conditions: list[Condition]
         :param where_conditions: List of where conditions for query
         """
 
-        def update_rows(rows, row_indexes, col_defs):
-            for row_index in row_indexes:
-                row = rows[row_index]
-                for col_index in range(len(col_defs)):
-                    col_name = col_defs[col_index]['name']
-                    if col_name in row_data:
-                        row[col_index] = row_data[col_name]
+        self._check_col_names(row_data, 'row to update')
+        # Match all rows before updating any, as updating a row can change whether later rows match
+        self._update_row_ids(list(self._match_row_ids(where_conditions)), row_data)
 
-        if not set(row_data.keys()).issubset(self.col_names):
-            raise ValueError('Invalid column name for row to update')
+    def _update_row_ids(self, row_ids, row_data):
+        """
+        Update columns of some rows to the ones specified in row data. Values that are the same as the current values
+        are skipped.
 
-        # Update initial rows
-        matched_initial_row_indexes = [
-            i for i in range(len(self.initial_rows))
-            if (self._is_where_conditions_passed(self.initial_rows[i], where_conditions)
-                # Skip if row already deleted
-                and i not in self.deleted_initial_row_indexes)
-        ]
-        update_rows(self.initial_rows, matched_initial_row_indexes, self.col_defs)
-        # Add matched indexes to updated initial row indexes
-        self.updated_initial_row_indexes = self.updated_initial_row_indexes.union(set(matched_initial_row_indexes))
-
-        # Update inserted rows
-        matched_inserted_row_indexes = [
-            i for i in range(len(self.inserted_rows))
-            if self._is_where_conditions_passed(self.inserted_rows[i], where_conditions)
-        ]
-        update_rows(self.inserted_rows, matched_inserted_row_indexes, self.col_defs)
+        :type row_ids: list[int]
+        :param row_ids: IDs of rows to update
+        :type row_data: dict
+        :param row_data: A dict where key is a valid column name and value is the value to be updated for that column
+        :rtype: int
+        :return: Number of rows changed
+        """
+
+        # Tuples of (column index, raw value, converted value). Values are converted once, before anything is changed.
+        updated_values = []
+        for col_name, raw_value in row_data.items():
+            col_index = self._col_indexes[col_name]
+            try:
+                value = convert_to_value(raw_value, self._col_types[col_index])
+            except (ValueError, TypeError):
+                if col_index in self._indexes:
+                    # Indexed values must be converted to be added to index
+                    raise
+                # Cannot be compared with current value, so cell is always changed
+                value = _UNCOMPARABLE
+            updated_values.append((col_index, raw_value, value))
+
+        storage = self._storage
+        indexes = self._indexes
+        num_changed_rows = 0
+        for row_id in row_ids:
+            changed_values = [(col_index, raw_value, value) for col_index, raw_value, value in updated_values
+                              if self._is_value_changed(row_id, col_index, value)]
+            if len(changed_values) == 0:
+                # Writing same values is skipped, so row is not committed
+                continue
+
+            # Tuples of (index, current value, converted value), read before row is changed
+            index_changes = [(indexes[col_index], storage.get_value(row_id, col_index), value)
+                             for col_index, raw_value, value in changed_values if col_index in indexes]
+            # Indexes are changed after storage, so that they are unchanged if storage cannot set values
+            storage.set_values(row_id, [(col_index, raw_value) for col_index, raw_value, value in changed_values])
+            for index, current_value, value in index_changes:
+                index.remove(current_value, row_id)
+                index.add(value, row_id)
+            self._num_changed_rows += 1
+            num_changed_rows += 1
+            if row_id < self._num_initial_rows:
+                self.updated_initial_row_indexes.setdefault(row_id, set()).update(
+                    col_index for col_index, raw_value, value in changed_values)
+        return num_changed_rows
+
+    def upsert(self, rows, key_cols, commit=True):
+        """
+        Update rows with the same key as rows of data, and insert rows of data with keys that are not in table.
+        Rows of data are in the form of row data of `insert`, and must contain values of all key columns.
+        If rows of data have the same key, they are applied in order, so later ones update earlier ones.
+
+        Keys are looked up in an index if key is a single indexed column. Otherwise, rows are grouped by key in a
+        single pass over table. All changes are committed together at the end.
+
+        :type rows: iterable
+        :param rows: Rows of data to update or insert
+        :type key_cols: list[str]
+        :param key_cols: Column names whose values identify a row
+        :type commit: bool
+        :param commit: Whether to commit changes. If False, changes are committed by `commit`.
+        :rtype: int, int
+        :return: Number of rows changed by updates, number of rows inserted
+        """
+
+        if len(key_cols) == 0:
+            raise ValueError('No key column')
+        self._check_col_names(key_cols, 'upsert key')
+        key_col_indexes = [self._col_indexes[col_name] for col_name in key_cols]
+        for col_index in key_col_indexes:
+            if self._col_types[col_index] == 'json':
+                raise ValueError('json column type cannot be used as upsert key')
+
+        rows = list(rows)
+        keys = []
+        for row_data in rows:
+            self._check_col_names(row_data, 'row to upsert')
+            key = tuple([convert_to_value(row_data.get(col_name), self._col_types[col_index])
+                         for col_name, col_index in zip(key_cols, key_col_indexes)])
+            if None in key:
+                raise ValueError('Row to upsert has no value for key column')
+            keys.append(key)
+
+        index = self._indexes.get(key_col_indexes[0]) if len(key_col_indexes) == 1 else None
+        if index is not None:
+            # Index is kept up to date as rows are inserted, so no other lookup is needed
+            def lookup(key):
+                return sorted(index.lookup(key[0]))
+
+            def add(key, row_id):
+                pass
+        else:
+            readers = [self._storage.get_column_reader(col_index) for col_index in key_col_indexes]
+            # Dict where key is tuple of key column values and value is list of row IDs
+            row_ids_by_key = {}
+            for row_id in self._iter_effective_row_ids():
+                row_ids_by_key.setdefault(tuple([read(row_id) for read in readers]), []).append(row_id)
+
+            def lookup(key):
+                return row_ids_by_key.get(key, [])
+
+            def add(key, row_id):
+                row_ids_by_key[key] = [row_id]
+
+        num_updated_rows = 0
+        num_inserted_rows = 0
+        col_names = self.col_names
+        for row_data, key in zip(rows, keys):
+            row_ids = lookup(key)
+            if len(row_ids) > 0:
+                num_updated_rows += self._update_row_ids(row_ids, row_data)
+            else:
+                raw_rows = [[row_data.get(col_name) for col_name in col_names]]
+                self._append_raw_rows(raw_rows, self._convert_raw_rows(raw_rows))
+                add(key, len(self._storage) - 1)
+                num_inserted_rows += 1
+
+        if commit:
+            self.commit()
+        return num_updated_rows, num_inserted_rows
+
+    def _is_value_changed(self, row_id, col_index, value):
+        """
+        Check if a converted value is different from the current value of a cell.
+
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_index: int
+        :param col_index: Index of column
+        :type value: Any
+        :param value: Converted value
+        :rtype: bool
+        :return: Whether value is different. True if values cannot be compared.
+        """
+
+        if value is _UNCOMPARABLE:
+            return True
+        try:
+            return self._storage.get_value(row_id, col_index) != value
+        except (ValueError, TypeError):
+            # Current value cannot be converted
+            return True
 
     def delete(self, where_conditions=list()):
         """
@@ -465,44 +1431,42 @@ class Table:
 
         **Warning**: If no where conditions are specified, ALL rows will be deleted.
 
-        :type where_conditions: list[WhereCondition]
+        :type where_conditions: list[Condition]
         :param where_conditions: List of where conditions for query
         """
 
-        # Delete initial rows
-        matched_initial_row_indexes = [
-            i for i in range(len(self.initial_rows))
-            if (self._is_where_conditions_passed(self.initial_rows[i], where_conditions)
-                # Skip if row already deleted
-                and i not in self.deleted_initial_row_indexes)
-        ]
-        # Add matched indexes to deleted initial row indexes
-        self.deleted_initial_row_indexes = self.deleted_initial_row_indexes.union(set(matched_initial_row_indexes))
-
-        # Delete inserted rows
-        self.inserted_rows = [
-            row for row in self.inserted_rows if not self._is_where_conditions_passed(row, where_conditions)
-        ]
-
-    def commit(self):
+        num_initial_rows = self._num_initial_rows
+        for row_id in list(self._match_row_ids(where_conditions)):
+            for col_index, index in self._indexes.items():
+                index.remove(self._storage.get_value(row_id, col_index), row_id)
+            if row_id < num_initial_rows:
+                self.deleted_initial_row_indexes.add(row_id)
+            else:
+                self.deleted_inserted_row_indexes.add(row_id - num_initial_rows)
+            self._num_rows -= 1
+            self._num_changed_rows += 1
+
+    def _commit_values(self, updated_rows_data, inserted_rows):
         """
-        Commits any the changes made to Google Sheets. Multiple commits is allowed and results in incremental update.
+        Commit changes with separate values API requests for updates, deletions and insertions.
+        Changes in requests before a failed request are committed.
+
+        :type updated_rows_data: list[dict]
+        :param updated_rows_data: Rows to update, in the form of rows data of `google_services.update_rows`
+        :type inserted_rows: list[list]
+        :param inserted_rows: Raw values of rows to insert
         """
 
+        error_source = '{}.{}'.format(type(self).__qualname__, 'commit')
+
         # Update
         # Do first as required initial row indexes to identify rows to update
-        if len(self.updated_initial_row_indexes) > 0:
+        if len(updated_rows_data) > 0:
             update_response, update_error_status = google_services.update_rows(
-                self.user, self.spreadsheet_id,
-                [
-                    {
-                        'index': updated_row_index,
-                        'values': self.initial_rows[updated_row_index],
-                    } for updated_row_index in self.updated_initial_row_indexes
-                ])
+                self.user, self.spreadsheet_id, updated_rows_data)
             if update_error_status is not None:
                 raise SheetsdbSDKError('Sheets API error {} when updating updated rows'.format(update_error_status),
-                                       SheetsdbSDKError.SHEETS_API_ERROR, '{}{}'.format(self.__qualname__, 'commit'))
+                                       SheetsdbSDKError.SHEETS_API_ERROR, error_source)
 
         # Delete
         # Also require initial row indexes to identify rows to update
@@ -512,24 +1476,244 @@ class Table:
                 self.user, self.spreadsheet_id, self.deleted_initial_row_indexes)
             if delete_error_status is not None:
                 raise SheetsdbSDKError('Sheets API error {} when deleting deleted rows'.format(delete_error_status),
-                                       SheetsdbSDKError.SHEETS_API_ERROR, '{}{}'.format(self.__qualname__, 'commit'))
+                                       SheetsdbSDKError.SHEETS_API_ERROR, error_source)
 
         # Insert last as it is just an append operation
-        if len(self.inserted_rows) > 0:
+        if len(inserted_rows) > 0:
             insert_response, insert_error_status = google_services.insert_rows(
-                self.user, self.spreadsheet_id, self.inserted_rows)
+                self.user, self.spreadsheet_id, inserted_rows)
             if insert_error_status is not None:
                 raise SheetsdbSDKError('Sheets API error {} when inserted inserted rows'.format(insert_error_status),
-                                       SheetsdbSDKError.SHEETS_API_ERROR, '{}{}'.format(self.__qualname__, 'commit'))
+                                       SheetsdbSDKError.SHEETS_API_ERROR, error_source)
+
+    def commit(self):
+        """
+        Commits any the changes made to Google Sheets. Multiple commits is allowed and results in incremental update.
+        With 'batch' commit method, either all changes are committed or none are, unless they write more than
+        `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST` cells and are split into several requests.
+
+        With write-behind, changes are queued to be written to Google Sheets in the background, and the table
+        continues as if they are committed. Commits of a process are written in the order they are made.
+        If a queued commit fails, the table no longer matches its spreadsheet. Later commits of the table that are
+        queued fail without being written, and committing raises `SheetsdbSDKError` until the table is read again.
+        Queuing waits if too many commits are pending, and raises `write_behind.WriteBehindQueueFull` if
+        `SHEETSDB_WRITE_BEHIND_QUEUE_TIMEOUT` is reached.
+
+        :rtype: write_behind.CommitHandle
+        :return: Handle to wait until changes are written, which raises `write_behind.WriteBehindError` if they fail.
+            Without write-behind, changes are already written.
+        """
+
+        if self._commit_handle is not None and self._commit_handle.error() is not None:
+            raise SheetsdbSDKError('Previous commit failed, table must be read again: {}'.format(
+                self._commit_handle.error()), SheetsdbSDKError.WRITE_BEHIND_ERROR,
+                '{}.{}'.format(type(self).__qualname__, 'commit'))
+
+        # Only changed cells are written, in runs of adjacent changed cells. Rows that are also deleted are skipped.
+        updated_rows_data = []
+        for updated_row_index, updated_col_indexes in sorted(self.updated_initial_row_indexes.items()):
+            if updated_row_index in self.deleted_initial_row_indexes:
+                continue
+            raw_row = self._storage.get_raw_row(updated_row_index)
+            for start_col_index, end_col_index in _get_continuous_runs(sorted(updated_col_indexes)):
+                updated_rows_data.append({
+                    'index': updated_row_index,
+                    'start_col_index': start_col_index,
+                    'values': raw_row[start_col_index:end_col_index + 1],
+                })
+        # Rows are copied, as queued rows are written after the table goes on to change them
+        inserted_rows = [
+            list(self._storage.get_raw_row(row_id)) for row_id in range(self._num_initial_rows, len(self._storage))
+            if row_id - self._num_initial_rows not in self.deleted_inserted_row_indexes
+        ]
 
-        # Update rows and reset changes when all Sheets API requests succeed
-        self.initial_rows = self._get_effective_rows()
-        self.inserted_rows = []
+        if self.write_behind:
+            commit_handle = write_behind.submit(self.user, self.spreadsheet_id, updated_rows_data,
+                                                self.deleted_initial_row_indexes, inserted_rows, self._commit_handle)
+        else:
+            if self.commit_method == 'batch':
+                commit_response, commit_error_status = google_services.commit_changes(
+                    self.user, self.spreadsheet_id, updated_rows_data, self.deleted_initial_row_indexes, inserted_rows)
+                if commit_error_status is not None:
+                    raise SheetsdbSDKError('Sheets API error {} when committing changes'.format(commit_error_status),
+                                           SheetsdbSDKError.SHEETS_API_ERROR,
+                                           '{}.{}'.format(type(self).__qualname__, 'commit'))
+            else:
+                self._commit_values(updated_rows_data, inserted_rows)
+            commit_handle = write_behind.CommitHandle.completed()
+
+        # Update rows and reset changes when all Sheets API requests succeed, or when changes are queued
+        if len(self.deleted_initial_row_indexes) > 0 or len(self.deleted_inserted_row_indexes) > 0:
+            # Renumber rows as rows after deleted rows move up
+            effective_row_ids = list(self._iter_effective_row_ids())
+            self._storage.compact(effective_row_ids)
+            row_id_mapping = {row_id: i for i, row_id in enumerate(effective_row_ids)}
+            for index in self._indexes.values():
+                index.remap(row_id_mapping)
+        self._num_initial_rows = len(self._storage)
+        self._num_rows = self._num_initial_rows
         self.deleted_initial_row_indexes = set()
-        self.updated_initial_row_indexes = set()
+        self.deleted_inserted_row_indexes = set()
+        self.updated_initial_row_indexes = {}
+        self._commit_handle = commit_handle
+
+        if self.on_commit is not None:
+            self.on_commit(self)
+        return commit_handle
+
+
+class Condition:
+    """
+    Base class of where conditions. Rows satisfy a list of where conditions if they satisfy all of them.
+
+    Subclasses implement `bind`, and `lookup_index` if they can be answered by an index.
+    """
+
+    def _resolve_col(self, col_name, col_defs, col_indexes=None, col_types=None):
+        """
+        Get the index and type of a column of where condition, and check that where condition is valid for it.
 
+        :type col_name: str
+        :param col_name: Column name
+        :type col_defs: list[dict]
+        :param col_defs: Column definitions for table
+        :type col_indexes: dict
+        :param col_indexes: Mapping of column name to column index from `get_col_indexes`. Optional.
+        :type col_types: tuple
+        :param col_types: Column types where condition is valid for. None indicates all column types except json.
+        :rtype: int, str
+        :return: Column index, column type
+        """
 
-class WhereCondition:
+        if col_defs is None:
+            raise ValueError('col_defs is None')
+        if col_indexes is not None:
+            col_index = col_indexes.get(col_name)
+        else:
+            col_index = get_col_index(col_name, col_defs)
+        if col_index is None:
+            raise ValueError('Column name {} is not in column definitions'.format(col_name))
+        col_type = col_defs[col_index]['type']
+        if col_type == 'json':
+            raise ValueError('json column type cannot be used in where condition')
+        if col_types is not None and col_type not in col_types:
+            raise ValueError('Illegal where condition {} for column type {}'.format(type(self).__name__, col_type))
+        return col_index, col_type
+
+    def lookup_index(self, col_indexes, indexes):
+        """
+        Get the rows that pass where condition from the indexes of a table, if where condition can be answered by them.
+
+        :type col_indexes: dict
+        :param col_indexes: Mapping of column name to column index from `get_col_indexes`
+        :type indexes: dict
+        :param indexes: Indexes of table, keyed by column index
+        :rtype: set
+        :return: IDs of rows that pass where condition. None if where condition cannot be answered by indexes.
+        """
+
+        return None
+
+    def can_lookup_index(self, col_indexes, indexes):
+        """
+        Check whether where condition can be answered by the indexes of a table, without looking it up.
+
+        :type col_indexes: dict
+        :param col_indexes: Mapping of column name to column index from `get_col_indexes`
+        :type indexes: dict
+        :param indexes: Indexes of table, keyed by column index
+        :rtype: bool
+        :return: Whether `lookup_index` returns the rows that pass where condition
+        """
+
+        return False
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        """
+        Compile where condition into a predicate on the row IDs of a table.
+        Columns are resolved and validated once, so the predicate can be reused for all rows of a query.
+
+        :type col_defs: list[dict]
+        :param col_defs: Column definitions for table
+        :type col_indexes: dict
+        :param col_indexes: Mapping of column name to column index from `get_col_indexes`
+        :type get_column_reader: function
+        :param get_column_reader: Function that takes a column index and returns a function that takes a row ID and
+            returns the converted value of column in row
+        :rtype: function
+        :return: Function that takes a row ID and returns whether row passes where condition
+        """
+
+        raise NotImplementedError()
+
+    def compile(self, col_defs, col_indexes=None):
+        """
+        Compile where condition into a predicate for the rows of a table.
+        Columns are resolved and validated once, so the predicate can be reused for all rows of a query.
+
+        :type col_defs: list[dict]
+        :param col_defs: Column definitions for table
+        :type col_indexes: dict
+        :param col_indexes: Mapping of column name to column index from `get_col_indexes`. Optional.
+        :rtype: function
+        :return: Function that takes a row and returns whether row passes where condition
+        """
+
+        if col_defs is None:
+            raise ValueError('col_defs is None')
+
+        def get_row_reader(col_index):
+            col_type = col_defs[col_index]['type']
+            return lambda row: convert_to_value(row[col_index] if col_index < len(row) else None, col_type)
+
+        return self.bind(col_defs, col_indexes or get_col_indexes(col_defs), get_row_reader)
+
+    def is_pass(self, row, col_defs):
+        """
+        Check if row passes where condition.
+        To check many rows, use a predicate from `compile` instead.
+
+        :type row: list
+        :param row: Row to check
+        :type col_defs: list[dict]
+        :param col_defs: Column definitions for table
+        :rtype: bool
+        :return: Whether row passes where condition
+        """
+
+        return self.compile(col_defs)(row)
+
+    def estimate_selectivity(self, get_col_stats):
+        """
+        Estimate the fraction of rows that pass where condition.
+
+        :type get_col_stats: function
+        :param get_col_stats: Function that takes a column name and returns its `planner.ColumnStats`,
+            or None if not available
+        :rtype: float
+        :return: Estimated fraction of rows, from 0 to 1
+        """
+
+        return 1.0
+
+    def estimate_cost(self):
+        """
+        :rtype: float
+        :return: Estimated cost of checking where condition against a row, relative to checking a single comparison
+        """
+
+        return 1.0
+
+
+class WhereCondition(Condition):
+
+    _COMPARE_FUNCTIONS = {
+        '=': operator.eq,
+        '<=': operator.le,
+        '<': operator.lt,
+        '>': operator.gt,
+        '>=': operator.ge,
+    }
 
     def __init__(self, col_name, value, comparator='='):
         """
@@ -538,54 +1722,369 @@ class WhereCondition:
         :type value: Any
         :param value: Value to check in where condition
         :type comparator: str
-        :param comparator: '=' for all, '<=', '<', '>', '>=' for number values
+        :param comparator: '=' for all, '<=', '<', '>', '>=' for number and datetime values.
+            datetime values are compared as strings, so they should be in a sortable format, e.g. ISO 8601.
         """
         if value is None:
             raise ValueError('value is None')
         if col_name is None:
             raise ValueError('col_name is None')
-        if comparator not in ('=', '<=', '<', '>', '>='):
+        if comparator not in self._COMPARE_FUNCTIONS:
             raise ValueError('Unrecognised comparator {}'.format(comparator))
 
         self.value = value
         self.col_name = col_name
         self.comparator = comparator
 
-    def is_pass(self, row, col_defs):
+    def __repr__(self):
+        return 'WhereCondition({!r}, {!r}, {!r})'.format(self.col_name, self.value, self.comparator)
+
+    def _compile_test(self):
         """
-        Check if row passes where condition
+        Compile where condition into a function that checks a converted column value.
 
-        :type row: list
-        :param row: Row to check
-        :type col_defs: list[dict]
-        :param col_defs: Column definitions for table
-        :rtype: bool
-        :return: Whether row passes where condition
+        :rtype: function
+        :return: Function that takes a converted column value and returns whether it passes where condition
         """
 
-        if col_defs is None:
-            raise ValueError('col_defs is None')
-        col_index = get_col_index(self.col_name, col_defs)
-        if col_index is None:
-            raise ValueError('Column name {} is not in column definitions'.format(self.col_name))
-        col_type = col_defs[col_index]['type']
-        if col_type == 'json':
-            raise ValueError('json column type cannot be used in where condition')
-        if not self.comparator == '=' and not col_type == 'int':
+        compare = self._COMPARE_FUNCTIONS[self.comparator]
+        value = self.value
+        if self.comparator == '=':
+            return lambda col_value: col_value == value
+        # Empty cells never satisfy ordering comparators
+        return lambda col_value: col_value is not None and compare(col_value, value)
+
+    def lookup_index(self, col_indexes, indexes):
+        index = indexes.get(col_indexes.get(self.col_name))
+        if index is None:
+            return None
+        if self.comparator == '=':
+            return index.lookup(self.value)
+        if not index.is_ordered:
+            return None
+        try:
+            if self.comparator in ('<', '<='):
+                return index.lookup_range(upper=self.value, is_upper_inclusive=self.comparator == '<=')
+            return index.lookup_range(lower=self.value, is_lower_inclusive=self.comparator == '>=')
+        except TypeError:
+            # Value cannot be compared with column values. Scan rows, so that result is the same as without index.
+            return None
+
+    def can_lookup_index(self, col_indexes, indexes):
+        index = indexes.get(col_indexes.get(self.col_name))
+        return index is not None and (self.comparator == '=' or index.is_ordered)
+
+    def estimate_selectivity(self, get_col_stats):
+        col_stats = get_col_stats(self.col_name)
+        if self.comparator == '=':
+            return col_stats.estimate_equal_selectivity() if col_stats is not None else DEFAULT_EQUAL_SELECTIVITY
+        if col_stats is None:
+            return DEFAULT_RANGE_SELECTIVITY
+        if self.comparator in ('<', '<='):
+            return col_stats.estimate_range_selectivity(upper=self.value)
+        return col_stats.estimate_range_selectivity(lower=self.value)
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        col_index, col_type = self._resolve_col(self.col_name, col_defs, col_indexes)
+        if not self.comparator == '=' and col_type not in ('number', 'datetime'):
             raise ValueError('Illegal comparator {} for column type {}'.format(self.comparator, col_type))
+        test = self._compile_test()
+        read = get_column_reader(col_index)
+        return lambda row_id: test(read(row_id))
 
-        col_value = convert_to_value(row[col_index], col_type) if col_index < len(row) else None
-        if self.comparator == '=':
-            return col_value == self.value
-        elif self.comparator == '<=':
-            return col_value <= self.value
-        elif self.comparator == '<':
-            return col_value < self.value
-        elif self.comparator == '>':
-            return col_value > self.value
-        elif self.comparator == '>=':
-            return col_value >= self.value
-        else:
-            raise RuntimeError(
-                'Undetected mistake in where condition for column name {}, value {}, comparator {}.'.format(
-                    self.col_name, self.value, self.comparator))
+
+class In(Condition):
+    """
+    Where condition satisfied by rows with a column value in a collection of values.
+    """
+
+    def __init__(self, col_name, values):
+        """
+        :type col_name: str
+        :param col_name: Column name to check in where condition
+        :type values: iterable
+        :param values: Values to check in where condition
+        """
+
+        if col_name is None:
+            raise ValueError('col_name is None')
+        if values is None:
+            raise ValueError('values is None')
+        values = frozenset(values)
+        if None in values:
+            raise ValueError('values contains None')
+
+        self.col_name = col_name
+        self.values = values
+
+    def __repr__(self):
+        return 'In({!r}, {!r})'.format(self.col_name, sorted(self.values, key=repr))
+
+    def lookup_index(self, col_indexes, indexes):
+        index = indexes.get(col_indexes.get(self.col_name))
+        if index is None:
+            return None
+        return set().union(*[index.lookup(value) for value in self.values])
+
+    def can_lookup_index(self, col_indexes, indexes):
+        return indexes.get(col_indexes.get(self.col_name)) is not None
+
+    def estimate_selectivity(self, get_col_stats):
+        col_stats = get_col_stats(self.col_name)
+        equal_selectivity = col_stats.estimate_equal_selectivity() if col_stats is not None \
+            else DEFAULT_EQUAL_SELECTIVITY
+        return min(1.0, len(self.values) * equal_selectivity)
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        col_index, col_type = self._resolve_col(self.col_name, col_defs, col_indexes)
+        values = self.values
+        read = get_column_reader(col_index)
+        return lambda row_id: read(row_id) in values
+
+
+class Between(Condition):
+    """
+    Where condition satisfied by rows with a number or datetime column value between 2 values, inclusive.
+    """
+
+    def __init__(self, col_name, lower, upper):
+        """
+        :type col_name: str
+        :param col_name: Column name to check in where condition
+        :type lower: Any
+        :param lower: Smallest value in range
+        :type upper: Any
+        :param upper: Largest value in range
+        """
+
+        if col_name is None:
+            raise ValueError('col_name is None')
+        if lower is None:
+            raise ValueError('lower is None')
+        if upper is None:
+            raise ValueError('upper is None')
+
+        self.col_name = col_name
+        self.lower = lower
+        self.upper = upper
+
+    def __repr__(self):
+        return 'Between({!r}, {!r}, {!r})'.format(self.col_name, self.lower, self.upper)
+
+    def lookup_index(self, col_indexes, indexes):
+        index = indexes.get(col_indexes.get(self.col_name))
+        if index is None or not index.is_ordered:
+            return None
+        try:
+            return index.lookup_range(self.lower, True, self.upper, True)
+        except TypeError:
+            # Bounds cannot be compared with column values. Scan rows, so that result is the same as without index.
+            return None
+
+    def can_lookup_index(self, col_indexes, indexes):
+        index = indexes.get(col_indexes.get(self.col_name))
+        return index is not None and index.is_ordered
+
+    def estimate_selectivity(self, get_col_stats):
+        col_stats = get_col_stats(self.col_name)
+        if col_stats is None:
+            return DEFAULT_RANGE_SELECTIVITY
+        return col_stats.estimate_range_selectivity(self.lower, self.upper)
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        col_index, col_type = self._resolve_col(self.col_name, col_defs, col_indexes, ('number', 'datetime'))
+        lower = self.lower
+        upper = self.upper
+        read = get_column_reader(col_index)
+
+        def predicate(row_id):
+            value = read(row_id)
+            return value is not None and lower <= value <= upper
+
+        return predicate
+
+
+class StartsWith(Condition):
+    """
+    Where condition satisfied by rows with a string or datetime column value that starts with a prefix.
+    Always checked row by row, as indexes cannot look up prefixes.
+    """
+
+    def __init__(self, col_name, prefix):
+        """
+        :type col_name: str
+        :param col_name: Column name to check in where condition
+        :type prefix: str
+        :param prefix: Prefix to check in where condition
+        """
+
+        if col_name is None:
+            raise ValueError('col_name is None')
+        if prefix is None:
+            raise ValueError('prefix is None')
+
+        self.col_name = col_name
+        self.prefix = prefix
+
+    def __repr__(self):
+        return 'StartsWith({!r}, {!r})'.format(self.col_name, self.prefix)
+
+    def estimate_selectivity(self, get_col_stats):
+        col_stats = get_col_stats(self.col_name)
+        if col_stats is None:
+            return DEFAULT_PREFIX_SELECTIVITY
+        return col_stats.non_null_fraction * DEFAULT_PREFIX_SELECTIVITY
+
+    def estimate_cost(self):
+        # Method call on value
+        return 2.0
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        col_index, col_type = self._resolve_col(self.col_name, col_defs, col_indexes, ('string', 'datetime'))
+        prefix = self.prefix
+        read = get_column_reader(col_index)
+
+        def predicate(row_id):
+            value = read(row_id)
+            return value is not None and value.startswith(prefix)
+
+        return predicate
+
+
+class Not(Condition):
+    """
+    Where condition satisfied by rows that do not satisfy another where condition,
+    including rows with empty values that the other where condition does not match.
+    Always checked row by row.
+    """
+
+    def __init__(self, condition):
+        """
+        :type condition: Condition
+        :param condition: Where condition to negate
+        """
+
+        if condition is None:
+            raise ValueError('condition is None')
+
+        self.condition = condition
+
+    def __repr__(self):
+        return 'Not({!r})'.format(self.condition)
+
+    def estimate_selectivity(self, get_col_stats):
+        return 1.0 - self.condition.estimate_selectivity(get_col_stats)
+
+    def estimate_cost(self):
+        return self.condition.estimate_cost()
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        predicate = self.condition.bind(col_defs, col_indexes, get_column_reader)
+        return lambda row_id: not predicate(row_id)
+
+
+class And(Condition):
+    """
+    Where condition satisfied by rows that satisfy all of some where conditions. Used to nest where conditions in `Or`.
+    """
+
+    def __init__(self, *conditions):
+        """
+        :type conditions: Condition
+        :param conditions: Where conditions to satisfy
+        """
+
+        if len(conditions) == 0:
+            raise ValueError('No condition')
+
+        self.conditions = conditions
+
+    def __repr__(self):
+        return 'And({})'.format(', '.join(repr(condition) for condition in self.conditions))
+
+    def estimate_selectivity(self, get_col_stats):
+        # Assume where conditions are independent
+        selectivity = 1.0
+        for condition in self.conditions:
+            selectivity *= condition.estimate_selectivity(get_col_stats)
+        return selectivity
+
+    def estimate_cost(self):
+        return sum(condition.estimate_cost() for condition in self.conditions)
+
+    def lookup_index(self, col_indexes, indexes):
+        row_ids = None
+        for condition in self.conditions:
+            condition_row_ids = condition.lookup_index(col_indexes, indexes)
+            if condition_row_ids is None:
+                return None
+            row_ids = condition_row_ids if row_ids is None else row_ids & condition_row_ids
+        return row_ids
+
+    def can_lookup_index(self, col_indexes, indexes):
+        return all(condition.can_lookup_index(col_indexes, indexes) for condition in self.conditions)
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        predicates = [condition.bind(col_defs, col_indexes, get_column_reader) for condition in self.conditions]
+
+        def predicate(row_id):
+            for condition_predicate in predicates:
+                if not condition_predicate(row_id):
+                    return False
+            return True
+
+        return predicate
+
+
+class Or(Condition):
+    """
+    Where condition satisfied by rows that satisfy any of some where conditions. Rows are checked in a single pass,
+    and looked up in indexes if all where conditions can be answered by indexes.
+    """
+
+    def __init__(self, *conditions):
+        """
+        :type conditions: Condition
+        :param conditions: Where conditions to satisfy any of
+        """
+
+        if len(conditions) == 0:
+            raise ValueError('No condition')
+
+        self.conditions = conditions
+
+    def __repr__(self):
+        return 'Or({})'.format(', '.join(repr(condition) for condition in self.conditions))
+
+    def estimate_selectivity(self, get_col_stats):
+        # Assume where conditions are independent
+        rejected_fraction = 1.0
+        for condition in self.conditions:
+            rejected_fraction *= 1.0 - condition.estimate_selectivity(get_col_stats)
+        return 1.0 - rejected_fraction
+
+    def estimate_cost(self):
+        return sum(condition.estimate_cost() for condition in self.conditions)
+
+    def lookup_index(self, col_indexes, indexes):
+        row_ids = set()
+        for condition in self.conditions:
+            condition_row_ids = condition.lookup_index(col_indexes, indexes)
+            if condition_row_ids is None:
+                return None
+            row_ids |= condition_row_ids
+        return row_ids
+
+    def can_lookup_index(self, col_indexes, indexes):
+        return all(condition.can_lookup_index(col_indexes, indexes) for condition in self.conditions)
+
+    def bind(self, col_defs, col_indexes, get_column_reader):
+        predicates = [condition.bind(col_defs, col_indexes, get_column_reader) for condition in self.conditions]
+
+        def predicate(row_id):
+            for condition_predicate in predicates:
+                if condition_predicate(row_id):
+                    return True
+            return False
+
+        return predicate
@@ -0,0 +1,466 @@
+import json
+import logging
+import sys
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+def get_or_default(arr, index, default_value=None):
+    """
+    Get value at index from list. Return default value if index out of bound
+
+    :type arr: list
+    :param arr: List to get value from
+    :type index: int
+    :param index: Index to get value for
+    :type default_value: Any
+    :param default_value: Default value
+    :rtype: Any
+    :return: Value to get
+    """
+    return arr[index] if len(arr) > index else default_value
+
+
+def convert_to_value(raw_value, value_type):
+    """
+    Convert raw values into the correct type.
+
+    :type raw_value: Any
+    :param raw_value: Raw value to convert
+    :type value_type: str
+    :param value_type: Type to convert raw value to
+    :rtype: Any
+    :return: Converted value
+    """
+
+    if raw_value is None or raw_value == '':
+        return None
+
+    if value_type == 'string':
+        return str(raw_value)
+    elif value_type == 'number':
+        return float(raw_value)
+    elif value_type == 'datetime':
+        # Simple string value for datetime for now
+        return str(raw_value)
+    elif value_type == 'json':
+        return json.loads(raw_value)
+    else:
+        logger.warning('Unrecognised value type {} when converting raw value'.format(value_type))
+        return raw_value
+
+
+class RowStorage:
+    """
+    Stores the rows of a table as lists of raw values, as returned by Sheets API.
+    Values are converted when they are read. With a value cache, converted values of the column types of the cache
+    are kept, so that reading them again does not convert them again.
+    Cached values are shared between reads, so json values that are read must not be modified.
+    """
+
+    def __init__(self, rows, col_types, value_cache=None):
+        """
+        :type rows: list[list]
+        :param rows: Rows of raw values. Rows are stored without copying.
+        :type col_types: list[str]
+        :param col_types: Types of columns, in the order of column index
+        :type value_cache: sheetsdb.caches.ValueCache
+        :param value_cache: Cache of converted values. None disables caching.
+        """
+
+        self.rows = rows
+        self._col_types = col_types
+        self._value_cache = value_cache
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_value(self, row_id, col_index):
+        """
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_index: int
+        :param col_index: Index of column
+        :rtype: Any
+        :return: Converted value of column in row
+        """
+
+        return self.get_column_reader(col_index)(row_id)
+
+    def get_column_reader(self, col_index):
+        """
+        Get a function that reads the converted values of a column. Faster than `get_value` for reading many rows.
+        The function must not be used after rows are compacted.
+
+        :type col_index: int
+        :param col_index: Index of column
+        :rtype: function
+        :return: Function that takes a row ID and returns the converted value of column in row
+        """
+
+        rows = self.rows
+        col_type = self._col_types[col_index]
+
+        def read(row_id):
+            row = rows[row_id]
+            return convert_to_value(row[col_index] if col_index < len(row) else None, col_type)
+
+        value_cache = self._value_cache
+        if value_cache is None or col_type not in value_cache.col_types:
+            return read
+
+        get_cached = value_cache.get
+        set_cached = value_cache.set
+        missing = value_cache.MISSING
+
+        def read_cached(row_id):
+            value = get_cached(row_id, col_index)
+            if value is missing:
+                value = read(row_id)
+                set_cached(row_id, col_index, value)
+            return value
+
+        return read_cached
+
+    def set_col_types(self, col_types):
+        """
+        Change the types of columns, e.g. when columns are added. Raw values are kept and converted to the new types
+        when they are read.
+
+        :type col_types: list[str]
+        :param col_types: Types of columns, in the order of column index
+        """
+
+        self._col_types = list(col_types)
+        if self._value_cache is not None:
+            self._value_cache.clear()
+
+    def get_raw_row(self, row_id):
+        """
+        :type row_id: int
+        :param row_id: ID of row
+        :rtype: list
+        :return: Raw values of row, to be written to Sheets API. Do not modify.
+        """
+
+        return self.rows[row_id]
+
+    def set_values(self, row_id, col_values):
+        """
+        Set some values of a row.
+
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_values: list[tuple]
+        :param col_values: List of tuples of (column index, raw value)
+        """
+
+        row = self.rows[row_id]
+        num_cols = len(self._col_types)
+        if len(row) < num_cols:
+            # Rows from Sheets API do not include empty cells at the end of row
+            row.extend([None] * (num_cols - len(row)))
+        for col_index, raw_value in col_values:
+            row[col_index] = raw_value
+        if self._value_cache is not None:
+            self._value_cache.invalidate_row(row_id, num_cols)
+
+    def append(self, raw_row):
+        """
+        Append a row.
+
+        :type raw_row: list
+        :param raw_row: Raw values of row, for all columns
+        :rtype: int
+        :return: ID of appended row
+        """
+
+        self.rows.append(raw_row)
+        return len(self.rows) - 1
+
+    def compact(self, row_ids):
+        """
+        Keep only some rows. Kept rows are renumbered from 0 in the order given.
+
+        :type row_ids: list[int]
+        :param row_ids: IDs of rows to keep
+        """
+
+        rows = self.rows
+        self.rows = [rows[row_id] for row_id in row_ids]
+        if self._value_cache is not None:
+            # Cached values are keyed by row ID, which changes
+            self._value_cache.clear()
+
+
+class _RawColumn:
+    """
+    Column of raw values that are converted every time they are read.
+    Used for column types without a typed container, and for columns containing values that cannot be converted.
+    """
+
+    def __init__(self, col_type, raw_values):
+        self._col_type = col_type
+        self._values = list(raw_values)
+
+    def convert(self, raw_value):
+        return raw_value
+
+    def get(self, row_id):
+        return convert_to_value(self._values[row_id], self._col_type)
+
+    def get_raw(self, row_id):
+        return self._values[row_id]
+
+    def set(self, row_id, stored_value):
+        self._values[row_id] = stored_value
+
+    def append(self, stored_value):
+        self._values.append(stored_value)
+
+    def compact(self, row_ids):
+        values = self._values
+        self._values = [values[row_id] for row_id in row_ids]
+
+    def get_reader(self):
+        values = self._values
+        col_type = self._col_type
+        return lambda row_id: convert_to_value(values[row_id], col_type)
+
+
+class _ObjectColumn:
+    """
+    Column of converted values in a list.
+    Strings are interned, so that repeated values share memory.
+    """
+
+    def __init__(self, col_type, raw_values):
+        self._col_type = col_type
+        self._values = [self.convert(raw_value) for raw_value in raw_values]
+
+    def convert(self, raw_value):
+        value = convert_to_value(raw_value, self._col_type)
+        return sys.intern(value) if type(value) is str else value
+
+    def get(self, row_id):
+        return self._values[row_id]
+
+    def get_raw(self, row_id):
+        value = self._values[row_id]
+        if value is not None and self._col_type == 'json':
+            return json.dumps(value)
+        return value
+
+    def set(self, row_id, stored_value):
+        self._values[row_id] = stored_value
+
+    def append(self, stored_value):
+        self._values.append(stored_value)
+
+    def compact(self, row_ids):
+        values = self._values
+        self._values = [values[row_id] for row_id in row_ids]
+
+    def get_reader(self):
+        return self._values.__getitem__
+
+
+class _NumberColumn:
+    """
+    Column of number values in an array of doubles, with a mask of empty values.
+    """
+
+    def __init__(self, raw_values):
+        self._values = array('d')
+        # 1 for empty value, 0 otherwise
+        self._empty_mask = bytearray()
+        for raw_value in raw_values:
+            self.append(self.convert(raw_value))
+
+    def convert(self, raw_value):
+        return convert_to_value(raw_value, 'number')
+
+    def get(self, row_id):
+        return None if self._empty_mask[row_id] else self._values[row_id]
+
+    get_raw = get
+
+    def set(self, row_id, stored_value):
+        self._values[row_id] = 0.0 if stored_value is None else stored_value
+        self._empty_mask[row_id] = stored_value is None
+
+    def append(self, stored_value):
+        self._values.append(0.0 if stored_value is None else stored_value)
+        self._empty_mask.append(stored_value is None)
+
+    def compact(self, row_ids):
+        values = self._values
+        empty_mask = self._empty_mask
+        self._values = array('d', (values[row_id] for row_id in row_ids))
+        self._empty_mask = bytearray(empty_mask[row_id] for row_id in row_ids)
+
+    def get_reader(self):
+        values = self._values
+        empty_mask = self._empty_mask
+        return lambda row_id: None if empty_mask[row_id] else values[row_id]
+
+
+def _create_column(col_type, raw_values):
+    """
+    Create a typed column for a column type. Falls back to a column of raw values if a value cannot be converted,
+    so that the conversion error is raised when the value is read, as with `RowStorage`.
+
+    :type col_type: str
+    :param col_type: Type of column
+    :type raw_values: list
+    :param raw_values: Raw values of column
+    :return: Column
+    """
+
+    try:
+        if col_type == 'number':
+            return _NumberColumn(raw_values)
+        elif col_type in ('string', 'datetime', 'json'):
+            return _ObjectColumn(col_type, raw_values)
+    except (ValueError, TypeError):
+        logger.warning('Column of type {} contains values that cannot be converted. '
+                       'Storing raw values instead.'.format(col_type))
+    return _RawColumn(col_type, raw_values)
+
+
+class ColumnStorage:
+    """
+    Stores the rows of a table column by column. Each column is converted once when it is stored,
+    into a typed container, e.g. an array of doubles for number columns and parsed objects for json columns.
+    Reads do not convert values, and memory per row is lower than `RowStorage` for wide tables.
+
+    Values are written back to Sheets API in their converted form. json values that are read are shared with the
+    storage, so they must not be modified.
+    """
+
+    def __init__(self, rows, col_types):
+        """
+        :type rows: list[list]
+        :param rows: Rows of raw values
+        :type col_types: list[str]
+        :param col_types: Types of columns, in the order of column index
+        """
+
+        self._num_rows = len(rows)
+        self._col_types = list(col_types)
+        self._columns = [
+            _create_column(col_type, [row[col_index] if col_index < len(row) else None for row in rows])
+            for col_index, col_type in enumerate(col_types)
+        ]
+
+    def __len__(self):
+        return self._num_rows
+
+    def get_value(self, row_id, col_index):
+        """
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_index: int
+        :param col_index: Index of column
+        :rtype: Any
+        :return: Converted value of column in row
+        """
+
+        return self._columns[col_index].get(row_id)
+
+    def get_column_reader(self, col_index):
+        """
+        Get a function that reads the converted values of a column. Faster than `get_value` for reading many rows.
+        The function must not be used after rows are appended or compacted.
+
+        :type col_index: int
+        :param col_index: Index of column
+        :rtype: function
+        :return: Function that takes a row ID and returns the converted value of column in row
+        """
+
+        return self._columns[col_index].get_reader()
+
+    def set_col_types(self, col_types):
+        """
+        Change the types of columns, e.g. when columns are added. Columns whose type is unchanged are kept,
+        other columns are converted again from their raw values, and added columns are empty.
+
+        :type col_types: list[str]
+        :param col_types: Types of columns, in the order of column index
+        """
+
+        row_ids = range(self._num_rows)
+        columns = []
+        for col_index, col_type in enumerate(col_types):
+            if col_index >= len(self._columns):
+                columns.append(_create_column(col_type, [None] * self._num_rows))
+            elif col_type != self._col_types[col_index]:
+                column = self._columns[col_index]
+                columns.append(_create_column(col_type, [column.get_raw(row_id) for row_id in row_ids]))
+            else:
+                columns.append(self._columns[col_index])
+        self._columns = columns
+        self._col_types = list(col_types)
+
+    def get_raw_row(self, row_id):
+        """
+        :type row_id: int
+        :param row_id: ID of row
+        :rtype: list
+        :return: Raw values of row, to be written to Sheets API
+        """
+
+        return [column.get_raw(row_id) for column in self._columns]
+
+    def set_values(self, row_id, col_values):
+        """
+        Set some values of a row.
+
+        :type row_id: int
+        :param row_id: ID of row
+        :type col_values: list[tuple]
+        :param col_values: List of tuples of (column index, raw value)
+        """
+
+        # Convert all values before setting any, so that a value that cannot be converted does not leave row half set
+        stored_values = [(self._columns[col_index], self._columns[col_index].convert(raw_value))
+                         for col_index, raw_value in col_values]
+        for column, stored_value in stored_values:
+            column.set(row_id, stored_value)
+
+    def append(self, raw_row):
+        """
+        Append a row.
+
+        :type raw_row: list
+        :param raw_row: Raw values of row, for all columns
+        :rtype: int
+        :return: ID of appended row
+        """
+
+        # Convert all values before appending any, so that a value that cannot be converted does not misalign columns
+        stored_values = [column.convert(raw_value) for column, raw_value in zip(self._columns, raw_row)]
+        for column, stored_value in zip(self._columns, stored_values):
+            column.append(stored_value)
+        self._num_rows += 1
+        return self._num_rows - 1
+
+    def compact(self, row_ids):
+        """
+        Keep only some rows. Kept rows are renumbered from 0 in the order given.
+
+        :type row_ids: list[int]
+        :param row_ids: IDs of rows to keep
+        """
+
+        for column in self._columns:
+            column.compact(row_ids)
+        self._num_rows = len(row_ids)
+
+
+STORAGE_KINDS = {
+    'rows': RowStorage,
+    'columns': ColumnStorage,
+}
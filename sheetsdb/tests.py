@@ -1,3 +1,579 @@
+import threading
+from unittest import mock
+
+import httplib2
 from django.test import TestCase
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from . import aggregates, configs, decorators, google_services, sdk, write_behind
+from .caches import LRUCache, RevisionCache
+from .http_pool import HttpPool
+from .rate_limit import RateLimiter
+
+
+class GetServiceTest(TestCase):
+
+    def setUp(self):
+        google_services.invalidate_service_cache()
+
+    def tearDown(self):
+        google_services.invalidate_service_cache()
+
+    def _get_services(self, credentials):
+        user = mock.Mock(pk=1)
+        user.googlecreds.credentials = credentials
+        with mock.patch.object(google_services, 'build_from_document', side_effect=lambda *args, **kwargs: object()):
+            return google_services._build_sheets_service(user), google_services._build_sheets_service(user)
+
+    def test_google_auth_service_is_cached(self):
+        service, cached_service = self._get_services(Credentials('token'))
+        self.assertIs(service, cached_service)
+
+    def test_other_service_is_not_cached(self):
+        # Requests of such services run on the Http object of the service, which must not be shared between threads
+        service, other_service = self._get_services(mock.Mock(token='token', refresh_token=None))
+        self.assertIsNot(service, other_service)
+
+
+class HttpPoolTest(TestCase):
+
+    def _checkout_with_error(self, pool, error):
+        with self.assertRaises(type(error)):
+            with pool.checkout() as http:
+                raise error
+        return http
+
+    def test_connection_is_reused_after_error_response(self):
+        pool = HttpPool(1)
+        http = self._checkout_with_error(pool, ValueError())
+        with pool.checkout() as reused_http:
+            self.assertIs(reused_http, http)
+
+    def test_connection_is_discarded_after_transport_error(self):
+        pool = HttpPool(1)
+        http = self._checkout_with_error(pool, ConnectionResetError())
+        with pool.checkout() as new_http:
+            self.assertIsNot(new_http, http)
+
+
+class RequireMetaSpreadsheetTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(decorators, '_meta_spreadsheet_cache', LRUCache(8))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(google_services, 'get_spreadsheet')
+    def test_cached_meta_spreadsheet_of_other_id_is_not_used(self, get_spreadsheet):
+        meta_spreadsheet = {'spreadsheetId': 'new', 'properties': {'title': configs.META_SPREADSHEET_TITLE}}
+        get_spreadsheet.return_value = (meta_spreadsheet, None)
+        view_func = mock.Mock()
+        request = mock.Mock(user=mock.Mock(pk=1))
+        # Cached by a process before the meta spreadsheet ID of the user is changed
+        decorators._meta_spreadsheet_cache.set(1, ('old', None))
+        request.user.sheetsmetainfo.meta_spreadsheet_id = 'new'
+
+        for i in range(2):
+            decorators.require_meta_spreadsheet(view_func)(request)
+        get_spreadsheet.assert_called_once_with(request.user, 'new')
+        view_func.assert_called_with(request, meta_spreadsheet=meta_spreadsheet)
+
+
+@mock.patch.object(google_services, 'get_columns_values', return_value=({'majorDimension': 'ROWS', 'values': []}, None))
+class MetaTableCacheTest(TestCase):
+
+    def setUp(self):
+        for name, value in [('_revision_forbidden_users', LRUCache(8)),
+                            ('_meta_table_cache', RevisionCache('test_meta_table', 8))]:
+            patcher = mock.patch.object(sdk, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _get_meta_tables(self, num_tables):
+        user = mock.Mock(pk=1)
+        for i in range(num_tables):
+            sdk.SheetsdbSDK(user, {'spreadsheetId': 'meta'}).get_meta_table()
+
+    @mock.patch.object(google_services, 'get_file_revision', return_value=('1', None))
+    def test_values_are_reused_for_same_revision(self, get_file_revision, get_columns_values):
+        self._get_meta_tables(2)
+        self.assertEqual(get_file_revision.call_count, 2)
+        self.assertEqual(get_columns_values.call_count, 1)
+
+    @mock.patch.object(google_services, 'get_file_revision', return_value=(None, 403))
+    def test_revision_is_not_asked_again_when_forbidden(self, get_file_revision, get_columns_values):
+        self._get_meta_tables(2)
+        self.assertEqual(get_file_revision.call_count, 1)
+        self.assertEqual(get_columns_values.call_count, 2)
+
+
+def _create_table(rows, col_defs, **kwargs):
+    return sdk.Table(mock.Mock(pk=1), 'spreadsheet', {'majorDimension': 'ROWS', 'values': [list(row) for row in rows]},
+                     col_defs, **kwargs)
+
+
+class TableColDefsTest(TestCase):
+    col_defs = [{'name': 'name', 'type': 'string'}, {'name': 'score', 'type': 'number'}]
+
+    def test_added_column_can_be_selected_and_updated(self):
+        for storage in ('rows', 'columns'):
+            with self.subTest(storage=storage):
+                table = _create_table([['a', '1'], ['b']], self.col_defs, storage=storage)
+                table.col_defs = self.col_defs + [{'name': 'extra', 'type': 'number'}]
+                self.assertEqual(table.select(['extra']), [{'extra': None}, {'extra': None}])
+                table.update({'extra': 2}, [sdk.WhereCondition('name', 'b')])
+                self.assertEqual(table.select(['name', 'extra']),
+                                 [{'name': 'a', 'extra': None}, {'name': 'b', 'extra': 2.0}])
+
+    def test_changed_column_type_converts_values(self):
+        for storage in ('rows', 'columns'):
+            with self.subTest(storage=storage):
+                table = _create_table([['a', '1']], self.col_defs, storage=storage)
+                table.col_defs = [{'name': 'name', 'type': 'string'}, {'name': 'score', 'type': 'string'}]
+                self.assertIsInstance(table.select(['score'])[0]['score'], str)
+
+    def test_invalid_col_defs_leave_table_unchanged(self):
+        for storage in ('rows', 'columns'):
+            table = _create_table([['a', '1'], ['b', '2']], self.col_defs, storage=storage)
+            table.create_index('score', 'sorted')
+            for col_defs in ([{'name': 'name', 'type': 'string', 'index': 'unknown'}, self.col_defs[1]],
+                             [{'name': 'name', 'type': 'json', 'index': 'sorted'}, self.col_defs[1]],
+                             [{'name': 'name', 'type': 'number', 'index': 'sorted'}, self.col_defs[1]]):
+                with self.subTest(storage=storage, col_defs=col_defs):
+                    with self.assertRaises(ValueError):
+                        table.col_defs = col_defs
+                    self.assertEqual(table.col_defs, self.col_defs)
+                    self.assertEqual(table.select(['name'], [sdk.WhereCondition('score', 2)]), [{'name': 'b'}])
+                    self.assertTrue(table.explain([sdk.WhereCondition('score', 2)])['index_lookups'])
+
+    def test_changed_column_type_rebuilds_index(self):
+        table = _create_table([['1', 'x'], ['2', 'y']], [{'name': 'id', 'type': 'string', 'index': 'hash'},
+                                                         {'name': 'name', 'type': 'string'}])
+        table.col_defs = [{'name': 'id', 'type': 'number', 'index': 'sorted'}, {'name': 'name', 'type': 'string'}]
+        self.assertEqual(table.select(['name'], [sdk.WhereCondition('id', 1.5, '>')]), [{'name': 'y'}])
+
+
+class TableValueCacheTest(TestCase):
+    col_defs = [{'name': 'data', 'type': 'json'}]
+
+    def test_selected_json_values_are_not_shared_by_default(self):
+        table = _create_table([['{"a": [1]}']], self.col_defs, storage='rows')
+        table.select(['data'])[0]['data']['a'].append(2)
+        self.assertEqual(table.select(['data']), [{'data': {'a': [1]}}])
+
+    def test_cached_json_values_are_invalidated_by_update(self):
+        table = _create_table([['{"a": 1}']], self.col_defs, storage='rows', value_cache_size=10)
+        self.assertEqual(table.select(['data']), [{'data': {'a': 1}}])
+        table.update({'data': '{"a": 2}'}, [])
+        self.assertEqual(table.select(['data']), [{'data': {'a': 2}}])
+
+
+class TablePlannerTest(TestCase):
+    col_defs = [{'name': 'name', 'type': 'string', 'index': 'hash'}, {'name': 'score', 'type': 'number'},
+                {'name': 'rank', 'type': 'number'}]
+
+    def setUp(self):
+        self.table = _create_table([['n{}'.format(i % 10), str(i), str(i % 7)] for i in range(1000)], self.col_defs)
+
+    def test_limit_does_not_compute_statistics(self):
+        where_conditions = [sdk.WhereCondition('score', 10, '>'), sdk.WhereCondition('rank', 0)]
+        rows = self.table.select(['score'], where_conditions, limit=2)
+        self.assertEqual(rows, [{'score': 14.0}, {'score': 21.0}])
+        self.assertEqual(self.table._col_stats, {})
+
+    def test_index_is_used_for_indexed_condition(self):
+        description = self.table.explain([sdk.WhereCondition('name', 'n3'), sdk.WhereCondition('score', 500, '<')])
+        self.assertEqual([lookup['num_rows'] for lookup in description['index_lookups']], [100])
+        self.assertEqual(description['scan'], 'index')
+        self.assertEqual(len(description['scan_conditions']), 1)
+
+
+@mock.patch.object(google_services, 'commit_changes', return_value=({}, None))
+class TableIndexTest(TestCase):
+    col_defs = [{'name': 'id', 'type': 'number'}, {'name': 'name', 'type': 'string'}]
+    rows = [[str(i), 'n{}'.format(i % 3)] for i in range(10)]
+
+    def _create_tables(self):
+        indexed_table = _create_table(self.rows, self.col_defs)
+        indexed_table.create_index('id', 'sorted')
+        indexed_table.create_index('name', 'hash')
+        return indexed_table, _create_table(self.rows, self.col_defs)
+
+    def _assert_same_rows(self, indexed_table, table):
+        for where_conditions in ([sdk.WhereCondition('id', 2)], [sdk.WhereCondition('id', 5, '>=')],
+                                 [sdk.WhereCondition('name', 'n1')], [sdk.WhereCondition('name', 'new')]):
+            self.assertTrue(indexed_table.explain(where_conditions)['index_lookups'])
+            self.assertEqual(indexed_table.select(['id', 'name'], where_conditions),
+                             table.select(['id', 'name'], where_conditions))
+
+    def test_indexes_follow_update_delete_insert_and_commit(self, commit_changes):
+        tables = self._create_tables()
+        for table in tables:
+            table.update({'name': 'new', 'id': 20}, [sdk.WhereCondition('id', 2)])
+            table.delete([sdk.WhereCondition('name', 'n1')])
+            table.insert({'id': 2, 'name': 'n1'})
+        self._assert_same_rows(*tables)
+        for table in tables:
+            table.commit()
+        self._assert_same_rows(*tables)
+        tables[0].update({'id': 6}, [sdk.WhereCondition('id', 5, '>=')])
+        tables[1].update({'id': 6}, [sdk.WhereCondition('id', 5, '>=')])
+        self._assert_same_rows(*tables)
+
+    def test_value_of_other_type_gives_same_result_as_scan(self, commit_changes):
+        indexed_table, table = self._create_tables()
+
+        def select(table, where_conditions):
+            try:
+                return table.select(['id'], where_conditions)
+            except TypeError:
+                return TypeError
+
+        for where_conditions in ([sdk.WhereCondition('id', '2')], [sdk.In('id', ['2', 3])],
+                                 [sdk.WhereCondition('id', '2', '>')], [sdk.Between('id', '2', '5')]):
+            with self.subTest(where_conditions=where_conditions):
+                self.assertEqual(select(indexed_table, where_conditions), select(table, where_conditions))
+
+    def test_update_with_value_that_cannot_be_converted_changes_nothing(self, commit_changes):
+        indexed_table, table = self._create_tables()
+        with self.assertRaises(ValueError):
+            indexed_table.update({'name': 'changed', 'id': 'abc'}, [sdk.WhereCondition('id', 2)])
+        self._assert_same_rows(indexed_table, table)
+        self.assertEqual(indexed_table.updated_initial_row_indexes, {})
+
+
+class CommitRequestsTest(TestCase):
+
+    def test_rows_with_continuous_indexes_and_same_columns_are_combined(self):
+        rows_data = [
+            {'index': 3, 'start_col_index': 1, 'values': ['c', None]},
+            {'index': 1, 'start_col_index': 1, 'values': ['a', 1]},
+            {'index': 2, 'start_col_index': 1, 'values': ['b', 2]},
+            {'index': 2, 'values': ['x']},
+        ]
+        self.assertEqual(google_services._combine_rows_data(rows_data), [
+            (2, 0, [['x']]),
+            (1, 1, [['a', 1], ['b', 2], ['c', '']]),
+        ])
+
+    def test_value_ranges_are_split_by_number_of_cells(self):
+        value_ranges = [{'values': [[1, 2]] * 2}, {'values': [[1]]}, {'values': [[1, 2]] * 3}]
+        self.assertEqual(google_services._split_value_ranges(value_ranges, 5),
+                         [value_ranges[:2], value_ranges[2:]])
+
+    @mock.patch.object(configs, 'UPDATE_MAX_CELLS_PER_REQUEST', 6)
+    def test_range_larger_than_maximum_is_split_by_rows(self):
+        with mock.patch.object(google_services, '_build_sheets_service'), \
+                mock.patch.object(google_services, '_execute_request', return_value=({}, None)):
+            google_services.update_rows(mock.Mock(pk=1), 'spreadsheet',
+                                        [{'index': i, 'values': [i, i]} for i in range(5)])
+            batch_update = google_services._build_sheets_service.return_value.spreadsheets().values().batchUpdate
+            data = [call[1]['body']['data'] for call in batch_update.call_args_list]
+
+        self.assertEqual([[(value_range['range'], value_range['values']) for value_range in batch] for batch in data], [
+            [('A1:B3', [[0, 0], [1, 1], [2, 2]])],
+            [('A4:B5', [[3, 3], [4, 4]])],
+        ])
+
+    def test_commit_is_sent_as_updates_then_deletes_from_bottom_then_appends(self):
+        with mock.patch.object(google_services, '_build_sheets_service'), \
+                mock.patch.object(google_services, '_execute_request', return_value=({}, None)):
+            google_services.commit_changes(
+                mock.Mock(pk=1), 'spreadsheet', [{'index': 0, 'start_col_index': 1, 'values': [True, 1.5, None]}],
+                {1, 2, 5}, [['a', '']])
+            service = google_services._build_sheets_service.return_value
+            request_body = service.spreadsheets.return_value.batchUpdate.call_args[1]['body']
+
+        self.assertEqual(request_body['requests'], [
+            {'updateCells': {
+                'start': {'sheetId': 0, 'rowIndex': 0, 'columnIndex': 1},
+                'rows': [{'values': [{'userEnteredValue': {'boolValue': True}},
+                                     {'userEnteredValue': {'numberValue': 1.5}}, {}]}],
+                'fields': 'userEnteredValue',
+            }},
+            {'deleteDimension': {'range': {'sheetId': 0, 'dimension': 'ROWS', 'startIndex': 5, 'endIndex': 6}}},
+            {'deleteDimension': {'range': {'sheetId': 0, 'dimension': 'ROWS', 'startIndex': 1, 'endIndex': 3}}},
+            {'appendCells': {
+                'sheetId': 0,
+                'rows': [{'values': [{'userEnteredValue': {'stringValue': 'a'}}, {}]}],
+                'fields': 'userEnteredValue',
+            }},
+        ])
+
+    @mock.patch.object(configs, 'UPDATE_MAX_CELLS_PER_REQUEST', 4)
+    def test_commit_larger_than_maximum_is_split_in_order(self):
+        with mock.patch.object(google_services, '_build_sheets_service'), \
+                mock.patch.object(google_services, '_execute_request', return_value=({'replies': [{}]}, None)):
+            response, error_status = google_services.commit_changes(
+                mock.Mock(pk=1), 'spreadsheet', [{'index': i, 'values': [i, i]} for i in range(3)], {0, 5, 7},
+                [['a'], ['b'], ['c'], ['d'], ['e']])
+            batch_update = google_services._build_sheets_service.return_value.spreadsheets().batchUpdate
+            batches = [call[1]['body']['requests'] for call in batch_update.call_args_list]
+
+        def describe(request):
+            kind, body = next(iter(request.items()))
+            if kind == 'updateCells':
+                return kind, body['start']['rowIndex'], len(body['rows'])
+            if kind == 'appendCells':
+                return kind, len(body['rows'])
+            return kind, body['range']['startIndex']
+
+        self.assertEqual([[describe(request) for request in batch] for batch in batches], [
+            [('updateCells', 0, 2)],
+            [('updateCells', 2, 1), ('deleteDimension', 7), ('deleteDimension', 5), ('deleteDimension', 0)],
+            [('appendCells', 4)],
+            [('appendCells', 1)],
+        ])
+        self.assertEqual((len(response['replies']), error_status), (4, None))
+
+    def test_empty_commit_sends_no_request(self):
+        with mock.patch.object(google_services, '_execute_request') as execute_request:
+            self.assertEqual(google_services.commit_changes(mock.Mock(pk=1), 'spreadsheet', [], set(), []),
+                             (None, None))
+        execute_request.assert_not_called()
+
+
+class WriteBehindTest(TestCase):
+    col_defs = [{'name': 'id', 'type': 'number'}]
+
+    def setUp(self):
+        patcher = mock.patch.object(write_behind, '_worker', write_behind.WriteBehindWorker(10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.table = _create_table([[str(i)] for i in range(5)], self.col_defs, write_behind=True)
+
+    def _delete_and_commit(self, row_id):
+        self.table.delete([sdk.WhereCondition('id', row_id)])
+        return self.table.commit()
+
+    @mock.patch.object(google_services, 'commit_many_changes', return_value=(None, 500))
+    def test_table_cannot_commit_after_failed_commit(self, commit_many_changes):
+        with self.assertRaises(write_behind.WriteBehindError) as context:
+            self._delete_and_commit(1).wait(5)
+        self.assertEqual(context.exception.error_status, 500)
+        with self.assertRaises(sdk.SheetsdbSDKError):
+            self._delete_and_commit(2)
+        self.assertEqual(commit_many_changes.call_count, 1)
+
+    def test_commit_queued_after_failed_commit_is_not_written(self):
+        started, release = threading.Event(), threading.Event()
+
+        def commit_many_changes(user, spreadsheet_id, changes):
+            started.set()
+            release.wait(5)
+            return None, 500
+
+        with mock.patch.object(google_services, 'commit_many_changes', side_effect=commit_many_changes) as mocked:
+            handle = self._delete_and_commit(1)
+            self.assertTrue(started.wait(5))
+            next_handle = self._delete_and_commit(2)
+            release.set()
+            self.assertTrue(write_behind.flush(5))
+        self.assertEqual(mocked.call_count, 1)
+        self.assertEqual(handle.error().error_status, 500)
+        self.assertEqual(next_handle.error().error_status, 500)
+
+
+    @mock.patch.object(google_services, 'get_columns_values', return_value=({'majorDimension': 'ROWS'}, None))
+    def test_table_is_read_after_queued_commits_to_its_spreadsheet(self, get_columns_values):
+        release = threading.Event()
+
+        def commit_many_changes(user, spreadsheet_id, changes):
+            release.wait(5)
+            return {}, None
+
+        with mock.patch.object(google_services, 'commit_many_changes', side_effect=commit_many_changes):
+            handle = self._delete_and_commit(1)
+            self.assertTrue(write_behind.flush(0, 'other'))
+            self.assertFalse(write_behind.flush(0.01, 'spreadsheet'))
+            reader = threading.Thread(
+                target=sdk.SheetsdbSDK(self.table.user, {'spreadsheetId': 'meta'})._get_value_range,
+                args=('spreadsheet', self.col_defs))
+            reader.start()
+            reader.join(0.05)
+            self.assertFalse(get_columns_values.called)
+            release.set()
+            reader.join(5)
+        self.assertTrue(handle.done())
+        self.assertTrue(get_columns_values.called)
+
+
+class ExecuteRequestTest(TestCase):
+
+    def setUp(self):
+        for target, name, value in [(configs, 'RETRY_BASE_DELAY', 0.001), (configs, 'RETRY_MAX_ATTEMPTS', 3),
+                                    (google_services, '_rate_limiter', RateLimiter(None, None))]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _execute(self, method, errors, **kwargs):
+        api_request = mock.Mock(uri='https://sheets.googleapis.com/v4/spreadsheets/spreadsheet', method=method)
+        api_request.execute.side_effect = errors + [{}]
+        with mock.patch.object(google_services, '_execute_attempt', side_effect=lambda request: request.execute()):
+            response = google_services._execute_request(mock.Mock(pk=1), api_request, **kwargs)
+        return response, api_request.execute.call_count
+
+    @staticmethod
+    def _http_error(status):
+        return HttpError(httplib2.Response({'status': status}), b'{}')
+
+    def test_read_request_is_retried(self):
+        self.assertEqual(self._execute('GET', [self._http_error(503), ConnectionResetError()]), (({}, None), 3))
+
+    def test_idempotent_write_request_is_retried(self):
+        self.assertEqual(self._execute('POST', [self._http_error(500)], idempotent=True), (({}, None), 2))
+
+    def test_write_request_is_not_retried_after_server_error(self):
+        self.assertEqual(self._execute('POST', [self._http_error(500)]), ((None, 500), 1))
+        with self.assertRaises(ConnectionResetError):
+            self._execute('POST', [ConnectionResetError()])
+
+    def test_write_request_is_retried_when_not_applied(self):
+        self.assertEqual(self._execute('POST', [self._http_error(429), ConnectionRefusedError()]), (({}, None), 3))
+
+    def test_request_is_not_retried_after_client_error(self):
+        self.assertEqual(self._execute('GET', [self._http_error(400)]), ((None, 400), 1))
+
+
+class TableInsertTest(TestCase):
+    col_defs = [{'name': 'id', 'type': 'number', 'index': 'sorted'}, {'name': 'name', 'type': 'string'}]
+
+    def _assert_rows(self, table, ids):
+        self.assertEqual([row['id'] for row in table.select(['id'])], ids)
+        self.assertEqual([row['id'] for row in table.select(['id'], [sdk.WhereCondition('id', 0, '>=')])], ids)
+        self.assertEqual(table._num_rows, len(ids))
+
+    def test_insert_many_with_value_that_cannot_be_converted_inserts_nothing(self):
+        for storage in ('rows', 'columns'):
+            with self.subTest(storage=storage):
+                table = _create_table([['0', 'a']], self.col_defs, storage=storage)
+                with self.assertRaises(ValueError):
+                    table.insert_many([[1, 'b'], {'id': 'abc'}])
+                self._assert_rows(table, [0.0])
+
+    def test_insert_with_value_that_cannot_be_converted_inserts_nothing(self):
+        table = _create_table([['0', 'a']], self.col_defs, storage='rows')
+        with self.assertRaises(ValueError):
+            table.insert({'id': 'abc', 'name': 'b'})
+        self._assert_rows(table, [0.0])
+
+    def test_insert_many_rejects_string_row(self):
+        table = _create_table([], self.col_defs)
+        with self.assertRaises(TypeError):
+            table.insert_many(['ab'])
+        self._assert_rows(table, [])
+
+
+class TableQueryTest(TestCase):
+    col_defs = [{'name': 'id', 'type': 'number'}, {'name': 'name', 'type': 'string'},
+                {'name': 'score', 'type': 'number'}]
+    # Scores of ids 0 to 9: None, 3, 6, 2, None, 1, 4, 0, None, 6
+    rows = [[str(i), 'n{}'.format(i % 3), '' if i % 4 == 0 else str(i * 10 % 7)] for i in range(10)]
+
+    def setUp(self):
+        self.table = _create_table(self.rows, self.col_defs)
+        self.indexed_table = _create_table(self.rows, self.col_defs)
+        self.indexed_table.create_index('name', 'hash')
+        self.indexed_table.create_index('score', 'sorted')
+
+    def _select_ids(self, table, where_conditions=list(), **kwargs):
+        return [int(row['id']) for row in table.select(['id'], where_conditions, **kwargs)]
+
+    def test_order_by_puts_empty_values_last_in_both_orders(self):
+        for table in (self.table, self.indexed_table):
+            self.assertEqual(self._select_ids(table, order_by=['score']), [7, 5, 3, 1, 6, 2, 9, 0, 4, 8])
+            self.assertEqual(self._select_ids(table, order_by=['-score']), [2, 9, 6, 1, 3, 5, 7, 0, 4, 8])
+        self.assertEqual(self.table.explain(order_by=['score'])['order'], 'sort')
+        self.assertEqual(self.indexed_table.explain(order_by=['score'])['order'], 'index')
+
+    def test_order_by_many_columns(self):
+        self.assertEqual(self._select_ids(self.table, order_by=['name', '-id']), [9, 6, 3, 0, 7, 4, 1, 8, 5, 2])
+
+    def test_order_by_with_limit_and_offset_keeps_top_rows(self):
+        self.assertEqual(self.table.explain(order_by=['score', 'id'], limit=3)['order'], 'top-k')
+        self.assertEqual(self._select_ids(self.table, order_by=['score', 'id'], limit=3, offset=2), [3, 1, 6])
+        self.assertEqual(self._select_ids(self.table, order_by=['-score'], limit=3, offset=6), [7, 0, 4])
+        self.assertEqual(self._select_ids(self.indexed_table, order_by=['-score'], limit=3, offset=6), [7, 0, 4])
+        self.assertEqual(self._select_ids(self.table, [sdk.WhereCondition('name', 'n0')], order_by=['-score'],
+                                          limit=2), [9, 6])
+
+    def test_aggregate_ignores_empty_values(self):
+        self.assertEqual(self.table.aggregate({'count': aggregates.Count(), 'scores': aggregates.Count('score'),
+                                               'min': aggregates.Min('score'), 'max': aggregates.Max('score')}),
+                         {'count': 10, 'scores': 7, 'min': 0.0, 'max': 6.0})
+        self.assertEqual(self.indexed_table.aggregate({'count': aggregates.Count()},
+                                                      [sdk.WhereCondition('score', 3, '>=')]), {'count': 4})
+
+    def test_aggregate_with_group_by(self):
+        results = self.table.aggregate({'count': aggregates.Count(), 'total': aggregates.Sum('score'),
+                                        'avg': aggregates.Avg('score')}, group_by=['name'])
+        self.assertEqual(results, [
+            {'name': 'n0', 'count': 4, 'total': 12.0, 'avg': 4.0},
+            {'name': 'n1', 'count': 3, 'total': 3.0, 'avg': 1.5},
+            {'name': 'n2', 'count': 3, 'total': 7.0, 'avg': 3.5},
+        ])
+
+    def test_conditions_give_result_of_plain_scan(self):
+        names = {i: 'n{}'.format(i % 3) for i in range(10)}
+        scores = {i: None if i % 4 == 0 else float(i * 10 % 7) for i in range(10)}
+        for condition, passes in [
+            (sdk.Or(sdk.WhereCondition('name', 'n1'), sdk.WhereCondition('score', 5, '>')),
+             lambda i: names[i] == 'n1' or (scores[i] is not None and scores[i] > 5)),
+            (sdk.In('name', ['n0', 'n2']), lambda i: names[i] in ('n0', 'n2')),
+            (sdk.In('score', [1, 6]), lambda i: scores[i] in (1, 6)),
+            (sdk.Not(sdk.WhereCondition('name', 'n0')), lambda i: names[i] != 'n0'),
+            (sdk.Between('score', 2, 4), lambda i: scores[i] is not None and 2 <= scores[i] <= 4),
+            (sdk.StartsWith('name', 'n1'), lambda i: names[i].startswith('n1')),
+            (sdk.And(sdk.In('name', ['n1', 'n2']), sdk.Not(sdk.Between('score', 1, 3))),
+             lambda i: names[i] in ('n1', 'n2') and not (scores[i] is not None and 1 <= scores[i] <= 3)),
+        ]:
+            with self.subTest(condition=condition):
+                expected_ids = [i for i in range(10) if passes(i)]
+                self.assertEqual(self._select_ids(self.table, [condition]), expected_ids)
+                self.assertEqual(self._select_ids(self.indexed_table, [condition]), expected_ids)
+
+    def test_indexes_answer_conditions(self):
+        for condition in (sdk.In('name', ['n0', 'n2']), sdk.Between('score', 2, 4),
+                          sdk.Or(sdk.WhereCondition('name', 'n1'), sdk.WhereCondition('score', 5, '>'))):
+            with self.subTest(condition=condition):
+                self.assertEqual(self.indexed_table.explain([condition])['scan'], 'index')
+
+
+class TableUpsertTest(TestCase):
+    col_defs = [{'name': 'id', 'type': 'number'}, {'name': 'name', 'type': 'string'}]
+    rows = [['1', 'a'], ['2', 'b']]
+
+    def _upsert(self, table, key_cols, commit=False):
+        return table.upsert([{'id': 2, 'name': 'c'}, {'id': 3, 'name': 'd'}, {'id': 3, 'name': 'e'}], key_cols,
+                            commit=commit)
+
+    def _assert_rows(self, table):
+        self.assertEqual(table.select(['id', 'name']),
+                         [{'id': 1.0, 'name': 'a'}, {'id': 2.0, 'name': 'c'}, {'id': 3.0, 'name': 'e'}])
+        for condition, ids in ((sdk.WhereCondition('id', 2), [2.0]), (sdk.WhereCondition('id', 3), [3.0]),
+                               (sdk.WhereCondition('name', 'b'), []), (sdk.WhereCondition('name', 'e'), [3.0]),
+                               (sdk.WhereCondition('name', 'd'), [])):
+            self.assertEqual([row['id'] for row in table.select(['id'], [condition])], ids)
+
+    def test_upsert_updates_and_inserts_by_indexed_key(self):
+        table = _create_table(self.rows, self.col_defs)
+        table.create_index('id', 'sorted')
+        table.create_index('name', 'hash')
+        self.assertEqual(self._upsert(table, ['id']), (2, 1))
+        self._assert_rows(table)
+        self.assertTrue(table.explain([sdk.WhereCondition('name', 'e')])['index_lookups'])
+        self.assertEqual(table.updated_initial_row_indexes, {1: {1}})
+
+    def test_upsert_updates_and_inserts_by_key_without_index(self):
+        table = _create_table(self.rows, self.col_defs)
+        self.assertEqual(self._upsert(table, ['id']), (2, 1))
+        self._assert_rows(table)
 
-# Create your tests here.
+    @mock.patch.object(google_services, 'commit_changes', return_value=({}, None))
+    def test_upsert_commits_changes(self, commit_changes):
+        table = _create_table(self.rows, self.col_defs)
+        self._upsert(table, ['id'], commit=True)
+        self.assertEqual(commit_changes.call_args[0][2:], ([{'index': 1, 'start_col_index': 1, 'values': ['c']}],
+                                                           set(), [[3, 'e']]))
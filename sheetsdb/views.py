@@ -7,7 +7,7 @@ from django.views.decorators.http import require_http_methods
 
 from . import configs
 from .configs import UPDATE_META_SPREADSHEET_ID_TEMPLATE
-from .decorators import require_sheetsdb_sdk
+from .decorators import require_sheetsdb_sdk, invalidate_meta_spreadsheet_cache
 from .models import SheetsMetaInfoForm
 
 logger = logging.getLogger(__name__)
@@ -45,6 +45,7 @@ def update_meta_spreadsheet_id(request):
         sheets_meta_info = form.save(commit=False)
         sheets_meta_info.user = request.user
         sheets_meta_info.save()
+        invalidate_meta_spreadsheet_cache(request.user)
         next_url = request.GET.get('next')
         if next_url is not None:
             return redirect(next_url)
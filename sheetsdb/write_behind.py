@@ -0,0 +1,355 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import Counter, OrderedDict
+
+from . import configs, google_services
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueueFull(Exception):
+    """
+    Error raised when a commit cannot be queued in time because too many commits are pending
+    """
+
+
+class WriteBehindError(Exception):
+    """
+    Error raised when waiting for a queued commit that fails
+    """
+
+    def __init__(self, message, error_status=None):
+        """
+        :type message: str
+        :param message: Error message
+        :type error_status: int
+        :param error_status: Error status of Sheets API. None if commit fails for another reason.
+        """
+
+        super().__init__(message)
+        self.error_status = error_status
+
+
+class CommitHandle:
+    """
+    Handle of a commit, to wait until its changes are written to Google Sheets.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._error = None
+
+    @classmethod
+    def completed(cls):
+        """
+        :rtype: CommitHandle
+        :return: Handle of a commit that is already written
+        """
+
+        handle = cls()
+        handle._set_result(None)
+        return handle
+
+    def _set_result(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        """
+        :rtype: bool
+        :return: Whether commit is written or has failed
+        """
+
+        return self._done.is_set()
+
+    def error(self):
+        """
+        :rtype: WriteBehindError
+        :return: Error of failed commit. None if commit is not done or is written.
+        """
+
+        return self._error
+
+    def wait(self, timeout=None):
+        """
+        Wait until commit is written to Google Sheets.
+
+        :type timeout: float
+        :param timeout: Seconds to wait. None waits indefinitely.
+        :rtype: bool
+        :return: True if commit is written, False if it is still pending after timeout
+        """
+
+        if not self._done.wait(timeout):
+            return False
+        if self._error is not None:
+            raise self._error
+        return True
+
+
+class WriteBehindWorker:
+    """
+    Background thread that writes queued commits of tables to Google Sheets, so that committing does not wait for
+    Sheets API.
+
+    Commits are written in the order they are queued. Consecutive commits to the same spreadsheet by the same user
+    that are pending together are written in a single atomic Sheets API request, unless they write more than
+    `SHEETSDB_UPDATE_MAX_CELLS_PER_REQUEST` cells. See `google_services.commit_many_changes`.
+    If a commit fails, later commits to the same spreadsheet in the same request also fail,
+    as they are made on top of it. A commit queued with the handle of a previous commit of the same table also fails
+    without being written if the previous commit fails, as its row indexes assume the previous commit is written.
+    """
+
+    def __init__(self, max_pending, queue_timeout=None, max_batch_size=50, shutdown_timeout=None):
+        """
+        :type max_pending: int
+        :param max_pending: Maximum number of commits pending. Queuing more commits waits for pending ones.
+        :type queue_timeout: float
+        :param queue_timeout: Seconds to wait to queue a commit when too many commits are pending.
+            None waits indefinitely.
+        :type max_batch_size: int
+        :param max_batch_size: Maximum number of commits written in a single Sheets API request
+        :type shutdown_timeout: float
+        :param shutdown_timeout: Seconds to wait for pending commits to be written when process exits.
+            None waits indefinitely.
+        """
+
+        if max_pending < 1:
+            raise ValueError('max_pending must be at least 1')
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.max_batch_size = max_batch_size
+        self.shutdown_timeout = shutdown_timeout
+        self._lock = threading.Lock()
+        self._reset()
+        atexit.register(self._shutdown)
+
+    def _reset(self):
+        self._queue = queue.Queue(self.max_pending)
+        self._thread = None
+        # Number of commits queued but not written, to wait for in `flush`
+        self._num_unfinished = 0
+        # Number of commits queued but not written per spreadsheet ID, to wait for in `flush` of a spreadsheet
+        self._num_unfinished_by_spreadsheet = Counter()
+        self._all_finished = threading.Condition(self._lock)
+        self._pid = os.getpid()
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so a forked worker process starts its own thread with an empty queue
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sheetsdb-write-behind', daemon=True)
+                self._thread.start()
+
+    def submit(self, user, spreadsheet_id, updated_rows_data, deleted_row_indexes_set, inserted_rows_data,
+               previous_handle=None):
+        """
+        Queue changes to be committed, in the form of the arguments of `google_services.commit_changes`.
+        Changes must not be modified after they are queued.
+
+        :type user: django.contrib.auth.models.User
+        :param user: User of spreadsheet
+        :type spreadsheet_id: str
+        :param spreadsheet_id: Spreadsheet ID of spreadsheet to commit changes to
+        :type updated_rows_data: list[dict]
+        :param updated_rows_data: Rows to update
+        :type deleted_row_indexes_set: set
+        :param deleted_row_indexes_set: Set of 0-based row indexes to delete
+        :type inserted_rows_data: list[list]
+        :param inserted_rows_data: Rows to append
+        :type previous_handle: CommitHandle
+        :param previous_handle: Handle of previous commit that changes are made on top of.
+            Changes are not written if it fails.
+        :rtype: CommitHandle
+        :return: Handle to wait for commit
+        """
+
+        self._ensure_started()
+        handle = CommitHandle()
+        with self._lock:
+            self._num_unfinished += 1
+            self._num_unfinished_by_spreadsheet[spreadsheet_id] += 1
+        try:
+            self._queue.put((user, spreadsheet_id, (updated_rows_data, deleted_row_indexes_set, inserted_rows_data),
+                             handle, previous_handle), timeout=self.queue_timeout)
+        except queue.Full:
+            self._finish([spreadsheet_id])
+            raise WriteBehindQueueFull('{} commits still pending after {} seconds'.format(
+                self.max_pending, self.queue_timeout))
+        return handle
+
+    def flush(self, timeout=None, spreadsheet_id=None):
+        """
+        Wait until all commits queued so far are written or have failed.
+
+        :type timeout: float
+        :param timeout: Seconds to wait. None waits indefinitely.
+        :type spreadsheet_id: str
+        :param spreadsheet_id: Spreadsheet ID to only wait for the commits to. None waits for commits to all
+            spreadsheets.
+        :rtype: bool
+        :return: True if all commits are done, False if some are still pending after timeout
+        """
+
+        if spreadsheet_id is None:
+            is_finished = lambda: self._num_unfinished == 0
+        else:
+            is_finished = lambda: self._num_unfinished_by_spreadsheet[spreadsheet_id] == 0
+        with self._all_finished:
+            if self._pid != os.getpid():
+                # Commits queued before a fork are not written by this process
+                return True
+            return self._all_finished.wait_for(is_finished, timeout)
+
+    def _finish(self, spreadsheet_ids):
+        """
+        :type spreadsheet_ids: list[str]
+        :param spreadsheet_ids: Spreadsheet IDs of commits that are done
+        """
+
+        with self._all_finished:
+            self._num_unfinished -= len(spreadsheet_ids)
+            for spreadsheet_id in spreadsheet_ids:
+                self._num_unfinished_by_spreadsheet[spreadsheet_id] -= 1
+                if self._num_unfinished_by_spreadsheet[spreadsheet_id] == 0:
+                    del self._num_unfinished_by_spreadsheet[spreadsheet_id]
+            self._all_finished.notify_all()
+
+    def _shutdown(self):
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        if not self.flush(self.shutdown_timeout):
+            logger.error('{} commits are not written to Google Sheets when process exits'.format(
+                self._num_unfinished))
+
+    def _run(self):
+        while True:
+            commits = [self._queue.get()]
+            # Take the other pending commits to write them together
+            while len(commits) < self.max_batch_size:
+                try:
+                    commits.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(commits)
+            except Exception as e:
+                logger.exception('Error when writing commits')
+                for commit in commits:
+                    if not commit[3].done():
+                        commit[3]._set_result(WriteBehindError('Error when writing commits: {}'.format(e)))
+            finally:
+                self._finish([commit[1] for commit in commits])
+
+    def _write(self, commits):
+        """
+        Write commits taken from queue, grouped by spreadsheet.
+
+        :type commits: list[tuple]
+        :param commits: List of tuples of (user, spreadsheet ID, changes, handle, previous handle),
+            in the order they are queued
+        """
+
+        commits_by_spreadsheet = OrderedDict()
+        for commit in commits:
+            # Previous commit is written before, unless it is pending in the same batch and fails with this one
+            previous_error = commit[4].error() if commit[4] is not None else None
+            if previous_error is not None:
+                commit[3]._set_result(WriteBehindError('Previous commit of table failed: {}'.format(previous_error),
+                                                       previous_error.error_status))
+                continue
+            commits_by_spreadsheet.setdefault(commit[1], []).append(commit)
+
+        for spreadsheet_id, spreadsheet_commits in commits_by_spreadsheet.items():
+            error = None
+            # Commits by different users are written in separate requests, with the credentials of their user
+            for i, j in _split_runs(spreadsheet_commits, lambda commit: commit[0]):
+                run = spreadsheet_commits[i:j]
+                if error is None:
+                    error = self._write_run(run[0][0], spreadsheet_id, [commit[2] for commit in run])
+                for commit in run:
+                    commit[3]._set_result(error)
+
+    def _write_run(self, user, spreadsheet_id, changes):
+        """
+        :type user: django.contrib.auth.models.User
+        :param user: User of spreadsheet
+        :type spreadsheet_id: str
+        :param spreadsheet_id: Spreadsheet ID of spreadsheet to commit changes to
+        :type changes: list[tuple]
+        :param changes: Changes of commits, in the form of changes of `google_services.commit_many_changes`
+        :rtype: WriteBehindError
+        :return: Error if commits fail, None otherwise
+        """
+
+        try:
+            response, error_status = google_services.commit_many_changes(user, spreadsheet_id, changes)
+        except Exception as e:
+            logger.exception('Error when committing changes to spreadsheet {}'.format(spreadsheet_id))
+            return WriteBehindError('Error when committing changes: {}'.format(e))
+        if error_status is not None:
+            logger.error('Sheets API error {} when committing {} changes to spreadsheet {}'.format(
+                error_status, len(changes), spreadsheet_id))
+            return WriteBehindError('Sheets API error {} when committing changes'.format(error_status), error_status)
+        return None
+
+
+_worker = WriteBehindWorker(configs.WRITE_BEHIND_MAX_PENDING, configs.WRITE_BEHIND_QUEUE_TIMEOUT,
+                            configs.WRITE_BEHIND_MAX_BATCH_SIZE, configs.WRITE_BEHIND_SHUTDOWN_TIMEOUT)
+
+
+def submit(user, spreadsheet_id, updated_rows_data, deleted_row_indexes_set, inserted_rows_data,
+           previous_handle=None):
+    """
+    Queue changes to be committed by the write-behind worker of process. See `WriteBehindWorker.submit`.
+
+    :rtype: CommitHandle
+    :return: Handle to wait for commit
+    """
+
+    return _worker.submit(user, spreadsheet_id, updated_rows_data, deleted_row_indexes_set, inserted_rows_data,
+                          previous_handle)
+
+
+def flush(timeout=None, spreadsheet_id=None):
+    """
+    Wait until all commits queued so far in process are written or have failed. See `WriteBehindWorker.flush`.
+
+    :type timeout: float
+    :param timeout: Seconds to wait. None waits indefinitely.
+    :type spreadsheet_id: str
+    :param spreadsheet_id: Spreadsheet ID to only wait for the commits to. None waits for commits to all spreadsheets.
+    :rtype: bool
+    :return: True if all commits are done, False if some are still pending after timeout
+    """
+
+    return _worker.flush(timeout, spreadsheet_id)
+
+
+def _split_runs(items, key):
+    """
+    Split items into runs of consecutive items with the same key
+
+    :type items: list
+    :param items: Items to split
+    :type key: function
+    :param key: Function that takes an item and returns its key
+    :rtype: list[tuple]
+    :return: List of tuples of (start index, end index exclusive) of runs
+    """
+
+    runs = []
+    start = 0
+    for i in range(1, len(items) + 1):
+        if i == len(items) or key(items[i]) != key(items[start]):
+            runs.append((start, i))
+            start = i
+    return runs